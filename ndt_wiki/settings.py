@@ -4,6 +4,7 @@ Django settings for ndt_wiki project.
 Generated by 'django-admin startproject' using Django 5.1.7.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,12 +36,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wiki.timing.ServerTimingMiddleware',   # first: it times everything below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'wiki.revisions.RevisionAuthorMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -48,7 +51,8 @@ ROOT_URLCONF = 'ndt_wiki.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, with render times for wiki.timing
+        'BACKEND': 'wiki.timing.DjangoTemplates',
         'DIRS': [],  # Add any directories for templates if needed
         'APP_DIRS': True,
         'OPTIONS': {
@@ -119,6 +123,86 @@ STATICFILES_DIRS = [
     BASE_DIR / "wiki" / "static",  # This points to: ndt_wiki/wiki/static
 ]
 
+# Cache (rendered wiki pages, see wiki/cache.py). Per-process memory is
+# enough for one server; point this at memcached/redis when running several.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ndt-wiki',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+WIKI_PAGE_CACHE_TIMEOUT = 3600
+
+# Seconds before a process notices categories added, renamed or removed by
+# other processes, and how long the navbar's page counts are cached.
+WIKI_CATEGORY_REFRESH = 5
+WIKI_CATEGORY_COUNTS_TIMEOUT = 60
+
+# Cache-Control of the read views (wiki/conditional.py). They all send ETags,
+# so "no-cache" still saves the download: clients revalidate and get a 304.
+WIKI_CACHE_CONTROL = {
+    'home': 'public, no-cache',
+    'category_detail': 'public, no-cache',
+    'page_detail': 'public, no-cache',
+    'api': 'public, no-cache',
+}
+
+# Full-text search backend (see wiki/search.py). Leave unset to pick
+# SQLite FTS5 or the plain database fallback automatically, e.g.
+# WIKI_SEARCH_BACKEND = 'wiki.search.DatabaseSearchBackend'
+
+# Search box completions (wiki/typeahead.py): seconds before a process
+# looks for pages changed by other processes, and whether step headings
+# are completed too (they take most of the index's memory).
+WIKI_TYPEAHEAD_REFRESH = 10
+WIKI_TYPEAHEAD_STEPS = True
+
+# JSON API (wiki/api.py): seconds every incremental sync reads again, so
+# pages saved by a transaction still open at "as_of" aren't missed.
+# Longer than the longest import transaction.
+WIKI_API_SYNC_OVERLAP = 600
+
+# Background worker threads per process for document imports (wiki/jobs.py).
+# Set to 0 and run `manage.py import_worker` to process imports elsewhere.
+WIKI_IMPORT_WORKERS = 2
+
+# Seconds an unsaved import draft (and its rendered images) is kept.
+WIKI_IMPORT_DRAFT_TTL = 24 * 3600
+
+# Limits on imported documents (wiki/uploads.py).  Uploads are streamed to
+# disk and cut off once they pass WIKI_IMPORT_MAX_BYTES; keep nginx's
+# client_max_body_size a little above it.
+WIKI_IMPORT_MAX_BYTES = 200 * 1024 * 1024
+WIKI_IMPORT_MAX_PAGES = 500
+
+# Page history (wiki/revisions.py): a full snapshot at least every this many
+# revisions, the rest are deltas.  Rebuilding a revision reads at most this
+# many rows.  Old revisions go with `manage.py prune_revisions`.
+WIKI_REVISION_SNAPSHOT_EVERY = 20
+
+# Request timing (wiki/timing.py).  Share of requests that get query and
+# template timings and a Server-Timing header (0 turns it off, leaving only
+# the slow-request log), the slow-request threshold in ms, and how often
+# one statement may run in a request before it is logged as a likely N+1.
+WIKI_TIMING_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+WIKI_TIMING_HEADER = True
+WIKI_SLOW_REQUEST_MS = 1000
+WIKI_REPEATED_QUERY_LIMIT = 5
+
+# Metrics (wiki/metrics.py): every process writes its numbers here and
+# /metrics adds them up, so all web and import workers must share it.
+# /metrics answers staff users and requests with the header
+# `Authorization: Bearer <WIKI_METRICS_TOKEN>` (bearer_token in the
+# Prometheus scrape config); without a token only staff.
+WIKI_METRICS_DIR = BASE_DIR / 'var' / 'metrics'
+WIKI_METRICS_TOKEN = os.environ.get('WIKI_METRICS_TOKEN')
+
+# LibreOffice conversion of .odt/.odp/.docx/.pptx imports (wiki/convert.py):
+# concurrent conversions per process, and seconds before one is killed.
+WIKI_OFFICE_WORKERS = 2
+WIKI_OFFICE_TIMEOUT = 120
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -15,17 +15,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.conf import settings
 from django.conf.urls.static import static
-from wiki.views import home  # import home directly
+from wiki.views import home, metrics_view, serve_blob  # import home directly
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', home, name='home'),   # Home page at /
     path('wiki/', include('wiki.urls', namespace='wiki')),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('metrics', metrics_view, name='metrics'),
     
 ]
 if settings.DEBUG:
+    # content-addressed blobs first, they get immutable cache headers
+    urlpatterns += [
+        re_path(r'^%s(?P<path>blobs/.*)$' % settings.MEDIA_URL.lstrip('/'), serve_blob),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, WikiPage, ResourceLink, MediaFile
+from .models import Category, WikiPage, ResourceLink, MediaFile, ImportJob, ImportedDocument, Blob, PageRevision
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -18,3 +18,26 @@ class ResourceLinkAdmin(admin.ModelAdmin):
 @admin.register(MediaFile)
 class MediaFileAdmin(admin.ModelAdmin):
     list_display = ('page', 'file')
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('original_name', 'user', 'status', 'pages_done', 'pages_total', 'attempts', 'created_at')
+    list_filter = ('status',)
+    exclude = ('draft',)
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'refcount', 'created_at')
+    readonly_fields = ('name', 'refcount', 'created_at')
+
+@admin.register(ImportedDocument)
+class ImportedDocumentAdmin(admin.ModelAdmin):
+    list_display = ('path', 'page', 'created_at')
+    search_fields = ('path', 'sha256')
+
+@admin.register(PageRevision)
+class PageRevisionAdmin(admin.ModelAdmin):
+    list_display = ('page', 'number', 'author', 'created_at', 'snapshot', 'added', 'removed')
+    list_select_related = ('page', 'author')
+    exclude = ('data',)
+    readonly_fields = ('page', 'number', 'author', 'created_at', 'snapshot', 'digest', 'added', 'removed')
@@ -0,0 +1,333 @@
+# wiki/api.py
+"""
+Read-only JSON API, version 1, under /wiki/api/v1/:
+
+    categories/                       every category, with its page count
+    pages/                            pages, most recently changed first
+    pages/<slug>/                     one page with its steps, resources, media
+    pages/<slug>/steps/               a guide's steps, in order
+
+Lists are cursor-paginated (wiki/pagination.py): follow "next" until it is
+null; `limit` sets the page size.  `pages/` filters on `category=<slug>`,
+`type=guide|note` and `updated_since=<ISO date/time>`.  A client syncing
+incrementally keeps "as_of" from its first request and passes it as
+updated_since next time; `pages/?fields=id` lists every id cheaply, to
+spot deleted pages.  "as_of" lies WIKI_API_SYNC_OVERLAP seconds in the
+past: a page saved by a long transaction (an import, say) carries the
+time it was saved, not the later time it became visible, so each sync
+reads that window again and may see pages it already has.
+
+`fields` picks what each item contains (sparse fieldsets), e.g.
+`pages/?fields=id,title,updated_at` or `pages/<slug>/?fields=title,steps`
+with `fields[step]=order,image` to leave the step text out.  Nested lists
+(steps, resources, media) cost one query each for the whole response,
+however many pages it holds.
+
+Every response has an ETag and answers If-None-Match with 304, like the
+HTML views (wiki/conditional.py).
+"""
+from datetime import datetime, time, timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Count, Max
+
+from . import cache as page_cache
+from . import pagination as keyset
+from .conditional import conditional, make_etag, request_stamp
+from .models import GuideStep, MediaFile, ResourceLink, WikiPage
+from .storage import get_blob_storage
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class ApiError(Exception):
+    status = 400
+
+
+# field name -> column for .values(); None for fields computed from others
+CATEGORY_FIELDS = {"id": "pk", "name": "name", "slug": "slug", "page_count": "page_count",
+                   "url": None, "pages": None}
+PAGE_FIELDS = {
+    "id": "pk", "title": "title", "slug": "slug", "type": "page_type",
+    "category": "category__slug", "author": "author__username",
+    "created_at": "created_at", "updated_at": "updated_at", "version": "version",
+    "content": "content", "url": None, "api_url": None,
+    "steps": None, "resources": None, "media": None,
+}
+STEP_FIELDS = {"id": "pk", "order": "step_order", "content": "step_content", "image": "file"}
+RESOURCE_FIELDS = {"id": "pk", "name": "name", "url": "url", "description": "description"}
+MEDIA_FIELDS = {"id": "pk", "url": "file", "description": "description"}
+
+PAGE_LIST_DEFAULT = ("id", "title", "slug", "type", "category", "updated_at", "url", "api_url")
+PAGE_DEFAULT = tuple(PAGE_FIELDS)
+NESTED = {
+    # name -> (model, field spec, fk column)
+    "steps": (GuideStep, STEP_FIELDS, "wiki_page_id"),
+    "resources": (ResourceLink, RESOURCE_FIELDS, "page_id"),
+    "media": (MediaFile, MEDIA_FIELDS, "page_id"),
+}
+
+
+def api_view(view):
+    """Errors as JSON ({"error": ...}) instead of the HTML error pages."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as exc:
+            return JsonResponse({"error": str(exc)}, status=exc.status)
+        except Http404 as exc:
+            return JsonResponse({"error": str(exc) or "Not found"}, status=404)
+    return wrapper
+
+
+def _safe(stamp):
+    # bad parameters: no validators, and the view itself answers 400
+    @wraps(stamp)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return stamp(request, *args, **kwargs)
+        except ApiError:
+            return None
+    return wrapper
+
+
+# ──────────────────────────────────────────────────────────────
+#  Parameters
+# ──────────────────────────────────────────────────────────────
+def fields(request, spec, default, param="fields"):
+    raw = request.GET.get(param)
+    if not raw:
+        return tuple(default)
+    wanted = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in wanted if f not in spec]
+    if unknown:
+        raise ApiError(f"Unknown {param}: {', '.join(unknown)} (known: {', '.join(spec)})")
+    return wanted
+
+
+def sync_overlap():
+    return timedelta(seconds=getattr(settings, "WIKI_API_SYNC_OVERLAP", 600))
+
+
+def limit(request):
+    raw = request.GET.get("limit")
+    if not raw:
+        return PAGE_SIZE
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ApiError("limit must be a number") from None
+    return min(max(value, 1), MAX_PAGE_SIZE)
+
+
+def updated_since(request):
+    raw = request.GET.get("updated_since")
+    if not raw:
+        return None
+    value = parse_datetime(raw)
+    if value is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ApiError("updated_since must be an ISO 8601 date or date-time")
+        value = datetime.combine(day, time.min)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def _absolute(request, url):
+    return request.build_absolute_uri(url)
+
+
+def _next_url(request, cursor):
+    query = request.GET.copy()
+    query["cursor"] = cursor
+    return _absolute(request, f"{request.path}?{query.urlencode()}")
+
+
+# ──────────────────────────────────────────────────────────────
+#  Rows to JSON
+# ──────────────────────────────────────────────────────────────
+def _columns(spec, wanted, *always):
+    return list(dict.fromkeys([*(spec[f] for f in wanted if spec[f]), *always]))
+
+
+def _item(request, row, spec, wanted):
+    item = {}
+    for f in wanted:
+        value = row[spec[f]]
+        if spec[f] == "file":
+            value = _absolute(request, get_blob_storage().url(value)) if value else None
+        item[f] = value
+    return item
+
+
+def _nested(request, page_ids, wanted_lists):
+    """{name: {page id: [items]}} for the nested lists asked for, one query each."""
+    found = {}
+    for name in wanted_lists:
+        model, spec, fk = NESTED[name]
+        wanted = fields(request, spec, spec, f"fields[{name.rstrip('s')}]")
+        order = "step_order" if model is GuideStep else "pk"
+        rows = (model.objects.filter(**{f"{fk}__in": page_ids})
+                .order_by(fk, order).values(*_columns(spec, wanted, fk)))
+        by_page = found[name] = {}
+        for row in rows:
+            by_page.setdefault(row[fk], []).append(_item(request, row, spec, wanted))
+    return found
+
+
+def _pages_json(request, rows, wanted):
+    lists = [f for f in wanted if f in NESTED]
+    nested = _nested(request, [row["pk"] for row in rows], lists) if lists else {}
+    items = []
+    for row in rows:
+        item = {}
+        for f in wanted:
+            if f == "url":
+                item[f] = _absolute(request, reverse("wiki:page_detail", args=[row["slug"]]))
+            elif f == "api_url":
+                item[f] = _absolute(request, reverse("wiki:api_page", args=[row["slug"]]))
+            elif f in NESTED:
+                item[f] = nested[f].get(row["pk"], [])
+            else:
+                item[f] = row[PAGE_FIELDS[f]]
+        items.append(item)
+    return items
+
+
+# ──────────────────────────────────────────────────────────────
+#  Categories
+# ──────────────────────────────────────────────────────────────
+def _categories_stamp(request):
+    # from the category snapshot and counts, like the home page: usually no query
+    return make_etag("api-categories", page_cache.category_counts_digest(),
+                     request.GET.urlencode()), None
+
+
+@api_view
+@conditional(_categories_stamp, "api")
+def categories(request):
+    wanted = fields(request, CATEGORY_FIELDS, CATEGORY_FIELDS)
+    pages = reverse("wiki:api_pages")
+    items = []
+    for category in page_cache.counted_categories():
+        item = {}
+        for f in wanted:
+            if f == "url":
+                item[f] = _absolute(request, reverse("wiki:category_detail", args=[category.slug]))
+            elif f == "pages":
+                item[f] = _absolute(request, f"{pages}?category={category.slug}")
+            else:
+                item[f] = getattr(category, CATEGORY_FIELDS[f])
+        items.append(item)
+    # categories are few: always one page
+    return JsonResponse({"data": items, "next": None})
+
+
+# ──────────────────────────────────────────────────────────────
+#  Pages
+# ──────────────────────────────────────────────────────────────
+def _filtered_pages(request):
+    pages = WikiPage.objects.all()
+    slug = request.GET.get("category")
+    if slug:
+        category = page_cache.find_category(slug)
+        if category is None:
+            raise ApiError(f"No category {slug!r}")
+        pages = pages.filter(category_id=category.pk)
+    page_type = request.GET.get("type")
+    if page_type:
+        if page_type not in (WikiPage.GUIDE, WikiPage.NOTE):
+            raise ApiError("type must be 'guide' or 'note'")
+        pages = pages.filter(page_type=page_type)
+    since = updated_since(request)
+    if since is not None:
+        pages = pages.filter(updated_at__gt=since)
+    return pages
+
+
+@_safe
+def _pages_stamp(request):
+    # count and newest change of everything the filters select: deletions
+    # move the count, any save (also of a step or attachment) moves the max
+    listed = _filtered_pages(request).aggregate(count=Count("pk"), last=Max("updated_at"))
+    return make_etag("api-pages", listed["count"], listed["last"], request.GET.urlencode()), None
+
+
+@api_view
+@conditional(_pages_stamp, "api")
+def pages(request):
+    as_of = timezone.now() - sync_overlap()
+    wanted = fields(request, PAGE_FIELDS, PAGE_LIST_DEFAULT)
+    size = limit(request)
+    cursor = request.GET.get("cursor")
+    if cursor and keyset.decode_cursor(cursor) is None:
+        raise ApiError("Malformed cursor")
+    rows = list(
+        _filtered_pages(request)
+        .filter(keyset.after(cursor, "updated_at"))
+        .order_by(*keyset.ordering("updated_at"))
+        .values(*_columns(PAGE_FIELDS, wanted, "pk", "slug", "updated_at"))[:size + 1]
+    )
+    next_url = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_url = _next_url(request, keyset.encode_cursor(rows[-1]["updated_at"], rows[-1]["pk"]))
+    return JsonResponse({"data": _pages_json(request, rows, wanted), "next": next_url,
+                         "as_of": as_of})
+
+
+def _page_stamp(request, page_slug):
+    # updated_at and version also move when a step, media file or link changes
+    row = (WikiPage.objects.filter(slug=page_slug)
+           .values_list("pk", "updated_at", "version").first())
+    if row is None:
+        return None
+    return make_etag("api-page", *row, request.GET.urlencode()), row[1], row
+
+
+@api_view
+@conditional(_page_stamp, "api")
+def page(request, page_slug):
+    stamp = request_stamp(request, _page_stamp, page_slug)
+    if stamp is None:
+        raise Http404("No such page")
+    wanted = fields(request, PAGE_FIELDS, PAGE_DEFAULT)
+    row = (WikiPage.objects.filter(pk=stamp[2][0])
+           .values(*_columns(PAGE_FIELDS, wanted, "pk", "slug")).first())
+    if row is None:
+        raise Http404("No such page")
+    return JsonResponse({"data": _pages_json(request, [row], wanted)[0]})
+
+
+@api_view
+@conditional(_page_stamp, "api")
+def page_steps(request, page_slug):
+    """A guide's steps in order; cursors here are the last step_order seen."""
+    stamp = request_stamp(request, _page_stamp, page_slug)
+    if stamp is None:
+        raise Http404("No such page")
+    spec = STEP_FIELDS
+    wanted = fields(request, spec, spec)
+    size = limit(request)
+    steps = GuideStep.objects.filter(wiki_page_id=stamp[2][0]).order_by("step_order")
+    cursor = request.GET.get("cursor")
+    if cursor:
+        if not cursor.isdigit():
+            raise ApiError("Malformed cursor")
+        steps = steps.filter(step_order__gt=int(cursor))
+    rows = list(steps.values(*_columns(spec, wanted, "step_order"))[:size + 1])
+    next_url = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_url = _next_url(request, str(rows[-1]["step_order"]))
+    return JsonResponse({"data": [_item(request, row, spec, wanted) for row in rows],
+                         "next": next_url})
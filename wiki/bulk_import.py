@@ -0,0 +1,36 @@
+# wiki/bulk_import.py
+"""
+Worker-process side of `manage.py import_guides`.
+
+Kept apart from the command so a freshly spawned worker can unpickle its
+tasks before Django is set up: nothing here imports models at module level.
+"""
+import tempfile
+from pathlib import Path
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def draft_file(path):
+    """Convert one file and return its draft; images go straight to blob storage."""
+    from django.core.files.base import ContentFile
+
+    from . import convert
+    from .storage import blob_storage
+    from .views import _pdf_to_draft
+
+    def save_image(data):
+        # content-addressed: safe from many processes, and returns the blob name
+        return blob_storage.save("import.png", ContentFile(data))
+
+    path = Path(path)
+    with tempfile.TemporaryDirectory(prefix="ndt-import-") as workdir:
+        source = path
+        if convert.is_office_document(path.name):
+            source = convert.to_pdf(path, workdir)
+        # one document per process: the pool already keeps every core busy
+        return _pdf_to_draft(source, name=path.with_suffix(".pdf").name,
+                             save_image=save_image, parallel=False, thumbnails=False)
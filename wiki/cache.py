@@ -0,0 +1,214 @@
+# wiki/cache.py
+"""
+Versioned cache of rendered wiki pages.
+
+Keys embed everything that can change a rendered page: the page's
+updated_at and version (bumped whenever a step, media file or resource link
+of the page changes, see signals.py), the category generation (which moves
+when a category is added, renamed or removed, since the navbar lists them
+all), the template version and the Markdown renderer's version
+(wiki/markup.py).  Stale entries are never read again and simply expire.
+
+The generation is read from the category rows themselves, so changes made
+by other processes (another worker, `manage.py import_guides`, the admin)
+count too.  The same generation guards the process-wide category snapshot
+used by the navbar and the home page.
+
+Page counts per category move with every new page, so they are kept apart:
+cached briefly on their own, and filled into cached pages when they are
+served (see category_options), instead of invalidating every page.
+"""
+import copy
+import hashlib
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+from django.template import engines
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from . import markup
+
+CATEGORY_COUNTS_KEY = "wiki:category-counts"
+CATEGORY_OPTIONS_SLOT = mark_safe("<!-- wiki:category-options -->")
+
+
+def page_timeout():
+    return getattr(settings, "WIKI_PAGE_CACHE_TIMEOUT", 3600)
+
+
+def category_refresh():
+    return getattr(settings, "WIKI_CATEGORY_REFRESH", 5)
+
+
+def category_counts_timeout():
+    return getattr(settings, "WIKI_CATEGORY_COUNTS_TIMEOUT", 60)
+
+
+_generation = (0.0, None)    # (checked at, generation)
+
+
+def category_generation():
+    """
+    Digest of the category rows (how many, the newest pk, the last change).
+
+    Looked up at most every WIKI_CATEGORY_REFRESH seconds; changes made in
+    this process are seen at once (bump_category_generation).
+    """
+    global _generation
+    checked, generation = _generation
+    now = time.monotonic()
+    if generation is None or now - checked >= category_refresh():
+        from .models import Category
+        row = Category.objects.aggregate(
+            count=Count("pk"), newest=Max("pk"), changed=Max("updated_at")
+        )
+        generation = hashlib.md5(
+            repr(sorted(row.items())).encode(), usedforsecurity=False
+        ).hexdigest()[:12]
+        _generation = (now, generation)
+    return generation
+
+
+def bump_category_generation():
+    """A category changed: look at the rows again on the next request."""
+    global _generation
+    _generation = (0.0, None)
+
+
+@lru_cache(maxsize=None)
+def template_version():
+    """
+    Hash of every template file, computed once per process: a deploy that
+    changes templates gets new cache keys and ETags, one that doesn't
+    keeps the old ones.
+    """
+    digest = hashlib.sha256()
+    dirs = set()
+    for engine in engines.all():
+        dirs.update(getattr(engine, "template_dirs", ()))
+    for directory in sorted(map(Path, dirs)):
+        for path in sorted(directory.rglob("*.html")):
+            digest.update(str(path).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def page_key(slug, pk, updated_at, version):
+    return (
+        f"wiki:page:{slug}:{pk}:{updated_at.timestamp():.6f}:{version}"
+        f":c{category_generation()}:t{template_version()}:m{markup.VERSION}"
+    )
+
+
+def touch_page(page_id):
+    """Mark a page's rendering stale after one of its children changed."""
+    touch_pages([page_id])
+
+
+def touch_pages(page_ids):
+    # updated_at moves too, so Last-Modified covers step and media changes
+    from .models import WikiPage
+    WikiPage.objects.filter(pk__in=page_ids).update(
+        version=F("version") + 1, updated_at=timezone.now()
+    )
+
+
+# ──────────────────────────────────────────────────────────────
+#  Category snapshot (navbar, home page)
+# ──────────────────────────────────────────────────────────────
+_categories = (None, ())     # (generation, categories)
+_categories_lock = threading.Lock()
+
+
+def category_snapshot():
+    """
+    All categories, in creation order.
+
+    Built once per process and reused until the category generation moves
+    on, so a request at most pays for the generation check.  No page
+    counts: see counted_categories().
+    """
+    global _categories
+    generation = category_generation()
+    cached_generation, categories = _categories
+    if cached_generation == generation:
+        return categories
+
+    from .models import Category
+    with _categories_lock:
+        if _categories[0] != generation:
+            _categories = (generation, tuple(Category.objects.order_by('pk')))
+        return _categories[1]
+
+
+def find_category(slug):
+    """The category with `slug`, from the snapshot if it's there (or None)."""
+    category = next((c for c in category_snapshot() if c.slug == slug), None)
+    if category is None:
+        # created a moment ago, maybe in another process: the snapshot
+        # catches up within WIKI_CATEGORY_REFRESH seconds
+        from .models import Category
+        category = Category.objects.filter(slug=slug).first()
+    return category
+
+
+def _category_counts():
+    # (digest, {category id: pages}), shared through the cache
+    entry = cache.get(CATEGORY_COUNTS_KEY)
+    if entry is None:
+        from .models import WikiPage
+        counts = dict(
+            WikiPage.objects.order_by().values_list('category_id').annotate(n=Count('pk'))
+        )
+        digest = hashlib.md5(
+            repr(sorted(counts.items(), key=str)).encode(), usedforsecurity=False
+        ).hexdigest()[:12]
+        entry = (digest, counts)
+        cache.set(CATEGORY_COUNTS_KEY, entry, category_counts_timeout())
+    return entry
+
+
+def category_counts_digest():
+    """Changes whenever a page count does (for the ETags of pages that show them)."""
+    return _category_counts()[0]
+
+
+def forget_category_counts():
+    """Pages were added, removed or moved: count again on the next request."""
+    cache.delete(CATEGORY_COUNTS_KEY)
+
+
+def counted_categories():
+    """The snapshot's categories, each with a current `page_count`."""
+    counts = _category_counts()[1]
+    categories = []
+    for category in category_snapshot():
+        category = copy.copy(category)      # the snapshot is shared by threads
+        category.page_count = counts.get(category.pk, 0)
+        categories.append(category)
+    return categories
+
+
+def category_options():
+    """
+    The navbar's category <option>s with their page counts.  Cached pages
+    hold CATEGORY_OPTIONS_SLOT instead, filled in here when served.
+    """
+    key = f"wiki:category-options:{category_generation()}:{category_counts_digest()}"
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string("wiki/category_options.html",
+                                {"all_categories": counted_categories()})
+        cache.set(key, html, category_counts_timeout())
+    return html
+
+
+def fill_category_options(html):
+    return html.replace(CATEGORY_OPTIONS_SLOT, category_options(), 1)
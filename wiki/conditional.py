@@ -0,0 +1,78 @@
+# wiki/conditional.py
+"""
+Conditional GET and Cache-Control for the read views.
+
+Each read view gets a `stamp` function that returns (etag, last_modified)
+from at most one small query.  Django's `condition` decorator compares it
+with If-None-Match / If-Modified-Since and answers 304 before the view
+runs.  The stamp is memoised on the request, so the view can reuse the
+row it fetched instead of querying again.
+
+Every ETag also carries the category generation (the navbar lists all
+categories), the template version and the Markdown renderer's version.
+Last-Modified only covers the page rows.  Clients that send both get ETag
+precedence (RFC 9110), so the navbar's categories are never served stale.
+Its page counts are not part of a page's validators: a new page elsewhere
+shouldn't invalidate every copy of every page, so they may lag behind in a
+revalidated copy.
+
+Cache-Control comes from settings.WIKI_CACHE_CONTROL, per view name; the
+default lets browsers and proxies store a page but revalidate every time.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.views.decorators.http import condition
+
+from . import markup
+from .cache import category_generation, template_version
+
+DEFAULT_CACHE_CONTROL = "public, no-cache"
+
+
+def make_etag(*parts):
+    parts = (*parts, category_generation(), template_version(), markup.VERSION)
+    return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def request_stamp(request, stamp, *args, **kwargs):
+    """stamp(request, ...) once per request; None means "no validators" (e.g. 404)."""
+    memo = request.__dict__.setdefault("_wiki_stamps", {})
+    if stamp not in memo:
+        memo[stamp] = stamp(request, *args, **kwargs)
+    return memo[stamp]
+
+
+def cache_control(view_name):
+    """Set the Cache-Control policy configured for `view_name`, on 200s and 304s."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD") and response.status_code in (200, 304):
+                policies = getattr(settings, "WIKI_CACHE_CONTROL", {})
+                response.setdefault("Cache-Control", policies.get(view_name, DEFAULT_CACHE_CONTROL))
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional(stamp, view_name):
+    """
+    Decorate a read view: 304 when the client's copy is current, otherwise
+    the view's response with ETag, Last-Modified and Cache-Control set.
+    """
+    def etag(request, *args, **kwargs):
+        result = request_stamp(request, stamp, *args, **kwargs)
+        return result and result[0]
+
+    def last_modified(request, *args, **kwargs):
+        result = request_stamp(request, stamp, *args, **kwargs)
+        return result and result[1]
+
+    def decorator(view):
+        return cache_control(view_name)(
+            condition(etag_func=etag, last_modified_func=last_modified)(view)
+        )
+    return decorator
@@ -1,5 +1,15 @@
 # wiki/context_processors.py
-from .models import Category
+from django.utils.functional import SimpleLazyObject
+
+from .cache import counted_categories
+from .timing import span
+
+
+def _categories():
+    with span('nav'):
+        return counted_categories()
+
 
 def all_categories_processor(request):
-    return {'all_categories': Category.objects.all()}
+    # lazy: pages that never show the category menu run no query at all
+    return {'all_categories': SimpleLazyObject(_categories)}
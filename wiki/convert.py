@@ -0,0 +1,297 @@
+# wiki/convert.py
+"""
+Office documents (.odt, .odp, .docx, .pptx) to PDF, through a small pool of
+LibreOffice processes.
+
+Every worker slot has its own LibreOffice profile directory, so
+conversions running side by side no longer fight over one profile.  At
+most WIKI_OFFICE_WORKERS conversions run at once; further callers wait
+for a free slot.
+
+With the `uno` Python bridge installed (python3-uno on Debian/Ubuntu), each
+slot keeps one headless soffice running and converts through it, so only
+the first document pays LibreOffice's start-up time.  Without it, a slot
+starts `soffice --convert-to` per document.
+
+A conversion that takes longer than WIKI_OFFICE_TIMEOUT seconds is killed.
+If soffice crashes, the slot starts a fresh process and the document is
+tried once more.
+
+Conversion works on files, not in-memory copies: pass the path of the
+document and a scratch directory, and you get back the path of the PDF.
+"""
+import atexit
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+from . import metrics
+
+try:
+    import uno
+except ImportError:  # no UNO bridge: fall back to one soffice run per file
+    uno = None
+
+logger = logging.getLogger(__name__)
+
+# suffix -> LibreOffice PDF export filter
+PDF_FILTERS = {
+    ".odt": "writer_pdf_Export",
+    ".docx": "writer_pdf_Export",
+    ".odp": "impress_pdf_Export",
+    ".pptx": "impress_pdf_Export",
+}
+START_TIMEOUT = 30      # seconds for a new soffice to accept connections
+QUEUE_TIMEOUT = 600     # seconds to wait for a free slot before giving up
+
+
+class ConversionError(Exception):
+    pass
+
+
+class ConversionTimeout(ConversionError):
+    pass
+
+
+def is_office_document(name):
+    return Path(name).suffix.lower() in PDF_FILTERS
+
+
+def _soffice():
+    return getattr(settings, "WIKI_SOFFICE", "soffice")
+
+
+def _kill(proc):
+    # soffice is a launcher script: take down the whole process group
+    if proc is None or proc.poll() is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        proc.kill()
+    proc.wait()
+
+
+# ──────────────────────────────────────────────────────────────
+#  Worker slots
+# ──────────────────────────────────────────────────────────────
+class _Slot:
+    """One conversion at a time, with its own LibreOffice profile."""
+
+    def __init__(self, root, index):
+        self.profile = Path(root) / f"profile-{index}"
+        self.profile.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def profile_arg(self):
+        return f"-env:UserInstallation={self.profile.as_uri()}"
+
+    def convert(self, source, outdir, timeout):
+        raise NotImplementedError
+
+    def restart(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _CommandSlot(_Slot):
+    """Runs `soffice --convert-to` per document."""
+
+    def convert(self, source, outdir, timeout):
+        export = f"pdf:{PDF_FILTERS[source.suffix.lower()]}"
+        proc = subprocess.Popen(
+            [_soffice(), self.profile_arg, "--headless", "--norestore",
+             "--convert-to", export, "--outdir", str(outdir), str(source)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+        )
+        try:
+            _out, err = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill(proc)
+            raise ConversionTimeout(f"conversion of {source.name} timed out after {timeout}s")
+        pdf = Path(outdir) / f"{source.stem}.pdf"
+        if proc.returncode != 0 or not pdf.exists():
+            raise ConversionError(
+                f"soffice could not convert {source.name}: "
+                f"{err.decode(errors='replace').strip() or f'exit code {proc.returncode}'}"
+            )
+        return pdf
+
+
+class _UnoSlot(_Slot):
+    """Keeps one headless soffice running and converts through UNO."""
+
+    def __init__(self, root, index):
+        super().__init__(root, index)
+        self.pipe = f"ndt-wiki-{os.getpid()}-{index}-{uuid.uuid4().hex[:6]}"
+        self.proc = None
+        self.desktop = None
+
+    def _start(self):
+        self.proc = subprocess.Popen(
+            [_soffice(), self.profile_arg, "--headless", "--invisible", "--nologo",
+             "--norestore", "--nodefault",
+             f"--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+        )
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local
+        )
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(
+                    f"uno:pipe,name={self.pipe};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise ConversionError("soffice did not start")
+                time.sleep(0.25)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", ctx
+        )
+
+    @staticmethod
+    def _props(**values):
+        props = []
+        for name, value in values.items():
+            prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+            prop.Name, prop.Value = name, value
+            props.append(prop)
+        return tuple(props)
+
+    def convert(self, source, outdir, timeout):
+        if self.proc is None or self.proc.poll() is not None:
+            self._start()
+        pdf = Path(outdir) / f"{source.stem}.pdf"
+
+        # UNO calls can't be interrupted: a watchdog kills soffice instead,
+        # which makes the pending call fail
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            _kill(self.proc)
+
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.start()
+        try:
+            doc = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(str(source)), "_blank", 0,
+                self._props(Hidden=True, ReadOnly=True),
+            )
+            if doc is None:
+                raise ConversionError(f"soffice could not open {source.name}")
+            try:
+                doc.storeToURL(
+                    uno.systemPathToFileUrl(str(pdf)),
+                    self._props(FilterName=PDF_FILTERS[source.suffix.lower()]),
+                )
+            finally:
+                doc.close(True)
+        except ConversionError:
+            raise
+        except Exception as exc:
+            if timed_out.is_set():
+                raise ConversionTimeout(f"conversion of {source.name} timed out after {timeout}s")
+            raise ConversionError(f"soffice failed on {source.name}: {exc}") from exc
+        finally:
+            watchdog.cancel()
+        return pdf
+
+    def restart(self):
+        self.close()
+        self._start()
+
+    def close(self):
+        self.desktop = None
+        _kill(self.proc)
+        self.proc = None
+
+
+# ──────────────────────────────────────────────────────────────
+#  Pool
+# ──────────────────────────────────────────────────────────────
+class ConverterPool:
+    def __init__(self, size, timeout, slot_class=None):
+        self.timeout = timeout
+        self.root = tempfile.mkdtemp(prefix="ndt-soffice-")
+        slot_class = slot_class or (_UnoSlot if uno is not None else _CommandSlot)
+        self._slots = [slot_class(self.root, i) for i in range(size)]
+        # last in, first out: the slot that just finished (and whose soffice
+        # is warm) takes the next job; slots that are never needed never start
+        self._idle = queue.LifoQueue()
+        for slot in self._slots:
+            self._idle.put(slot)
+
+    def convert(self, source, outdir):
+        """Convert the document at `source` into `outdir`; returns the PDF's path."""
+        source = Path(source)
+        if not is_office_document(source.name):
+            raise ConversionError(f"unsupported document type: {source.suffix or source.name}")
+        try:
+            with metrics.OFFICE_WAIT.time():
+                slot = self._idle.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            raise ConversionError("all document converters are busy") from None
+        try:
+            try:
+                return self._timed(slot, source, outdir)
+            except ConversionTimeout:
+                slot.close()
+                raise
+            except ConversionError as exc:
+                # soffice may have crashed: once more on a fresh process
+                logger.warning("Retrying %s on a fresh soffice: %s", source.name, exc)
+                slot.restart()
+                return self._timed(slot, source, outdir)
+        finally:
+            self._idle.put(slot)
+
+    def _timed(self, slot, source, outdir):
+        started, result = time.perf_counter(), "error"
+        try:
+            pdf = slot.convert(source, outdir, self.timeout)
+            result = "ok"
+            return pdf
+        except ConversionTimeout:
+            result = "timeout"
+            raise
+        finally:
+            metrics.CONVERT.observe(time.perf_counter() - started, result=result)
+
+    def close(self):
+        for slot in self._slots:
+            slot.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    pool = ConverterPool(
+        size=max(1, getattr(settings, "WIKI_OFFICE_WORKERS", 2)),
+        timeout=getattr(settings, "WIKI_OFFICE_TIMEOUT", 120),
+    )
+    atexit.register(pool.close)
+    return pool
+
+
+def to_pdf(source, outdir):
+    """Convert an office document on disk to PDF inside `outdir`."""
+    return get_pool().convert(source, outdir)
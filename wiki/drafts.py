@@ -0,0 +1,131 @@
+# wiki/drafts.py
+"""
+On-disk storage for the images of a guide import draft.
+
+Rendered page images are written once, under
+MEDIA_ROOT/import_drafts/<draft id>/<content hash>.png, and the draft itself
+only keeps the file names.  The preview streams thumbnails from here, and
+saving the guide reads the full-size images back exactly once.
+
+Drafts nobody saved are removed by `collect_garbage()`, which the import
+workers run periodically and `manage.py purge_import_drafts` runs on demand.
+"""
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+ROOT = "import_drafts"
+ASSET_NAME_RE = re.compile(r"^[0-9a-f]{32}\.png$")
+
+
+def draft_ttl():
+    return timedelta(seconds=getattr(settings, "WIKI_IMPORT_DRAFT_TTL", 24 * 3600))
+
+
+class DraftStore:
+    """The image assets of a single draft."""
+
+    def __init__(self, draft_id, storage=None):
+        self.draft_id = str(draft_id)
+        self.storage = storage or default_storage
+
+    @property
+    def directory(self):
+        return f"{ROOT}/{self.draft_id}"
+
+    def _path(self, name):
+        if not ASSET_NAME_RE.match(name):
+            raise ValueError(f"not a draft asset name: {name!r}")
+        return f"{self.directory}/{name}"
+
+    def save(self, data):
+        """
+        Store PNG bytes, or an uploaded file (read in chunks, never whole),
+        and return their asset name (identical images are kept once).
+        """
+        if isinstance(data, bytes):
+            data = ContentFile(data)
+        digest = hashlib.sha256()
+        for chunk in data.chunks():
+            digest.update(chunk)
+        name = digest.hexdigest()[:32] + ".png"
+        path = self._path(name)
+        if not self.storage.exists(path):
+            self.storage.save(path, data)
+        return name
+
+    def open(self, name):
+        return self.storage.open(self._path(name), "rb")
+
+    def exists(self, name):
+        return bool(ASSET_NAME_RE.match(name)) and self.storage.exists(self._path(name))
+
+    def discard(self):
+        """Delete every asset of this draft."""
+        if not self.storage.exists(self.directory):
+            return
+        _dirs, files = self.storage.listdir(self.directory)
+        for name in files:
+            self.storage.delete(f"{self.directory}/{name}")
+        _remove_empty_dir(self.storage, self.directory)
+
+
+def _remove_empty_dir(storage, directory):
+    # Storage has no API for directories; only local storage leaves them behind
+    try:
+        path = storage.path(directory)
+    except NotImplementedError:
+        return
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def collect_garbage(now=None):
+    """
+    Remove import jobs and draft images that outlived WIKI_IMPORT_DRAFT_TTL.
+
+    Finished jobs that were never saved are deleted together with their
+    uploaded source; draft directories without a job are swept once their
+    newest file is older than the TTL.  Returns the number of drafts removed.
+    """
+    from .models import ImportJob
+
+    now = now or timezone.now()
+    cutoff = now - draft_ttl()
+    removed = 0
+
+    expired = ImportJob.objects.filter(
+        status__in=[ImportJob.DONE, ImportJob.FAILED], updated_at__lt=cutoff
+    )
+    for job in expired:
+        DraftStore(job.pk).discard()
+        job.source.delete(save=False)
+        job.delete()
+        removed += 1
+
+    storage = default_storage
+    if not storage.exists(ROOT):
+        return removed
+    live = set(map(str, ImportJob.objects.values_list("pk", flat=True)))
+    draft_dirs, _files = storage.listdir(ROOT)
+    for draft_id in draft_dirs:
+        if draft_id in live:
+            continue
+        store = DraftStore(draft_id, storage)
+        _dirs, files = storage.listdir(store.directory)
+        newest = max(
+            (storage.get_modified_time(f"{store.directory}/{f}") for f in files),
+            default=None,
+        )
+        if newest is None or newest < cutoff:
+            store.discard()
+            removed += 1
+    return removed
@@ -52,10 +52,49 @@ GuideStepFormSet = modelformset_factory(
 # ──────────────────────────────────────────────────────────────
 #  PDF import helper form (upload + optional category)
 # ──────────────────────────────────────────────────────────────
+from pathlib import Path
+import fitz
+from .convert import PDF_FILTERS
+from . import uploads
+
+IMPORT_SUFFIXES = (".pdf", *PDF_FILTERS)
+
 class PDFImportForm(forms.Form):
-    file     = forms.FileField(label="Select a PDF file")
+    file     = forms.FileField(
+        label  = "Select a PDF or office document",
+        widget = forms.FileInput(attrs={"accept": ",".join(IMPORT_SUFFIXES)}),
+    )
     category = forms.ModelChoiceField(
         queryset     = Category.objects.all(),
         required     = False,
         empty_label  = "— choose category (optional) —",
     )
+    # slug of a guide to re-import the file into (wiki/reimport.py)
+    into     = forms.SlugField(required=False, widget=forms.HiddenInput)
+
+    def clean_into(self):
+        slug = self.cleaned_data["into"]
+        if not slug:
+            return None
+        guide = WikiPage.objects.filter(slug=slug, page_type=WikiPage.GUIDE).first()
+        if guide is None:
+            raise forms.ValidationError("There is no guide to re-import into.")
+        return guide
+
+    def clean_file(self):
+        f = self.cleaned_data["file"]
+        if Path(f.name).suffix.lower() not in IMPORT_SUFFIXES:
+            raise forms.ValidationError(
+                "Upload a PDF or an office document (%s)." % ", ".join(IMPORT_SUFFIXES)
+            )
+        if f.size > uploads.max_bytes():
+            raise forms.ValidationError(uploads.too_large_message())
+        if Path(f.name).suffix.lower() == ".pdf":
+            # office documents get their page count checked once converted
+            try:
+                uploads.check_pdf(f)
+            except uploads.UploadRejected as exc:
+                raise forms.ValidationError(str(exc))
+            except fitz.FileDataError:
+                raise forms.ValidationError("This file doesn't look like a PDF.")
+        return f
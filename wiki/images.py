@@ -0,0 +1,211 @@
+# wiki/images.py
+"""
+Responsive derivatives (smaller widths, WebP/AVIF) of uploaded step and
+media images.
+
+Derivatives of a file are stored under MEDIA_ROOT/derivatives/<key>/, next to
+a manifest.json describing what was produced.  They are generated in the
+background after a GuideStep or MediaFile is saved (see signals.py), or by
+`manage.py generate_image_derivatives` for existing rows.  Until the manifest
+exists, templates simply fall back to the original file.
+
+Pillow is optional: without it nothing is generated and the original is used.
+"""
+import hashlib
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .storage import is_blob
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow not installed
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = "derivatives"
+WIDTHS = (240, 480, 960, 1600)
+# modern formats, best first; only those the installed Pillow can write are used
+MODERN_FORMATS = ("avif", "webp")
+QUALITY = {"avif": 55, "webp": 75, "jpeg": 82}
+MIME = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+MANIFEST_CACHE_SIZE = 4096     # manifests kept per process (a few hundred bytes each)
+
+
+def available_formats():
+    if Image is None:
+        return ()
+    Image.init()
+    return tuple(f for f in MODERN_FORMATS if f.upper() in Image.SAVE)
+
+
+def derivative_key(name):
+    """
+    Directory name for the derivatives of `name`.  Blobs already carry their
+    content hash; for anything else we hash the name.
+    """
+    if is_blob(name):
+        return Path(name).stem
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def _path(name, filename):
+    return f"{ROOT}/{derivative_key(name)}/{filename}"
+
+
+# ──────────────────────────────────────────────────────────────
+#  Manifest lookup (cached per process; manifests never change)
+# ──────────────────────────────────────────────────────────────
+_manifests = OrderedDict()      # least recently used first
+_manifests_lock = threading.Lock()
+
+
+def _remember(key, manifest):
+    with _manifests_lock:
+        _manifests[key] = manifest
+        _manifests.move_to_end(key)
+        while len(_manifests) > MANIFEST_CACHE_SIZE:
+            _manifests.popitem(last=False)
+
+
+def get_manifest(name, storage=default_storage):
+    """Return the manifest of `name`, or None if it hasn't been generated."""
+    key = derivative_key(name)
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is not None:
+            _manifests.move_to_end(key)
+            return manifest
+    path = _path(name, "manifest.json")
+    try:
+        with storage.open(path, "rb") as fh:
+            manifest = json.load(fh)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    _remember(key, manifest)
+    return manifest
+
+
+def variants(manifest, fmt):
+    """[(url, width), …] of one format in a manifest."""
+    return [
+        (default_storage.url(_path(manifest["source"], f"{w}.{fmt}")), w)
+        for w in manifest["widths"]
+    ]
+
+
+# ──────────────────────────────────────────────────────────────
+#  Generation
+# ──────────────────────────────────────────────────────────────
+def generate(name, source_storage=default_storage, storage=default_storage, force=False):
+    """
+    Create all derivatives of the file `name` and return its manifest, or
+    None if the file can't be read right now (tried again next time).
+    """
+    if not force:
+        manifest = get_manifest(name, storage)
+        if manifest is not None:
+            return manifest
+    if Image is None:
+        return None
+
+    manifest = {"source": name, "image": False, "widths": [], "formats": []}
+    try:
+        with source_storage.open(name, "rb") as fh:
+            img = Image.open(fh)
+            img.load()
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+        # not an image (video, PDF, …): remember that, so we don't retry
+        _write_manifest(name, manifest, storage)
+        return manifest
+    except OSError:
+        # missing for now, or a read error: no manifest, so it's tried again
+        logger.warning("Could not read %s for derivatives", name, exc_info=True)
+        return None
+
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    fallback = "png" if has_alpha else "jpeg"
+    formats = available_formats() + (fallback,)
+
+    # never upscale; the original width closes the list if it falls between steps
+    widths = [w for w in WIDTHS if w < img.width] + [min(img.width, WIDTHS[-1])]
+    widths = sorted(set(widths))
+
+    for width in widths:
+        height = max(1, round(img.height * width / img.width))
+        resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+        for fmt in formats:
+            buf = io.BytesIO()
+            resized.save(buf, fmt.upper(), quality=QUALITY.get(fmt, 80), optimize=True)
+            path = _path(name, f"{width}.{fmt}")
+            if storage.exists(path):
+                storage.delete(path)
+            storage.save(path, ContentFile(buf.getvalue()))
+
+    manifest.update({
+        "image": True,
+        "width": img.width,
+        "height": img.height,
+        "widths": widths,
+        "formats": list(formats),
+        "fallback": fallback,
+    })
+    _write_manifest(name, manifest, storage)
+    return manifest
+
+
+def _write_manifest(name, manifest, storage):
+    path = _path(name, "manifest.json")
+    if storage.exists(path):
+        storage.delete(path)
+    storage.save(path, ContentFile(json.dumps(manifest).encode()))
+    _remember(derivative_key(name), manifest)
+
+
+def discard(name, storage=default_storage):
+    """Delete every derivative of `name` (used when its blob is swept)."""
+    directory = f"{ROOT}/{derivative_key(name)}"
+    if storage.exists(directory):
+        for filename in storage.listdir(directory)[1]:
+            storage.delete(f"{directory}/{filename}")
+    with _manifests_lock:
+        _manifests.pop(derivative_key(name), None)
+
+
+# one background thread: derivative encoding is CPU heavy (AVIF especially)
+# and must never compete with page requests for more than a core
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-derivatives")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def schedule(name, source_storage=default_storage):
+    """Generate derivatives of `name` in the background, once."""
+    if Image is None or not name:
+        return
+    with _pending_lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+
+    def run():
+        try:
+            generate(name, source_storage)
+        except Exception:
+            logger.exception("Generating derivatives of %s failed", name)
+        finally:
+            with _pending_lock:
+                _pending.discard(name)
+
+    _executor.submit(run)
@@ -0,0 +1,295 @@
+# wiki/jobs.py
+"""
+Background processing of PDF and office-document guide imports.
+
+Jobs live in the ImportJob table, so there is no broker to run: a small pool
+of worker threads inside each Django process claims queued jobs with an
+atomic UPDATE and renews a lease while it works: a heartbeat thread keeps
+it fresh however long the job waits for a document converter or spends
+in soffice.  If a process dies the lease runs out and any other worker
+picks the job up again.
+
+`manage.py import_worker` runs the same pool as a standalone process, for
+deployments that set WIKI_IMPORT_WORKERS = 0 in the web processes.
+"""
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import convert, metrics, reimport
+from .drafts import DraftStore, collect_garbage
+from .models import ImportJob
+from .uploads import UploadRejected
+
+logger = logging.getLogger(__name__)
+
+LEASE = timedelta(minutes=2)     # renewed by the heartbeat and on every processed page
+HEARTBEAT = 30                   # seconds between lease renewals of a running job
+POLL_INTERVAL = 5                # seconds between idle queue checks
+MAX_ATTEMPTS = 3                 # crashed runs before a job is given up
+GC_INTERVAL = 3600               # seconds between sweeps of expired drafts
+
+
+def _claimable():
+    return Q(status=ImportJob.QUEUED) | Q(
+        status=ImportJob.RUNNING, lease_expires__lt=timezone.now()
+    )
+
+
+def claim_next():
+    """
+    Atomically take the oldest runnable job, or return None.
+
+    The conditional UPDATE only succeeds for one worker, so several threads
+    and processes can poll the same table safely.
+    """
+    candidates = (
+        ImportJob.objects.filter(_claimable())
+        .order_by('created_at')
+        .values_list('pk', flat=True)[:5]
+    )
+    for pk in candidates:
+        claimed = ImportJob.objects.filter(_claimable(), pk=pk).update(
+            status=ImportJob.RUNNING,
+            lease_expires=timezone.now() + LEASE,
+            attempts=F('attempts') + 1,
+            error='',
+        )
+        if claimed:
+            return ImportJob.objects.get(pk=pk)
+    return None
+
+
+def _report_progress(job_id, done, total):
+    ImportJob.objects.filter(pk=job_id).update(
+        pages_done=done,
+        pages_total=total,
+        lease_expires=timezone.now() + LEASE,
+        updated_at=timezone.now(),
+    )
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """
+    Renew the job's lease every HEARTBEAT seconds until the block ends.
+
+    Pages report progress themselves, but converting an office document
+    can first wait up to convert.QUEUE_TIMEOUT for a slot and then run
+    soffice twice: without this the lease would run out meanwhile and a
+    second worker would claim the job.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(HEARTBEAT):
+                try:
+                    ImportJob.objects.filter(pk=job_id, status=ImportJob.RUNNING).update(
+                        lease_expires=timezone.now() + LEASE,
+                    )
+                except Exception:
+                    # e.g. the database is locked: try again next beat
+                    logger.warning("Renewing the lease of import job %s failed", job_id,
+                                   exc_info=True)
+        finally:
+            connection.close()      # this thread's own connection
+
+    thread = threading.Thread(target=beat, name=f"import-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _local_copy(job, workdir):
+    """Path of the job's upload on local disk, copied into `workdir` if need be."""
+    suffix = Path(job.original_name).suffix.lower()
+    try:
+        path = Path(job.source.path)
+        if path.suffix.lower() == suffix:
+            return path
+    except NotImplementedError:  # remote storage
+        pass
+    # LibreOffice goes by the extension, so keep the original one
+    target = Path(workdir) / f"source{suffix}"
+    with job.source.open('rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return target
+
+
+def run_job(job):
+    """Convert the uploaded file and store the draft on the job."""
+    # imported here: the helper lives in views.py, which imports this module
+    from .views import _pdf_to_draft
+
+    if job.attempts > MAX_ATTEMPTS:
+        job.status, job.error = ImportJob.FAILED, "Gave up after repeated worker crashes."
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        metrics.IMPORT_JOBS.inc(status=ImportJob.FAILED)
+        return
+    if job.attempts == 1:
+        # updated_at: when it was queued, or requeued by retry()
+        metrics.IMPORT_WAIT.observe((timezone.now() - job.updated_at).total_seconds())
+
+    try:
+        with _heartbeat(job.pk), tempfile.TemporaryDirectory(prefix="ndt-import-") as workdir:
+            source = _local_copy(job, workdir)
+            if convert.is_office_document(job.original_name):
+                source = convert.to_pdf(source, workdir)
+            name = Path(job.original_name).with_suffix('.pdf').name
+            progress = lambda done, total: _report_progress(job.pk, done, total)
+            if job.target_id:
+                # a new revision of an existing guide: the draft is the plan
+                draft = reimport.plan(job.target, source, name, DraftStore(job.pk).save,
+                                      progress=progress)
+            else:
+                draft = _pdf_to_draft(source, name=name, progress=progress,
+                                      save_image=DraftStore(job.pk).save)
+    except Exception as exc:
+        job.status = ImportJob.FAILED
+        if isinstance(exc, UploadRejected):
+            # over the page limit: the user's problem, not a bug
+            job.error = str(exc)
+        else:
+            logger.exception("Import job %s failed", job.pk)
+            job.error = traceback.format_exc(limit=3)
+        job.lease_expires = None
+        job.save(update_fields=['status', 'error', 'lease_expires', 'updated_at'])
+        metrics.IMPORT_JOBS.inc(status=ImportJob.FAILED)
+        return
+
+    job.refresh_from_db(fields=['pages_done', 'pages_total'])
+    job.draft = draft
+    job.status = ImportJob.DONE
+    job.lease_expires = None
+    job.save(update_fields=['draft', 'status', 'lease_expires', 'updated_at'])
+    metrics.IMPORT_JOBS.inc(status=ImportJob.DONE)
+
+
+def retry(job):
+    """Put a failed job back on the queue. Returns False if it isn't failed."""
+    requeued = ImportJob.objects.filter(pk=job.pk, status=ImportJob.FAILED).update(
+        status=ImportJob.QUEUED, attempts=0, pages_done=0, error='',
+        updated_at=timezone.now(),
+    )
+    if requeued:
+        ensure_workers().wake()
+    return bool(requeued)
+
+
+# ──────────────────────────────────────────────────────────────
+#  Worker pool
+# ──────────────────────────────────────────────────────────────
+class WorkerPool:
+    """A fixed number of daemon threads draining the ImportJob queue."""
+
+    def __init__(self, size):
+        self.size = size
+        self.name = f"import-worker-{uuid.uuid4().hex[:6]}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._gc_lock = threading.Lock()
+        self._next_gc = 0.0
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._loop, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            job = None
+            try:
+                close_old_connections()
+                job = claim_next()
+                if job is not None:
+                    run_job(job)
+            except Exception:
+                logger.exception("Import worker %s crashed", threading.current_thread().name)
+            finally:
+                close_old_connections()
+            if job is None:
+                self._collect_garbage()
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _collect_garbage(self):
+        """Sweep expired drafts at most once per GC_INTERVAL, when idle."""
+        if not self._gc_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() < self._next_gc:
+                return
+            self._next_gc = time.monotonic() + GC_INTERVAL
+            removed = collect_garbage()
+            if removed:
+                logger.info("Removed %d expired import drafts", removed)
+        except Exception:
+            logger.exception("Sweeping import drafts failed")
+        finally:
+            close_old_connections()
+            self._gc_lock.release()
+
+
+class _NullPool:
+    """Stand-in when this process runs no workers (WIKI_IMPORT_WORKERS = 0)."""
+
+    def wake(self):
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def ensure_workers():
+    """Start this process's worker pool on first use and return it."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            size = getattr(settings, 'WIKI_IMPORT_WORKERS', 2)
+            _pool = WorkerPool(size).start() if size > 0 else _NullPool()
+    return _pool
+
+
+def enqueue(uploaded, user=None, category=None, target=None):
+    """
+    Store the upload as a new job and nudge the workers.  With `target`
+    (a guide) the file is re-imported into it, see wiki/reimport.py.
+    """
+    metrics.UPLOAD_BYTES.observe(uploaded.size)
+    job = ImportJob(user=user, category=category, target=target,
+                    original_name=uploaded.name)
+    job.source.save(Path(uploaded.name).name, uploaded, save=False)
+    job.save()
+    ensure_workers().wake()
+    return job
@@ -0,0 +1,91 @@
+# wiki/management/commands/bench_rasterize.py
+"""
+Per-page throughput of the PDF import rasterizer on a synthetic document.
+
+Compares the old approach (thumbnail and full image rendered separately,
+one page after another) with wiki.rasterize, both on one core and on the
+process pool.
+"""
+import base64
+import random
+import time
+
+import fitz
+from django.core.management.base import BaseCommand
+
+from wiki import rasterize
+
+
+def synthetic_pdf(pages):
+    """
+    A4 pages shaped like our scanned work instructions: a heading, numbered
+    text, a photo (noise JPEG, shared by all pages) and some vector drawing.
+    """
+    noise = random.Random(0).randbytes(1600 * 1200 * 3)
+    photo = fitz.Pixmap(fitz.csRGB, 1600, 1200, noise, False).tobytes("jpg")
+
+    doc = fitz.open()
+    photo_xref = 0
+    for n in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Work instruction page {n}", fontsize=18)
+        body = "\n".join(f"{i}. Tighten bolt {i} on fixture {n} to spec." for i in range(1, 13))
+        page.insert_text((72, 110), body, fontsize=10)
+        photo_xref = page.insert_image(fitz.Rect(72, 300, 523, 638),
+                                       stream=None if photo_xref else photo,
+                                       xref=photo_xref)
+        for i in range(40):
+            r = fitz.Rect(72 + i * 11, 660, 78 + i * 11, 660 + (i * 7 + n) % 120)
+            page.draw_rect(r, color=(0, 0.3, 0.5), fill=(0.2, 0.5 + i / 100, 0.8))
+    return doc.tobytes()
+
+
+def legacy_render(data):
+    """The pre-rasterize.py loop: two renders per page, single core."""
+    doc = fitz.open(stream=data, filetype="pdf")
+    for page in doc:
+        for width in (rasterize.THUMB_W, rasterize.FULL_W):
+            zoom = width / page.rect.width
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB)
+            base64.b64encode(pix.tobytes("png")).decode()
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Benchmark PDF page rasterization for guide imports."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=3,
+                            help="Runs per variant; the fastest one is reported")
+
+    def handle(self, *args, **options):
+        pages = options["pages"]
+        data = synthetic_pdf(pages)
+        numbers = range(pages)
+
+        # start the pool outside the timed runs
+        list(rasterize.render_pages(data, range(rasterize.PARALLEL_MIN_PAGES)))
+
+        runs = [
+            ("legacy (2 renders/page, 1 core)", lambda: legacy_render(data)),
+            ("render-once, 1 core", lambda: list(
+                rasterize.render_pages(data, numbers, parallel=False))),
+            (f"render-once, {rasterize.pool_size()} processes", lambda: list(
+                rasterize.render_pages(data, numbers))),
+        ]
+
+        self.stdout.write(f"{pages}-page synthetic PDF ({len(data) / 1024:.0f} KiB)")
+        baseline = None
+        for label, fn in runs:
+            elapsed = min(_timed(fn) for _ in range(options["repeat"]))
+            baseline = baseline or elapsed
+            self.stdout.write(
+                f"  {label:<36} {elapsed:7.2f}s  {pages / elapsed:7.1f} pages/s"
+                f"  x{baseline / elapsed:.1f}"
+            )
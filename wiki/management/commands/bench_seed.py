@@ -0,0 +1,151 @@
+# wiki/management/commands/bench_seed.py
+"""
+Fill the database with synthetic categories, pages and guide steps for
+`manage.py bench_views`.
+
+    manage.py bench_seed --categories 100 --pages 50000 --steps 500000
+
+Run it against a scratch database, not production.  Everything it creates
+lives in categories named "Bench NNN" (slugs bench-NNN), so --clear removes
+it again.  Rows are written with bulk_create, so no signals fire: the
+search index is rebuilt at the end, and no revisions are recorded.
+"""
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from wiki.cache import bump_category_generation, forget_category_counts
+from wiki.models import Category, GuideStep, WikiPage
+from wiki.search import get_backend
+
+BATCH = 2000
+PREFIX = "Bench "
+
+# Domain words first, so searches for them hit many pages; the generated
+# ones make up a long tail of rare terms.
+DOMAIN_WORDS = (
+    "ultrasonic probe weld crack calibration phased array eddy current "
+    "radiography penetrant magnetic particle inspection thickness gauge "
+    "couplant transducer wedge fixture bolt torque specimen defect flaw "
+    "indication acceptance report operator procedure setup scan"
+).split()
+
+
+def vocabulary(size, rng):
+    """Words and Zipf-like cumulative weights: the domain words are the most frequent."""
+    letters = "etaoinshrdlucmfwypvbgk"
+    words, seen = list(DOMAIN_WORDS), set(DOMAIN_WORDS)
+    while len(words) < size:
+        word = "".join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    weights = list(accumulate(1 / rank for rank in range(1, size + 1)))
+    return words, weights
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic wiki content (or --clear it) for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=100)
+        parser.add_argument("--pages", type=int, default=50_000)
+        parser.add_argument("--steps", type=int, default=500_000,
+                            help="Guide steps in total, spread over the guides")
+        parser.add_argument("--guides", type=float, default=0.5,
+                            help="Share of pages that are guides (default: 0.5)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--clear", action="store_true",
+                            help="Delete earlier benchmark data and stop")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if self.clear():
+            self.stdout.write("Removed earlier benchmark data")
+        if options["clear"]:
+            get_backend().rebuild()
+            bump_category_generation()
+            forget_category_counts()
+            return
+
+        rng = random.Random(options["seed"])
+        self.words, self.weights = vocabulary(5000, rng)
+        author = User.objects.filter(is_superuser=True).first()
+
+        categories = Category.objects.bulk_create([
+            Category(name=f"{PREFIX}{i:03d}", slug=f"bench-{i:03d}")
+            for i in range(1, options["categories"] + 1)
+        ])
+
+        n_pages = options["pages"]
+        n_guides = round(n_pages * options["guides"])
+        per_guide, extra = divmod(options["steps"], max(n_guides, 1))
+        pages = steps = 0
+        for start in range(0, n_pages, BATCH):
+            with transaction.atomic():
+                batch = []
+                for n in range(start, min(start + BATCH, n_pages)):
+                    # guides and notes interleaved, in every category
+                    is_guide = n * n_guides // n_pages != (n + 1) * n_guides // n_pages
+                    batch.append(WikiPage(
+                        title=self.sentence(rng, 3, 8).rstrip(".").title(),
+                        slug=f"bench-{n + 1}",
+                        content="\n\n".join(self.sentence(rng, 20, 60) for _ in range(rng.randint(1, 6))),
+                        category=categories[n % len(categories)],
+                        author=author,
+                        page_type=WikiPage.GUIDE if is_guide else WikiPage.NOTE,
+                    ))
+                WikiPage.objects.bulk_create(batch)
+                pages += len(batch)
+
+                guide_steps = []
+                for page in batch:
+                    if page.page_type != WikiPage.GUIDE:
+                        continue
+                    count = per_guide + (1 if extra > 0 else 0)
+                    extra -= 1
+                    guide_steps.extend(
+                        GuideStep(wiki_page=page, step_order=i, step_content=self.sentence(rng, 6, 30))
+                        for i in range(1, count + 1)
+                    )
+                GuideStep.objects.bulk_create(guide_steps, batch_size=BATCH)
+                steps += len(guide_steps)
+            self.stdout.write(f"  {pages}/{n_pages} pages, {steps} steps")
+
+        self.stdout.write("Rebuilding the search index …")
+        get_backend().rebuild()
+        bump_category_generation()
+        forget_category_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(categories)} categories, {pages} pages and {steps} steps "
+            f"in {time.monotonic() - started:.0f}s"
+        ))
+
+    def clear(self):
+        """
+        Delete the benchmark categories with plain DELETEs: the ORM would
+        load every step and page to send their delete signals.
+        """
+        categories = Category.objects.filter(name__startswith=PREFIX)
+        if not categories.exists():
+            return False
+        pages = WikiPage.objects.filter(category__in=categories).values("pk")
+        with transaction.atomic(), connection.cursor() as cur:
+            for rel in WikiPage._meta.related_objects:
+                sql, params = pages.query.sql_with_params()
+                cur.execute(
+                    f"DELETE FROM {rel.related_model._meta.db_table} "
+                    f"WHERE {rel.field.column} IN ({sql})", params
+                )
+            sql, params = pages.query.sql_with_params()
+            cur.execute(f"DELETE FROM {WikiPage._meta.db_table} WHERE id IN ({sql})", params)
+            categories.delete()
+        return True
+
+    def sentence(self, rng, low, high):
+        words = rng.choices(self.words, cum_weights=self.weights, k=rng.randint(low, high))
+        return " ".join(words).capitalize() + "."
@@ -0,0 +1,273 @@
+# wiki/management/commands/bench_views.py
+"""
+Latency, query count and peak memory of the wiki views and the PDF
+importer, written as JSON that later runs can be compared against.
+
+    manage.py bench_seed --pages 50000 --steps 500000     # once
+    manage.py bench_views --output before.json
+    ... change things ...
+    manage.py bench_views --output after.json --compare before.json
+
+Requests go through the test client, i.e. the full middleware stack, as an
+anonymous visitor.  Every scenario runs --requests times for the latency
+percentiles, then a few more times under tracemalloc and query capture
+(tracing slows Python down, so those runs are not timed).  Peak memory is
+the Python heap of this process only; pages rendered on the rasterizer's
+process pool don't show up in it.
+
+With --compare the command fails when a scenario got slower at the median
+by more than --threshold percent, allocates that much more, or runs more
+queries, so it can gate a deploy.
+"""
+import json
+import platform
+import re
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from wiki.management.commands.bench_rasterize import synthetic_pdf
+from wiki.management.commands.bench_seed import DOMAIN_WORDS
+from wiki.management.commands.export_static import _default_host
+from wiki import pagination as keyset
+from wiki.models import Category, GuideStep, WikiPage
+from wiki.views import _pdf_to_draft
+
+TRACED_RUNS = 3
+PDF_RUNS = 3
+MIN_SLOWDOWN_MS = 1.0     # ignore "regressions" smaller than this
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = "Benchmark the wiki views and the PDF importer; write JSON results and compare runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50,
+                            help="Timed runs per scenario (default: 50)")
+        parser.add_argument("--pdf-pages", type=int, default=20,
+                            help="Pages of the synthetic PDF for the importer (default: 20)")
+        parser.add_argument("--only", help="Regex: run only the scenarios whose name matches")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--compare", help="Results of an earlier run to compare with")
+        parser.add_argument("--threshold", type=float, default=20,
+                            help="Percent slower / bigger that counts as a regression (default: 20)")
+        parser.add_argument("--host", default=_default_host(),
+                            help="Host name to send (must be in ALLOWED_HOSTS)")
+
+    def handle(self, *args, **options):
+        self.client = Client(HTTP_HOST=options["host"])
+        self.etags = {}
+        results = {}
+        with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+            self.workdir = Path(workdir)
+            scenarios = self.scenarios(options)
+            if options["only"]:
+                scenarios = [s for s in scenarios if re.search(options["only"], s[0])]
+            if not scenarios:
+                raise CommandError("Nothing to run (no pages? try manage.py bench_seed first)")
+
+            for name, run in scenarios:
+                results[name] = r = self.measure(
+                    run, PDF_RUNS if name == "pdf_to_draft" else options["requests"])
+                self.stdout.write(
+                    f"  {name:<32} p50 {r['p50_ms']:8.2f}ms  p90 {r['p90_ms']:8.2f}ms  "
+                    f"p99 {r['p99_ms']:8.2f}ms  {r['queries']:4d} queries  {r['peak_kib']:9.0f} KiB"
+                )
+
+        report = {"meta": self.meta(options), "results": results}
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=1, sort_keys=True))
+            self.stdout.write(f"Wrote {options['output']}")
+        if options["compare"]:
+            self.compare(json.loads(Path(options["compare"]).read_text()), report, options["threshold"])
+
+    # ── scenarios ────────────────────────────────────────────────
+    def scenarios(self, options):
+        """(name, run) pairs; run(i) performs request i and returns the response."""
+        get = self.client.get
+        category = (Category.objects.filter(pages__isnull=False)
+                    .order_by("-pk").first())
+        guides, notes = self.sample(WikiPage.GUIDE), self.sample(WikiPage.NOTE)
+        busiest = (GuideStep.objects.values_list("wiki_page__slug", flat=True)
+                   .order_by("-step_order").first())
+        if category is None or not (guides or notes):
+            return []
+
+        scenarios = [
+            ("home", lambda i: get(reverse("wiki:home"))),
+            ("category_detail", lambda i: get(reverse("wiki:category_detail", args=[category.slug]))),
+        ]
+        older = self.older_link(category)
+        if older:
+            scenarios.append(("category_detail_deep", lambda i: get(older)))
+
+        def uncached(slugs):
+            def run(i):
+                cache.clear()
+                return get(reverse("wiki:page_detail", args=[slugs[i % len(slugs)]]))
+            return run
+
+        for kind, slugs in (("guide", guides), ("note", notes)):
+            if not slugs:
+                continue
+            url = reverse("wiki:page_detail", args=[slugs[0]])
+            scenarios += [
+                (f"page_detail_{kind}", uncached(slugs)),
+                (f"page_detail_{kind}_cached", lambda i, url=url: get(url)),
+            ]
+        if busiest:
+            scenarios.append(("page_detail_longest_guide", uncached([busiest])))
+
+        etag_url = reverse("wiki:page_detail", args=[(guides or notes)[0]])
+        scenarios.append(("page_detail_304", lambda i: get(
+            etag_url, HTTP_IF_NONE_MATCH=self.etag(etag_url))))
+        scenarios.append(("page_history", lambda i: get(
+            reverse("wiki:page_history", args=[(guides or notes)[0]]))))
+
+        search = reverse("wiki:search")
+        common, rare = DOMAIN_WORDS[0], self.rare_word()
+        scenarios += [
+            ("search_common", lambda i: get(search, {"q": common})),
+            ("search_common_page5", lambda i: get(search, {"q": common, "page": 5})),
+            ("search_two_words", lambda i: get(search, {"q": f"{DOMAIN_WORDS[1]} {DOMAIN_WORDS[2]}"})),
+        ]
+        if rare:
+            scenarios.append(("search_rare", lambda i: get(search, {"q": rare})))
+        suggest = reverse("wiki:search_suggest")
+        scenarios.append(("search_suggest", lambda i: get(suggest, {"q": common[:1 + i % len(common)]})))
+
+        api_pages = reverse("wiki:api_pages")
+        scenarios += [
+            ("api_pages", lambda i: get(api_pages)),
+            ("api_pages_with_steps", lambda i: get(
+                api_pages, {"type": "guide", "fields": "id,title,steps", "limit": 100})),
+            ("api_page", lambda i: get(reverse("wiki:api_page", args=[(guides or notes)[i % len(guides or notes)]]))),
+        ]
+
+        pdf = self.workdir / "synthetic.pdf"
+        pdf.write_bytes(synthetic_pdf(options["pdf_pages"]))
+        scenarios.append(("pdf_to_draft", lambda i: _pdf_to_draft(pdf, save_image=len)))
+        return scenarios
+
+    def sample(self, page_type, size=500):
+        """Up to `size` slugs spread evenly over the table, the same every run."""
+        slugs = list(WikiPage.objects.filter(page_type=page_type)
+                     .order_by("pk").values_list("slug", flat=True))
+        return slugs[::max(1, len(slugs) // size)][:size]
+
+    def older_link(self, category):
+        """The category page halfway down its guides, as an "Older" link would fetch it."""
+        guides = (WikiPage.objects.filter(category=category, page_type=WikiPage.GUIDE)
+                  .order_by(*keyset.ordering()).values_list("created_at", "pk"))
+        middle = guides[guides.count() // 2:][:1]
+        if middle:
+            url = reverse("wiki:category_detail", args=[category.slug])
+            return f"{url}?guides={keyset.encode_cursor(*middle[0])}"
+
+    def etag(self, url):
+        # fetched when the scenario first runs: the scenarios before it
+        # clear the cache, which moves the ETags
+        if url not in self.etags:
+            self.etags[url] = self.client.get(url)["ETag"]
+        return self.etags[url]
+
+    def rare_word(self):
+        # the last word of some page title: most are rare in generated text
+        title = WikiPage.objects.order_by("-pk").values_list("title", flat=True).first() or ""
+        words = re.findall(r"\w{4,}", title)
+        return words[-1].lower() if words else None
+
+    # ── measuring ────────────────────────────────────────────────
+    def measure(self, run, n):
+        self.expect_ok(run(0))       # warm up, and fail early on errors
+        timings = []
+        for i in range(n):
+            started = time.perf_counter()
+            self.expect_ok(run(i))
+            timings.append((time.perf_counter() - started) * 1000)
+
+        queries = peak = 0
+        for i in range(TRACED_RUNS):
+            tracemalloc.start()
+            try:
+                with CaptureQueriesContext(connection) as captured:
+                    self.expect_ok(run(i))
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            queries = max(queries, len(captured))
+
+        timings.sort()
+        return {
+            "n": n,
+            "p50_ms": percentile(timings, 50),
+            "p90_ms": percentile(timings, 90),
+            "p99_ms": percentile(timings, 99),
+            "max_ms": timings[-1],
+            "mean_ms": sum(timings) / n,
+            "queries": queries,
+            "peak_kib": peak / 1024,
+        }
+
+    def expect_ok(self, response):
+        status = getattr(response, "status_code", 200)
+        if status not in (200, 304):
+            raise CommandError(f"{response.request['PATH_INFO']} answered {status}")
+
+    def meta(self, options):
+        return {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "categories": Category.objects.count(),
+            "pages": WikiPage.objects.count(),
+            "steps": GuideStep.objects.count(),
+            "pdf_pages": options["pdf_pages"],
+        }
+
+    # ── comparing ────────────────────────────────────────────────
+    def compare(self, old, new, threshold):
+        if old["meta"].get("pages") != new["meta"]["pages"]:
+            self.stdout.write(self.style.WARNING(
+                f"Different data: {old['meta'].get('pages')} pages then, {new['meta']['pages']} now"
+            ))
+        limit = 1 + threshold / 100
+        regressions = []
+        self.stdout.write(f"{'scenario':<32} {'p50 then':>10} {'p50 now':>10} {'queries':>9} {'peak KiB':>17}")
+        for name, now in new["results"].items():
+            then = old["results"].get(name)
+            if then is None:
+                continue
+            self.stdout.write(
+                f"{name:<32} {then['p50_ms']:9.2f}ms {now['p50_ms']:9.2f}ms "
+                f"{then['queries']:4d}→{now['queries']:<4d} {then['peak_kib']:8.0f}→{now['peak_kib']:<8.0f}"
+            )
+            if (now["p50_ms"] > then["p50_ms"] * limit
+                    and now["p50_ms"] - then["p50_ms"] > MIN_SLOWDOWN_MS):
+                regressions.append(f"{name}: median {then['p50_ms']:.2f}ms → {now['p50_ms']:.2f}ms")
+            if now["queries"] > then["queries"]:
+                regressions.append(f"{name}: {then['queries']} → {now['queries']} queries")
+            if now["peak_kib"] > then["peak_kib"] * limit and now["peak_kib"] - then["peak_kib"] > 64:
+                regressions.append(f"{name}: peak {then['peak_kib']:.0f} → {now['peak_kib']:.0f} KiB")
+        if regressions:
+            for line in regressions:
+                self.stderr.write(f"  {line}")
+            raise CommandError(f"{len(regressions)} regressions")
+        self.stdout.write(self.style.SUCCESS("No regressions."))
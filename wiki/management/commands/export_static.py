@@ -0,0 +1,209 @@
+# wiki/management/commands/export_static.py
+"""
+Export the read-only wiki as static HTML, for nginx to serve without Django.
+
+    manage.py export_static /srv/wiki-static
+
+Writes the home page, every category page and every wiki page as
+<url>/index.html, and copies (hard-links where possible) the media files
+they reference into <dir>/media/.  Serve it with something like
+
+    root /srv/wiki-static;
+    location /static/ { alias <STATIC_ROOT>/; }       # after collectstatic
+    location / { try_files $uri $uri/index.html @django; }
+
+Search, editing, imports and older category listing pages (the ?guides= /
+?notes= cursors) still need Django behind @django.
+
+Rebuilds are incremental.  <dir>/.export-manifest.json remembers a
+fingerprint of every exported url: for pages their updated_at and version
+(which moves when a step, media file or link changes), for category pages
+their page list, plus for all of them the navbar's category names and
+the templates.  The navbar's page counts only count for the home and
+category pages: an exported page keeps the counts it was rendered with
+until it changes.  Only urls whose fingerprint changed are rendered again,
+on a pool of worker processes; files of deleted pages and media nobody
+references any more are removed.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from wiki import static_export
+from wiki.cache import category_counts_digest, category_snapshot, template_version
+from wiki.models import WikiPage
+
+MANIFEST = ".export-manifest.json"
+CHUNK = 25      # urls per worker task
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+
+
+def _default_host():
+    concrete = [h for h in settings.ALLOWED_HOSTS if h != "*" and not h.startswith(".")]
+    return concrete[0] if concrete else "localhost"
+
+
+class Command(BaseCommand):
+    help = "Render the wiki to static HTML (incrementally) so a web server can serve it without Django."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Render processes (default: CPU count)")
+        parser.add_argument("--full", action="store_true",
+                            help="Ignore the manifest and render everything")
+        parser.add_argument("--host", default=_default_host(),
+                            help="Host name to render as (must be in ALLOWED_HOSTS)")
+
+    def handle(self, *args, **options):
+        outdir = Path(options["directory"])
+        outdir.mkdir(parents=True, exist_ok=True)
+        manifest_path = outdir / MANIFEST
+        old = {}
+        if manifest_path.exists() and not options["full"]:
+            old = json.loads(manifest_path.read_text()).get("urls", {})
+
+        started = time.monotonic()
+        fingerprints = self.fingerprints()
+        stale = [url for url, fp in fingerprints.items()
+                 if url not in old or old[url].get("fingerprint") != fp]
+        self.stdout.write(f"{len(fingerprints)} urls, {len(stale)} to render")
+
+        entries = {url: old[url] for url in fingerprints if url in old}
+        errors = []
+        for result in self.render(outdir, stale, options):
+            url = result["url"]
+            if "error" in result:
+                errors.append((url, result["error"]))
+                if url in entries:
+                    # keep serving the last good copy, try again next time
+                    entries[url] = {**entries[url], "fingerprint": None}
+                continue
+            entries[url] = {
+                "file": result["file"],
+                "media": result["media"],
+                # images still being converted: render again next time
+                "fingerprint": None if result["pending"] else fingerprints[url],
+            }
+
+        self.remove_deleted(outdir, old, entries)
+        copied, removed = self.sync_media(outdir, old, entries)
+        static_export.write_atomic(
+            manifest_path, json.dumps({"urls": entries}, indent=1, sort_keys=True).encode()
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {len(stale) - len(errors)} urls in {time.monotonic() - started:.1f}s; "
+            f"media: {copied} copied, {removed} removed."
+        ))
+        if errors:
+            for url, error in errors:
+                self.stderr.write(f"  {url}: {error}")
+            raise CommandError(f"{len(errors)} urls failed to render")
+
+    # ── what to render ───────────────────────────────────────────
+    def fingerprints(self):
+        """url -> fingerprint of everything its HTML depends on (2 queries)."""
+        categories = category_snapshot()
+        site = _digest(
+            template_version(),
+            [(c.pk, c.name, c.slug, c.custom_template) for c in categories],
+        )
+        # page counts (navbar) only make the listings stale, not every page:
+        # a new page elsewhere would otherwise re-render the whole site
+        counts = category_counts_digest()
+        urls = {reverse("home"): _digest(site, counts), reverse("wiki:home"): _digest(site, counts)}
+
+        listing = defaultdict(list)
+        rows = WikiPage.objects.values_list(
+            "pk", "slug", "title", "page_type", "category_id", "author__username",
+            "created_at", "updated_at", "version",
+        ).order_by("pk")
+        for pk, slug, title, page_type, category_id, author, created, updated, version in rows:
+            urls[reverse("wiki:page_detail", args=[slug])] = _digest(site, pk, updated, version, author)
+            listing[category_id].append((pk, slug, title, page_type, author, created))
+        for category in categories:
+            urls[reverse("wiki:category_detail", args=[category.slug])] = _digest(
+                site, counts, listing[category.pk]
+            )
+        return urls
+
+    # ── rendering ────────────────────────────────────────────────
+    def render(self, outdir, urls, options):
+        if not urls:
+            return
+        secure = getattr(settings, "SECURE_SSL_REDIRECT", False)
+        chunks = [urls[i:i + CHUNK] for i in range(0, len(urls), CHUNK)]
+        workers = max(1, min(options["workers"], len(chunks)))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=static_export.init_worker,
+            initargs=(options["host"],),
+        ) as executor:
+            futures = [executor.submit(static_export.render, str(outdir), chunk, secure)
+                       for chunk in chunks]
+            done = 0
+            for future in as_completed(futures):
+                for result in future.result():
+                    done += 1
+                    yield result
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"  {done}/{len(urls)}")
+
+    # ── cleanup and media ────────────────────────────────────────
+    def remove_deleted(self, outdir, old, entries):
+        for url, entry in old.items():
+            if url not in entries:
+                path = outdir / entry["file"]
+                path.unlink(missing_ok=True)
+                try:
+                    path.parent.rmdir()
+                except OSError:
+                    pass
+
+    def sync_media(self, outdir, old, entries):
+        wanted = {name for entry in entries.values() for name in entry["media"]}
+        previous = {name for entry in old.values() for name in entry["media"]}
+        media_root = outdir / settings.MEDIA_URL.strip("/")
+        copied = removed = 0
+
+        for name in sorted(wanted):
+            target = media_root / name
+            try:
+                source = Path(default_storage.path(name))
+            except NotImplementedError:
+                raise CommandError("export_static needs MEDIA files on local disk")
+            if not source.exists():
+                continue
+            if target.exists():
+                # blobs and derivatives never change under the same name
+                stat, src = target.stat(), source.stat()
+                if stat.st_size == src.st_size and stat.st_mtime >= src.st_mtime:
+                    continue
+                target.unlink()
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            copied += 1
+
+        for name in previous - wanted:
+            (media_root / name).unlink(missing_ok=True)
+            removed += 1
+        return copied, removed
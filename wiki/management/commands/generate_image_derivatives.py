@@ -0,0 +1,41 @@
+# wiki/management/commands/generate_image_derivatives.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wiki import images
+from wiki.models import GuideStep, MediaFile
+
+
+class Command(BaseCommand):
+    help = "Create responsive image derivatives for existing GuideStep and MediaFile files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true",
+                            help="Regenerate derivatives that already exist")
+
+    def handle(self, *args, **options):
+        if images.Image is None:
+            raise CommandError("Pillow is not installed; no derivatives can be generated.")
+        self.stdout.write(f"Formats: {', '.join(images.available_formats()) or 'fallback only'}")
+
+        started = time.perf_counter()
+        seen, made, skipped = set(), 0, 0
+        for model in (GuideStep, MediaFile):
+            for fieldfile in (obj.file for obj in model.objects.exclude(file="").exclude(file__isnull=True).only("file")):
+                if fieldfile.name in seen:
+                    continue
+                seen.add(fieldfile.name)
+                if not fieldfile.storage.exists(fieldfile.name):
+                    self.stderr.write(f"missing: {fieldfile.name}")
+                    continue
+                manifest = images.generate(fieldfile.name, fieldfile.storage, force=options["force"])
+                if manifest and manifest["image"]:
+                    made += 1
+                else:
+                    skipped += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{made} images have derivatives, {skipped} files are not images "
+            f"({time.perf_counter() - started:.1f}s)."
+        ))
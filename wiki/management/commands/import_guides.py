@@ -0,0 +1,219 @@
+# wiki/management/commands/import_guides.py
+"""
+Bulk import of a directory tree of manuals (PDF and office documents).
+
+    manage.py import_guides /srv/manuals --category Archive --user admin
+
+Every file becomes a guide, one step per page, exactly as the browser
+import would draft it.  The first subdirectory below the root names the
+category (created if missing); files directly in the root go to
+--category.
+
+Files are converted and rendered on a process pool.  Their images go
+straight to blob storage from the workers, and the parent writes pages and
+steps in batches, one transaction per --batch documents.  Every imported
+file is recorded by content hash (ImportedDocument), so an interrupted
+run simply picks up where it stopped, and files that are already in the
+wiki, under any name, are skipped.
+"""
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from wiki import metrics
+from wiki.bulk_import import draft_file, init_worker
+from wiki.forms import IMPORT_SUFFIXES
+from wiki.models import Category, GuideStep, ImportedDocument, WikiPage
+from wiki.reimport import step_digest
+from wiki.signals import bulk_saved
+from wiki.slugs import allocate_many
+
+RETRIES = 3
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ──────────────────────────────────────────────────────────────
+#  Command
+# ──────────────────────────────────────────────────────────────
+class Command(BaseCommand):
+    help = "Import a directory of PDF and office documents as guides; subdirectories become categories."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--category",
+                            help="Category for files directly in DIRECTORY")
+        parser.add_argument("--user", help="Username to set as author")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Documents converted at once (default: CPU count)")
+        parser.add_argument("--batch", type=int, default=20,
+                            help="Documents written per transaction (default: 20)")
+
+    def handle(self, *args, **options):
+        root = Path(options["directory"])
+        if not root.is_dir():
+            raise CommandError(f"{root} is not a directory")
+        self.author = None
+        if options["user"]:
+            self.author = User.objects.filter(username=options["user"]).first()
+            if self.author is None:
+                raise CommandError(f"No user named {options['user']!r}")
+
+        todo, skipped, self.failures = self.plan(root, options["category"])
+        self.stdout.write(f"{len(todo)} documents to import, {skipped} skipped (already imported or duplicates)")
+
+        self.imported = self.steps = 0
+        started = time.monotonic()
+        pending = []
+        interrupted = False
+        executor = ProcessPoolExecutor(
+            max_workers=max(1, options["workers"]),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+        try:
+            futures = {executor.submit(draft_file, str(item["path"])): item for item in todo}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    item["draft"] = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as exc:
+                    self.fail(item["path"], exc)
+                    continue
+                pending.append(item)
+                if len(pending) >= options["batch"]:
+                    self.write(pending)
+                    pending = []
+                    self.progress(len(todo), started)
+        except KeyboardInterrupt:
+            interrupted = True
+            self.stderr.write("Interrupted, saving what is finished …")
+        except BrokenProcessPool:
+            # a worker died hard (out of memory, killed): stop rather than
+            # report every remaining file as failed
+            interrupted = True
+            self.stderr.write("A worker process died, saving what is finished …")
+        finally:
+            executor.shutdown(wait=not interrupted, cancel_futures=True)
+            self.write(pending)
+
+        self.report(started, interrupted)
+        if interrupted:
+            raise CommandError("Stopped early; run the same command again to continue.")
+
+    # ── planning ─────────────────────────────────────────────────
+    def plan(self, root, default_category):
+        """Hash every candidate file and drop those imported before."""
+        files = sorted(
+            p for p in root.rglob("*")
+            if p.is_file() and p.suffix.lower() in IMPORT_SUFFIXES
+        )
+        hashes = {p: _sha256(p) for p in files}
+        done = set()
+        values = list(set(hashes.values()))
+        for i in range(0, len(values), 500):
+            done.update(ImportedDocument.objects.filter(sha256__in=values[i:i + 500])
+                        .values_list("sha256", flat=True))
+
+        todo, skipped, failures = [], 0, []
+        categories = {}
+        for path in files:
+            digest = hashes[path]
+            if digest in done:
+                skipped += 1
+                continue
+            done.add(digest)    # identical copies under other names, too
+            rel = path.relative_to(root)
+            name = rel.parts[0] if len(rel.parts) > 1 else default_category
+            if not name:
+                failures.append((path, "no category; put it in a subdirectory or pass --category"))
+                continue
+            if name not in categories:
+                categories[name] = self.category(name)
+            todo.append({"path": path, "rel": str(rel), "sha256": digest,
+                         "category": categories[name]})
+        return todo, skipped, failures
+
+    def category(self, name):
+        found = Category.objects.filter(Q(name=name) | Q(slug=slugify(name))).first()
+        return found or Category.objects.create(name=name)
+
+    # ── writing ──────────────────────────────────────────────────
+    def write(self, items):
+        """Store finished drafts as pages and steps, in one transaction."""
+        if not items:
+            return
+        max_length = WikiPage._meta.get_field("slug").max_length
+        for attempt in range(RETRIES):
+            try:
+                with metrics.STEP_SAVE.time(source='bulk'), transaction.atomic():
+                    titles = [item["draft"]["title"] for item in items]
+                    pages = [
+                        WikiPage(title=title, slug=slug, content=item["draft"]["intro"],
+                                 category=item["category"], author=self.author,
+                                 page_type=WikiPage.GUIDE)
+                        for item, title, slug in zip(items, titles, allocate_many(WikiPage, titles, max_length))
+                    ]
+                    WikiPage.objects.bulk_create(pages)
+                    bulk_saved(WikiPage, pages)
+
+                    steps = [
+                        GuideStep(wiki_page=page, step_order=n, step_content=step["text"],
+                                  file=step["full"], source_page=step.get("page"),
+                                  fingerprint=step.get("fingerprint", ""),
+                                  imported_digest=step_digest(step["text"], step["full"]))
+                        for page, item in zip(pages, items)
+                        for n, step in enumerate(item["draft"]["steps"], start=1)
+                    ]
+                    GuideStep.objects.bulk_create(steps, batch_size=500)
+                    bulk_saved(GuideStep, steps)
+
+                    ImportedDocument.objects.bulk_create([
+                        ImportedDocument(page=page, sha256=item["sha256"], path=item["rel"])
+                        for page, item in zip(pages, items)
+                    ])
+                break
+            except IntegrityError:
+                # a page saved meanwhile took one of our slugs: allocate again
+                if attempt == RETRIES - 1:
+                    raise
+        self.imported += len(items)
+        self.steps += len(steps)
+
+    # ── reporting ────────────────────────────────────────────────
+    def fail(self, path, exc):
+        self.failures.append((path, f"{type(exc).__name__}: {exc}"))
+        self.stderr.write(f"FAILED {path}: {exc}")
+
+    def progress(self, total, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"  {self.imported}/{total} imported ({elapsed:.0f}s)")
+
+    def report(self, started, interrupted):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} documents ({self.steps} steps) in {elapsed:.1f}s: "
+            f"{self.imported / elapsed * 60:.1f} documents/min, {self.steps / elapsed:.1f} pages/s"
+        ))
+        if self.failures:
+            self.stdout.write(self.style.WARNING(f"{len(self.failures)} failed:"))
+            for path, error in self.failures:
+                self.stdout.write(f"  {path}: {error}")
@@ -0,0 +1,26 @@
+# wiki/management/commands/import_worker.py
+import signal
+
+from django.core.management.base import BaseCommand
+
+from wiki.jobs import WorkerPool
+
+
+class Command(BaseCommand):
+    help = "Process queued PDF/ODT guide imports until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=2,
+                            help="Number of jobs to process at once (default: 2)")
+
+    def handle(self, *args, **options):
+        pool = WorkerPool(options["threads"]).start()
+        self.stdout.write(f"{pool.name}: {options['threads']} threads waiting for imports")
+
+        signal.signal(signal.SIGTERM, lambda *_: pool.stop())
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pool.stop()
+            pool.join()
+        self.stdout.write("Import worker stopped.")
@@ -0,0 +1,50 @@
+# wiki/management/commands/prune_revisions.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from wiki import revisions
+from wiki.models import PageRevision
+
+
+class Command(BaseCommand):
+    help = ("Delete old page revisions: those beyond the newest --keep of a page "
+            "that are also older than --days.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, default=50,
+                            help="Always keep this many newest revisions per page (default: 50)")
+        parser.add_argument("--days", type=float, default=90,
+                            help="Always keep revisions younger than this (default: 90)")
+        parser.add_argument("--page", help="Only prune the page with this slug")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        keep = max(1, options["keep"])
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        rows = PageRevision.objects.all()
+        if options["page"]:
+            rows = rows.filter(page__slug=options["page"])
+        per_page = rows.values("page_id").annotate(
+            first=Min("number"),
+            last=Max("number"),
+            old=Max("number", filter=Q(created_at__lt=cutoff)),
+        )
+
+        pages = removed = 0
+        for row in per_page:
+            # revisions are numbered in time order, so what goes is always
+            # the oldest stretch of a page's history
+            drop_to = min(row["last"] - keep, row["old"] or 0)
+            if drop_to < row["first"]:
+                continue
+            pages += 1
+            if options["dry_run"]:
+                removed += rows.filter(page_id=row["page_id"], number__lte=drop_to).count()
+            else:
+                removed += revisions.drop_before(row["page_id"], drop_to + 1)
+
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} revisions of {pages} pages."))
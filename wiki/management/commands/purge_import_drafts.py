@@ -0,0 +1,12 @@
+# wiki/management/commands/purge_import_drafts.py
+from django.core.management.base import BaseCommand
+
+from wiki.drafts import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete import drafts and their images older than WIKI_IMPORT_DRAFT_TTL."
+
+    def handle(self, *args, **options):
+        removed = collect_garbage()
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} expired import drafts."))
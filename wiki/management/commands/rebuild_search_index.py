@@ -0,0 +1,19 @@
+# wiki/management/commands/rebuild_search_index.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from wiki.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Drop and rebuild the full-text search index for all wiki pages."
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        started = time.perf_counter()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} pages with {type(backend).__name__} "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,87 @@
+# wiki/management/commands/reimport_guide.py
+"""
+Re-import a new revision of a manual into the guide made from the old one
+(wiki/reimport.py): only the steps of pages that changed are replaced,
+steps edited since the last import are kept.
+
+    manage.py reimport_guide maintenance-manual /srv/manuals/manual-rev7.pdf
+    manage.py reimport_guide maintenance-manual manual-rev7.pdf --dry-run
+
+--dry-run prints what would change without rendering or saving anything.
+Rendered images go straight to blob storage, as with import_guides.
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+
+from wiki import convert, reimport
+from wiki.models import WikiPage
+from wiki.storage import blob_storage
+from wiki.uploads import UploadRejected
+
+
+class Command(BaseCommand):
+    help = "Re-import a new revision of a PDF or office document into an existing guide."
+
+    def add_arguments(self, parser):
+        parser.add_argument("guide", help="Slug of the guide")
+        parser.add_argument("file", help="The new revision of the document")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report what would change")
+
+    def handle(self, *args, **options):
+        guide = WikiPage.objects.filter(slug=options["guide"], page_type=WikiPage.GUIDE).first()
+        if guide is None:
+            raise CommandError(f"No guide {options['guide']!r}")
+        path = Path(options["file"])
+        if not path.is_file():
+            raise CommandError(f"{path} is not a file")
+
+        def save_image(data):
+            return blob_storage.save("import.png", ContentFile(data))
+
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory(prefix="ndt-import-") as workdir:
+            source = path
+            if convert.is_office_document(path.name):
+                source = convert.to_pdf(path, workdir)
+            try:
+                plan = reimport.plan(guide, source, path.with_suffix(".pdf").name, save_image,
+                                     render=not options["dry_run"])
+            except UploadRejected as exc:
+                raise CommandError(str(exc))
+
+        if options["dry_run"]:
+            self._report(plan["report"], "would be")
+            return
+        try:
+            # blob names are what the steps' file field stores
+            report = reimport.apply(guide, plan, lambda name: name)
+        except reimport.ReimportError as exc:
+            raise CommandError(str(exc))
+        self._report(report, "were")
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-imported {path.name} into {guide.title!r} in {time.monotonic() - started:.1f}s."))
+
+    def _report(self, report, verb):
+        def pages(numbers):
+            return f" ({', '.join(map(str, numbers))})" if numbers else ""
+
+        self.stdout.write(f"{len(report['unchanged'])} page(s) unchanged")
+        self.stdout.write(f"{len(report['changed'])} page(s) changed{pages(report['changed'])}: "
+                          f"their steps {verb} replaced")
+        self.stdout.write(f"{len(report['added'])} new page(s){pages(report['added'])}")
+        if report["dismissed"]:
+            self.stdout.write(f"{len(report['dismissed'])} page(s) left out of the guide before"
+                              f"{pages(report['dismissed'])} stay out")
+        self.stdout.write(f"{len(report['removed'])} step(s) whose page is gone"
+                          f"{pages(report['removed'])} {verb} removed")
+        for step, page in report["conflicts"]:
+            self.stdout.write(self.style.WARNING(
+                f"step {step} was edited and its page {page} changed: kept as edited"))
+        if report["kept"]:
+            self.stdout.write(f"{len(report['kept'])} edited or hand-written step(s) kept"
+                              f"{pages(report['kept'])}")
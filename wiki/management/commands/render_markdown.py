@@ -0,0 +1,63 @@
+# wiki/management/commands/render_markdown.py
+"""
+Re-render the stored HTML of pages and guide steps (wiki/markup.py).
+
+    manage.py render_markdown          # rows rendered by an older VERSION
+    manage.py render_markdown --all    # every row
+
+Rows are read and written in batches of --batch, in pk order, with
+bulk_update: no save signals, no revisions.  Until a row is re-rendered
+the views render it on the fly, so this can run after a deploy, not
+before it.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wiki import markup
+from wiki.cache import touch_pages
+from wiki.models import GuideStep, WikiPage
+
+
+class Command(BaseCommand):
+    help = "Re-render stored page and step HTML after the Markdown renderer changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Re-render every row, not just the outdated ones")
+        parser.add_argument("--batch", type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model, page_field in ((WikiPage, "pk"), (GuideStep, "wiki_page_id")):
+            rows = model.objects.all()
+            if not options["all"]:
+                rows = rows.exclude(html_version=markup.VERSION)
+            rendered = changed = 0
+            last = 0
+            while True:
+                with transaction.atomic():
+                    batch = list(
+                        rows.filter(pk__gt=last).order_by("pk")
+                        .only("pk", page_field, model.markdown_field, "html", "html_version")
+                        [:options["batch"]]
+                    )
+                    if not batch:
+                        break
+                    touched = set()
+                    for row in batch:
+                        # a row at the current version was shown as stored; one
+                        # that wasn't has been rendered on the fly all along
+                        shown = row.html if row.html_version == markup.VERSION else None
+                        row.render_html()
+                        if shown is not None and shown != row.html:
+                            touched.add(getattr(row, page_field))
+                    model.objects.bulk_update(batch, ["html", "html_version"])
+                    if touched:
+                        touch_pages(touched)     # their cached renderings are stale
+                rendered += len(batch)
+                changed += len(touched)
+                last = batch[-1].pk
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural}: {rendered} rendered, "
+                f"{changed} page(s) whose output changed"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Stored HTML is at renderer version {markup.VERSION}."))
@@ -0,0 +1,101 @@
+# wiki/management/commands/sweep_blobs.py
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from wiki import images
+from wiki.models import Blob, GuideStep, MediaFile
+from wiki.storage import blob_storage, is_blob
+
+
+class Command(BaseCommand):
+    help = "Delete content-addressed blobs that no GuideStep or MediaFile references."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--adopt", action="store_true",
+                            help="Move files uploaded before blob storage into it first")
+        parser.add_argument("--recount", action="store_true",
+                            help="Recompute reference counts from the database first")
+        parser.add_argument("--grace-hours", type=float, default=24,
+                            help="Keep unreferenced blobs younger than this (default: 24), "
+                                 "so uploads still being saved aren't swept")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["adopt"] and not options["dry_run"]:
+            self.adopt()
+            options["recount"] = True
+        if options["recount"]:
+            self.recount()
+
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        counts = dict(Blob.objects.values_list("name", "refcount"))
+        removed = freed = 0
+
+        for name in blob_storage.iter_blobs():
+            if counts.get(name, 0) > 0:
+                continue
+            if blob_storage.get_modified_time(name) >= cutoff:
+                continue
+            if not options["dry_run"] and not self.claim(name, cutoff):
+                continue
+            freed += blob_storage.size(name)
+            removed += 1
+            if not options["dry_run"]:
+                blob_storage.delete(name)
+                images.discard(name)
+
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {removed} unreferenced blobs ({freed / 1024 / 1024:.1f} MiB)."
+        ))
+
+    def claim(self, name, cutoff):
+        """
+        Take the blob's row away if it is still at zero references (the
+        counts above were read at the start).  A blob reused meanwhile has
+        a reference by now, or at least a fresh mtime (storage.py), and
+        stays.
+        """
+        Blob.objects.bulk_create([Blob(name=name)], ignore_conflicts=True)
+        if not Blob.objects.filter(name=name, refcount=0).delete()[0]:
+            return False
+        return blob_storage.get_modified_time(name) < cutoff
+
+    def adopt(self):
+        """Re-store pre-blob uploads (guide_steps/, wiki_media/) by content hash."""
+        adopted = 0
+        legacy_names = set()
+        for model in (GuideStep, MediaFile):
+            rows = model.objects.exclude(file="").exclude(file__isnull=True)
+            for pk, name in rows.values_list("pk", "file"):
+                if is_blob(name) or not blob_storage.exists(name):
+                    continue
+                with blob_storage.open(name, "rb") as fh:
+                    blob = blob_storage.save(name, fh)
+                model.objects.filter(pk=pk).update(file=blob)
+                legacy_names.add(name)
+                adopted += 1
+        for name in legacy_names:
+            blob_storage.delete(name)
+        self.stdout.write(f"Adopted {adopted} legacy files into blob storage.")
+
+    def recount(self):
+        names = Counter()
+        for model in (GuideStep, MediaFile):
+            names.update(
+                n for n in model.objects.values_list("file", flat=True) if is_blob(n)
+            )
+        with transaction.atomic():
+            Blob.objects.exclude(name__in=names).update(refcount=0)
+            existing = set(Blob.objects.values_list("name", flat=True))
+            Blob.objects.bulk_create(
+                [Blob(name=n, refcount=c) for n, c in names.items() if n not in existing]
+            )
+            for name, count in names.items():
+                if name in existing:
+                    Blob.objects.filter(name=name).update(refcount=count)
+        self.stdout.write(f"Recounted references for {len(names)} blobs.")
@@ -0,0 +1,181 @@
+# wiki/markup.py
+"""
+Markdown for page and step content, compiled to HTML when a row is saved
+(see MarkdownContent in models.py) instead of on every view.
+
+A small subset, no third-party parser:
+
+    # Heading … ######           - / * / + bullet lists, 1. numbered lists
+    **bold**, __bold__           > quotes
+    *italic*, _italic_           ``` fenced code ```   (not inside words)
+    `code`                       [text](https://link), <https://link>
+    ---                          (a rule)
+
+Other text is treated the way the templates' |linebreaks filter always did:
+blank lines separate paragraphs and single newlines become <br>, so
+existing plain-text content renders as before.
+
+The output is safe by construction: all input is HTML-escaped first and
+only the tags above are produced; links keep only http(s), mailto and
+relative URLs.  Bump VERSION whenever the output changes, then run
+`manage.py render_markdown` to re-render the stored HTML.
+"""
+import html
+import re
+from urllib.parse import urlsplit
+
+VERSION = 2
+
+SAFE_SCHEMES = {"", "http", "https", "mailto"}
+
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+_RULE = re.compile(r"^\s*(?:(?:\*\s*){3,}|(?:-\s*){3,}|(?:_\s*){3,})$")
+_BULLET = re.compile(r"^\s*[-*+]\s+(.*)$")
+_NUMBERED = re.compile(r"^\s*(\d{1,9})[.)]\s+(.*)$")
+_QUOTE = re.compile(r"^\s*>\s?(.*)$")
+
+# inline patterns run on escaped text: & < > " ' are entities by then
+_CODE = re.compile(r"(`+)(.+?)\1", re.S)
+_LINK = re.compile(r"\[([^\[\]]+)\]\(\s*([^\s()]+)\s*\)")
+_AUTOLINK = re.compile(r"&lt;((?:https?://|mailto:)[^\s&]+)&gt;")
+# emphasis never starts or ends inside a word: 2*3*4, snake_case_name
+_STRONG = re.compile(r"(?<![\w*_])(\*\*|__)(?=\S)(.+?)(?<=\S)\1(?![\w*_])", re.S)
+_EM = re.compile(r"(?<![\w*_])([*_])(?=[^\s*_])(.+?)(?<=[^\s*_])\1(?![\w*_])", re.S)
+_HOLE = re.compile("\x00(\\d+)\x00")
+
+
+def render(text):
+    """Markdown source -> HTML fragment ("" for empty text)."""
+    text = (text or "").replace("\x00", "").replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    return "\n\n".join(_blocks(lines))
+
+
+# ──────────────────────────────────────────────────────────────
+#  Blocks
+# ──────────────────────────────────────────────────────────────
+def _blocks(lines):
+    out = []
+    paragraph, items, kind = [], _Items(), None
+
+    def close_paragraph():
+        if paragraph:
+            out.append("<p>" + "<br>".join(_inline(line.strip()) for line in paragraph) + "</p>")
+            paragraph.clear()
+
+    def close_list():
+        nonlocal kind
+        if items:
+            body = "".join("<li>" + "<br>".join(_inline(l.strip()) for l in item) + "</li>"
+                           for item in items)
+            start = ""
+            if kind == "ol" and items.start != 1:
+                start = f' start="{items.start}"'
+            out.append(f"<{kind}{start}>{body}</{kind}>")
+            items.clear()
+        kind = None
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = _FENCE.match(line)
+        if fence:
+            close_paragraph()
+            close_list()
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                code.append(lines[i])
+                i += 1
+            out.append("<pre><code>" + html.escape("\n".join(code)) + "</code></pre>")
+            i += 1
+            continue
+
+        if not line.strip():
+            close_paragraph()
+            close_list()
+        elif _HEADING.match(line):
+            close_paragraph()
+            close_list()
+            marks, title = _HEADING.match(line).groups()
+            out.append(f"<h{len(marks)}>{_inline(title)}</h{len(marks)}>")
+        elif _RULE.match(line):
+            close_paragraph()
+            close_list()
+            out.append("<hr>")
+        elif _QUOTE.match(line):
+            close_paragraph()
+            close_list()
+            quoted = []
+            while i < len(lines) and _QUOTE.match(lines[i]):
+                quoted.append(_QUOTE.match(lines[i]).group(1))
+                i += 1
+            out.append("<blockquote>" + "\n".join(_blocks(quoted)) + "</blockquote>")
+            continue
+        elif _BULLET.match(line) or _NUMBERED.match(line):
+            close_paragraph()
+            bullet, numbered = _BULLET.match(line), _NUMBERED.match(line)
+            this = "ul" if bullet else "ol"
+            if kind != this:
+                close_list()
+                kind = this
+                items.start = int(numbered.group(1)) if numbered else 1
+            items.append([(bullet or numbered).groups()[-1]])
+        elif items and line[:1].isspace():
+            items[-1].append(line)          # an indented line continues the item
+        else:
+            close_list()
+            paragraph.append(line)
+        i += 1
+
+    close_paragraph()
+    close_list()
+    return out
+
+
+class _Items(list):
+    start = 1
+
+
+# ──────────────────────────────────────────────────────────────
+#  Inline
+# ──────────────────────────────────────────────────────────────
+def _safe_url(escaped):
+    url = html.unescape(escaped)
+    if any(ord(c) < 32 for c in url):
+        return None
+    try:
+        scheme = urlsplit(url).scheme.lower()
+    except ValueError:
+        return None
+    return escaped if scheme in SAFE_SCHEMES else None
+
+
+def _emphasis(text):
+    text = _STRONG.sub(r"<strong>\2</strong>", text)
+    return _EM.sub(r"<em>\2</em>", text)
+
+
+def _inline(text):
+    text = html.escape(text)
+    held = []
+
+    def hold(fragment):
+        held.append(fragment)
+        return f"\x00{len(held) - 1}\x00"
+
+    # code spans and link targets are set aside, so emphasis can't reach them
+    text = _CODE.sub(lambda m: hold(f"<code>{m.group(2).strip()}</code>"), text)
+
+    def link(m):
+        label, url = m.group(1), _safe_url(m.group(2))
+        # the label's emphasis stays inside the <a>: `[a *b](x) c*` is no <em>
+        return hold(f'<a href="{url}">{_emphasis(label)}</a>') if url else label
+    text = _LINK.sub(link, text)
+    text = _AUTOLINK.sub(lambda m: hold(f'<a href="{m.group(1)}">{m.group(1)}</a>'), text)
+
+    text = _emphasis(text)
+    while "\x00" in text:
+        text = _HOLE.sub(lambda m: held[int(m.group(1))], text)
+    return text
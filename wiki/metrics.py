@@ -0,0 +1,270 @@
+# wiki/metrics.py
+"""
+Counters and histograms for the import pipeline, the page cache and
+search, served on /metrics in the Prometheus text format.
+
+Every process (web workers, import workers, the rasterizer's pool) keeps
+its numbers in memory and writes them to its own file in WIKI_METRICS_DIR
+at most once a second.  /metrics adds up the files of all processes, so
+the totals cover the whole deployment, not just the process that answers.
+Files of processes that have exited are folded into one archive file, so
+counters never go backwards when workers are recycled.
+
+No prometheus_client needed; this module is also imported by the
+rasterizer's worker processes, which never set Django up, so nothing here
+touches the models.
+"""
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+FLUSH_INTERVAL = 1.0     # seconds between writes of this process's file
+ARCHIVE = "archive.json"
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES = tuple(2 ** n for n in range(16, 31, 2))      # 64 KiB … 1 GiB
+FAST = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+
+def metrics_dir():
+    try:
+        configured = getattr(settings, "WIKI_METRICS_DIR", None)
+    except ImproperlyConfigured:
+        configured = None
+    configured = configured or os.environ.get("WIKI_METRICS_DIR")
+    return Path(configured or Path(tempfile.gettempdir()) / "ndt-wiki-metrics")
+
+
+# ──────────────────────────────────────────────────────────────
+#  Metrics
+# ──────────────────────────────────────────────────────────────
+def _key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+def _label_text(key, extra=()):
+    pairs = [*json.loads(key), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        _registry.add(self)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        _registry.record(self.name, _key(labels), lambda value: (value or 0) + amount)
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=SECONDS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        index = bisect_left(self.buckets, value)
+
+        def update(state):
+            state = state or {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+            return state
+        _registry.record(self.name, _key(labels), update)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def merge(a, b):
+        return {
+            "buckets": [x + y for x, y in zip(a["buckets"], b["buckets"])],
+            "sum": a["sum"] + b["sum"],
+            "count": a["count"] + b["count"],
+        }
+
+    def samples(self, values):
+        for key, state in sorted(values.items()):
+            running = 0
+            for bound, count in zip((*self.buckets, "+Inf"), state["buckets"]):
+                running += count
+                yield f"{self.name}_bucket{_label_text(key, [('le', bound)])} {running}"
+            yield f"{self.name}_sum{_label_text(key)} {state['sum']}"
+            yield f"{self.name}_count{_label_text(key)} {state['count']}"
+
+
+# ──────────────────────────────────────────────────────────────
+#  Per-process values and their files
+# ──────────────────────────────────────────────────────────────
+class _Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # a forked child starts from zero: its parent's numbers are in the
+        # parent's file already
+        self.pid = os.getpid()
+        self.file = f"{self.pid}-{time.time_ns()}.json"
+        self.values = {}
+        self.dirty = False
+        self.flushed = 0.0
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+
+    def record(self, name, key, update):
+        with self.lock:
+            if os.getpid() != self.pid:
+                self._reset()
+            series = self.values.setdefault(name, {})
+            series[key] = update(series.get(key))
+            self.dirty = True
+        self.flush()
+
+    def flush(self, force=False):
+        with self.lock:
+            if not self.dirty or os.getpid() != self.pid:
+                return
+            if not force and time.monotonic() - self.flushed < FLUSH_INTERVAL:
+                return
+            data = json.dumps({"pid": self.pid, "values": self.values})
+            self.dirty = False
+            self.flushed = time.monotonic()
+        try:
+            _write(metrics_dir() / self.file, data)
+        except OSError:
+            self.dirty = True      # try again next time
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".metrics-")
+    with os.fdopen(fd, "w") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+_registry = _Registry()
+atexit.register(_registry.flush, force=True)
+
+
+def flush():
+    """Write this process's numbers now (worker processes call it after each batch)."""
+    _registry.flush(force=True)
+
+
+def _merge_into(totals, values):
+    for name, series in values.items():
+        metric = _registry.metrics.get(name)
+        if metric is None:
+            continue
+        into = totals.setdefault(name, {})
+        for key, value in series.items():
+            into[key] = metric.merge(into[key], value) if key in into else value
+
+
+def collect():
+    """Totals over all processes: {metric name: {label key: value}}."""
+    flush()
+    directory = metrics_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    totals = {}
+    with open(directory / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = directory / ARCHIVE
+        archive = json.loads(archive_path.read_text()) if archive_path.exists() else {}
+        gone = []
+        for path in directory.glob("*-*.json"):
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if _alive(data["pid"]):
+                _merge_into(totals, data["values"])
+            else:
+                _merge_into(archive, data["values"])
+                gone.append(path)
+        if gone:
+            _write(archive_path, json.dumps(archive))
+            for path in gone:
+                path.unlink(missing_ok=True)
+        _merge_into(totals, archive)
+    return totals
+
+
+def exposition():
+    """Everything in the Prometheus text format (version 0.0.4)."""
+    totals = collect()
+    lines = []
+    for name, metric in _registry.metrics.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        lines.extend(metric.samples(totals.get(name, {})))
+    return "\n".join(lines) + "\n"
+
+
+# ──────────────────────────────────────────────────────────────
+#  The wiki's metrics
+# ──────────────────────────────────────────────────────────────
+UPLOAD_BYTES = Histogram("wiki_import_upload_bytes", "Size of uploaded import files.", BYTES)
+IMPORT_JOBS = Counter("wiki_import_jobs_total", "Import jobs finished, by status.")
+IMPORT_WAIT = Histogram("wiki_import_queue_wait_seconds",
+                        "Time import jobs spent queued before a worker took them.")
+IMPORT_PAGES = Counter("wiki_import_pages_total", "Document pages turned into guide steps.")
+OFFICE_WAIT = Histogram("wiki_office_slot_wait_seconds", "Time waiting for a free soffice converter.")
+CONVERT = Histogram("wiki_office_convert_seconds", "soffice conversion to PDF, by result.")
+PDF_OPEN = Histogram("wiki_import_pdf_open_seconds", "Opening documents with MuPDF.")
+TEXT = Histogram("wiki_import_text_seconds", "Text extraction, per document.")
+RENDER = Histogram("wiki_import_render_seconds", "Rasterizing one page (or sub-step) to pixmaps.")
+PNG = Histogram("wiki_import_png_seconds", "PNG encoding of one page's thumbnail and full image.")
+IMAGE_STORE = Histogram("wiki_import_image_store_seconds",
+                        "Storing one rendered image (draft file or inline base64).")
+STEP_SAVE = Histogram("wiki_import_save_seconds", "Saving an imported guide and its steps, by source.")
+PAGE_CACHE = Counter("wiki_page_cache_requests_total", "Rendered-page cache lookups, by result.")
+SEARCH = Histogram("wiki_search_seconds", "Search requests: counting and fetching one page of hits.")
+SUGGEST = Histogram("wiki_search_suggest_seconds", "Search box completions from the typeahead index.", FAST)
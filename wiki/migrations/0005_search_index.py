@@ -0,0 +1,37 @@
+# Full-text search index (SQLite FTS5), see wiki/search.py
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS wiki_search_index USING fts5("
+        "title, content, steps, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO wiki_search_index(rowid, title, content, steps) "
+        "SELECT p.id, p.title, p.content, "
+        "  COALESCE((SELECT group_concat(s.step_content, char(10)) "
+        "            FROM wiki_guidestep s WHERE s.wiki_page_id = p.id), '') "
+        "FROM wiki_wikipage p"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS wiki_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0004_guidestep_file_alter_guidestep_step_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:02
+
+import wiki.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0006_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='guidestep',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=wiki.storage.get_blob_storage, upload_to='blobs/'),
+        ),
+        migrations.AlterField(
+            model_name='mediafile',
+            name='file',
+            field=models.FileField(storage=wiki.storage.get_blob_storage, upload_to='blobs/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0007_content_addressed_files'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='wikipage',
+            index=models.Index(fields=['category', 'page_type', '-created_at', '-id'], name='wikipage_cat_type_created_idx'),
+        ),
+    ]
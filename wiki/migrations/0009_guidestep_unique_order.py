@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+def renumber_steps(apps, schema_editor):
+    # the old count()-based numbering could hand out the same order twice
+    # (or skip numbers after a delete): make every guide 1..n first
+    GuideStep = apps.get_model('wiki', 'GuideStep')
+    changed = []
+    page_id, order = None, 0
+    for step in GuideStep.objects.order_by('wiki_page_id', 'step_order', 'pk').only(
+        'pk', 'wiki_page_id', 'step_order'
+    ).iterator():
+        if step.wiki_page_id != page_id:
+            page_id, order = step.wiki_page_id, 0
+        order += 1
+        if step.step_order != order:
+            step.step_order = order
+            changed.append(step)
+    GuideStep.objects.bulk_update(changed, ['step_order'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0008_wikipage_listing_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_steps, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='guidestep',
+            constraint=models.UniqueConstraint(fields=('wiki_page', 'step_order'), name='guidestep_unique_order'),
+        ),
+    ]
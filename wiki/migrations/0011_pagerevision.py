@@ -0,0 +1,81 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:40
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# frozen copies of wiki/revisions.py's helpers as of this migration, so
+# later changes to that module can't change what this one writes
+def document(title, category, page_type, content, steps):
+    lines = [f"title: {title}", f"category: {category}", f"type: {page_type}", ""]
+    lines += content.split("\n")
+    for n, (text, file) in enumerate(steps, start=1):
+        lines += ["", f"== Step {n} =="]
+        if file:
+            lines.append(f"image: {file}")
+        lines += text.split("\n")
+    return lines
+
+
+def digest(lines):
+    return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+
+
+def pack_snapshot(lines):
+    return zlib.compress("\n".join(lines).encode(), 9)
+
+
+def first_revisions(apps, schema_editor):
+    # history starts with the pages as they are now
+    WikiPage = apps.get_model('wiki', 'WikiPage')
+    GuideStep = apps.get_model('wiki', 'GuideStep')
+    PageRevision = apps.get_model('wiki', 'PageRevision')
+    steps = {}
+    for page_id, text, file in GuideStep.objects.order_by('wiki_page_id', 'step_order').values_list(
+        'wiki_page_id', 'step_content', 'file'
+    ).iterator():
+        steps.setdefault(page_id, []).append((text, file))
+
+    revisions = []
+    for page in WikiPage.objects.select_related('category').iterator():
+        lines = document(page.title, page.category.name, page.page_type,
+                         page.content, steps.get(page.pk, ()))
+        revisions.append(PageRevision(
+            page_id=page.pk, number=1, author_id=page.author_id, snapshot=True,
+            data=pack_snapshot(lines), digest=digest(lines), added=len(lines),
+        ))
+    PageRevision.objects.bulk_create(revisions, batch_size=200)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0010_importeddocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('snapshot', models.BooleanField(default=False)),
+                ('data', models.BinaryField()),
+                ('digest', models.CharField(max_length=40)),
+                ('added', models.PositiveIntegerField(default=0)),
+                ('removed', models.PositiveIntegerField(default=0)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='wiki.wikipage')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('page', 'number'), name='pagerevision_unique_number')],
+            },
+        ),
+        migrations.RunPython(first_revisions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0011_pagerevision'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='wikipage',
+            index=models.Index(fields=['updated_at'], name='wikipage_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0012_wikipage_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guidestep',
+            name='html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='guidestep',
+            name='html_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='wikipage',
+            name='html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='wikipage',
+            name='html_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0015_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wikipage',
+            name='dismissed_pages',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,8 +1,12 @@
 # wiki/models.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
+from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 
+from . import markup, slugs
+from .storage import get_blob_storage
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
@@ -12,6 +16,8 @@ class Category(models.Model):
         null=True,
         help_text="Optional path to a custom template, e.g. 'wiki/category_production.html'"
     )
+    # moves the category generation (wiki/cache.py) in every process
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -21,7 +27,54 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class WikiPage(models.Model):
+class RenderedQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create() skips save(), so render here too
+        objs = list(objs)
+        for obj in objs:
+            obj.render_html()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class MarkdownContent(models.Model):
+    """
+    `html`: the Markdown in `markdown_field`, compiled by wiki/markup.py
+    whenever the row is saved.  Templates output `rendered`.
+    """
+    markdown_field = 'content'
+
+    html = models.TextField(blank=True, editable=False)
+    html_version = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = RenderedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def render_html(self):
+        self.html = markup.render(getattr(self, self.markdown_field))
+        self.html_version = markup.VERSION
+
+    @property
+    def rendered(self):
+        # rows saved by an older renderer are rendered on the fly until
+        # `manage.py render_markdown` has caught up with them
+        if self.html_version != markup.VERSION:
+            return mark_safe(markup.render(getattr(self, self.markdown_field)))
+        return mark_safe(self.html)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            if self.markdown_field in self.__dict__:     # not deferred
+                self.render_html()
+        elif self.markdown_field in update_fields:
+            self.render_html()
+            kwargs['update_fields'] = {*update_fields, 'html', 'html_version'}
+        super().save(*args, **kwargs)
+
+
+class WikiPage(MarkdownContent):
     NOTE = 'note'
     GUIDE = 'guide'
     PAGE_TYPE_CHOICES = [
@@ -38,21 +91,40 @@ class WikiPage(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     page_type = models.CharField(max_length=10, choices=PAGE_TYPE_CHOICES, default=NOTE)
     version = models.IntegerField(default=1)
+    # fingerprints of imported PDF pages left out of this guide on purpose,
+    # so re-importing the manual doesn't offer them again (wiki/reimport.py)
+    dismissed_pages = models.JSONField(default=list, blank=True)
 
-    def save(self, *args, **kwargs):
-            if not self.slug:
-                base_slug = slugify(self.title)
-                slug_candidate = base_slug
-                counter = 1
+    class Meta:
+        indexes = [
+            # category listing: newest guides / notes of one category
+            models.Index(fields=['category', 'page_type', '-created_at', '-id'],
+                         name='wikipage_cat_type_created_idx'),
+            # pages changed since a point in time (wiki/typeahead.py)
+            models.Index(fields=['updated_at'], name='wikipage_updated_idx'),
+        ]
 
-                # While a page with this slug already exists, append a suffix
-                while WikiPage.objects.filter(slug=slug_candidate).exists():
-                    slug_candidate = f"{base_slug}-{counter}"
-                    counter += 1
+    SLUG_RETRIES = 5
 
-                self.slug = slug_candidate
+    def save(self, *args, **kwargs):
+        if self.slug:
+            return super().save(*args, **kwargs)
 
-            super().save(*args, **kwargs)
+        # Another request may grab the same slug between allocating and
+        # inserting; the unique index catches that, so just allocate again.
+        max_length = self._meta.get_field('slug').max_length
+        tried = set()
+        for attempt in range(self.SLUG_RETRIES):
+            self.slug = slugs.allocate(WikiPage, self.title, max_length, exclude=tried)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                clash = WikiPage.objects.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                tried.add(self.slug)
+                self.slug = ''
+                if not clash or attempt == self.SLUG_RETRIES - 1:
+                    raise
 
     def __str__(self):
         return f"{self.title} ({self.get_page_type_display()})"
@@ -60,23 +132,37 @@ class WikiPage(models.Model):
 
 # wiki/models.py
 
-class GuideStep(models.Model):
+class GuideStep(MarkdownContent):
     """
     Represents a single step in a multi-step guide.
     """
+    markdown_field = 'step_content'
     wiki_page = models.ForeignKey(
         WikiPage, on_delete=models.CASCADE, related_name='guide_steps'
     )
     step_order = models.PositiveIntegerField(editable=False)  # We'll auto-set this.
     step_content = models.TextField()
-    file = models.FileField(upload_to='guide_steps/', blank=True, null=True)
+    file = models.FileField(upload_to='blobs/', storage=get_blob_storage, blank=True, null=True)
+    # set by PDF imports, for re-importing a newer revision (wiki/reimport.py):
+    # the page the step came from, that page's fingerprint, and a digest of
+    # the step as imported, to tell whether anyone edited it since
+    source_page = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    fingerprint = models.CharField(max_length=64, blank=True, editable=False)
+    imported_digest = models.CharField(max_length=64, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wiki_page', 'step_order'],
+                                    name='guidestep_unique_order'),
+        ]
 
     def save(self, *args, **kwargs):
-        # If this is a new step (no primary key yet)
-        if not self.pk:
-            # Count existing steps for this guide, increment for the new one
-            existing_steps = GuideStep.objects.filter(wiki_page=self.wiki_page).count()
-            self.step_order = existing_steps + 1
+        # A single new step goes after the last one.  To add several at
+        # once, or reorder, use wiki/steps.py.
+        if not self.pk and not self.step_order:
+            last = GuideStep.objects.filter(wiki_page=self.wiki_page).aggregate(
+                last=models.Max('step_order'))['last']
+            self.step_order = (last or 0) + 1
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -84,6 +170,31 @@ class GuideStep(models.Model):
 
 
 
+class PageRevision(models.Model):
+    """
+    One saved state of a page and its steps.  `data` is the zlib-compressed
+    page text when `snapshot` is set, otherwise a compressed delta against
+    revision number - 1 (see wiki/revisions.py).
+    """
+    page = models.ForeignKey(WikiPage, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    snapshot = models.BooleanField(default=False)
+    data = models.BinaryField()
+    digest = models.CharField(max_length=40)
+    added = models.PositiveIntegerField(default=0)      # lines, for the history list
+    removed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['page', 'number'], name='pagerevision_unique_number'),
+        ]
+
+    def __str__(self):
+        return f"{self.page.title} r{self.number}"
+
+
 class ResourceLink(models.Model):
     """
     Stores useful links (e.g., drivers, BIOS settings, external documentation).
@@ -102,8 +213,92 @@ class MediaFile(models.Model):
     Stores images or videos associated with a guide.
     """
     page = models.ForeignKey(WikiPage, on_delete=models.CASCADE, related_name='media_files')
-    file = models.FileField(upload_to='wiki_media/')
+    file = models.FileField(upload_to='blobs/', storage=get_blob_storage)
     description = models.CharField(max_length=255, blank=True)
 
     def __str__(self):
         return self.file.name
+
+
+class Blob(models.Model):
+    """
+    Reference count for a file in the content-addressed blob storage
+    (wiki/storage.py).  Kept up to date by signals on GuideStep and
+    MediaFile; blobs at zero are removed by `manage.py sweep_blobs`.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class ImportedDocument(models.Model):
+    """
+    A source file `manage.py import_guides` turned into a page, by content
+    hash, so running the import again skips it.  Deleting the page forgets
+    the file, and the next run imports it again.
+    """
+    page = models.ForeignKey(WikiPage, on_delete=models.CASCADE, related_name='sources')
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.path
+
+
+class ImportJob(models.Model):
+    """
+    A PDF/ODT guide import waiting for, or processed by, the background
+    workers in wiki/jobs.py.  The finished draft is kept on the row until
+    the user saves it from the preview page.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='import_jobs')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    # re-import into this guide instead of drafting a new one
+    target = models.ForeignKey(WikiPage, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='reimport_jobs')
+    source = models.FileField(upload_to='import_jobs/')
+    original_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    pages_done = models.PositiveIntegerField(default=0)
+    pages_total = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    draft = models.JSONField(null=True, blank=True)
+    # a running job whose lease ran out belongs to a worker that died
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def percent(self):
+        if self.status == self.DONE:
+            return 100
+        if not self.pages_total:
+            return 0
+        return int(100 * self.pages_done / self.pages_total)
+
+    def __str__(self):
+        return f"Import {self.original_name} ({self.get_status_display()})"
@@ -0,0 +1,42 @@
+# wiki/oncommit.py
+"""
+Work collected per transaction and done once it commits.
+
+Saving a guide with fifty steps fires fifty signals.  Each handler adds
+its page to a batch here instead of registering a callback of its own:
+
+    oncommit.defer("search", reindex, pages=[page_id])
+
+The first call for a key registers `reindex(batch)` with
+transaction.on_commit; later calls in the same transaction only add to
+`batch`, a dict of sets ({"pages": {...}}).  Outside a transaction the
+batch is handed over at once, as on_commit does.
+"""
+from collections import defaultdict
+from weakref import WeakKeyDictionary
+
+from django.db import transaction
+
+_pending = WeakKeyDictionary()   # connection -> (its commit hooks, {key: batch})
+
+
+def defer(key, flush, using=None, **items):
+    """Add `items` (name -> iterable) to the current transaction's batch for `key`."""
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        batch = {name: set(values) for name, values in items.items()}
+        transaction.on_commit(lambda: flush(batch), using=using)
+        return
+
+    # a commit or rollback (also of a savepoint) starts a new list of hooks,
+    # so batches waiting on the old one are done with or thrown away
+    hooks, batches = _pending.get(connection, (None, None))
+    if hooks is not connection.run_on_commit:
+        batches = {}
+        _pending[connection] = (connection.run_on_commit, batches)
+    batch = batches.get(key)
+    if batch is None:
+        batch = batches[key] = defaultdict(set)
+        transaction.on_commit(lambda: flush(batch), using=using)
+    for name, values in items.items():
+        batch[name].update(values)
@@ -0,0 +1,70 @@
+# wiki/pagination.py
+"""
+Keyset ("cursor") pagination, newest first.
+
+Instead of OFFSET, the next page starts after the (timestamp, pk) of the
+last row shown, so fetching page 500 costs the same index range scan as
+page 1.  Cursors are opaque url-safe strings.
+"""
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(value, pk):
+    raw = f"{value.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (datetime, pk) or None for a missing or malformed cursor."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        value, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(value), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def after(token, field_name="created_at"):
+    """Filter for the rows that come after `token` in newest-first order."""
+    cursor = decode_cursor(token)
+    if cursor is None:
+        return Q()
+    value, pk = cursor
+    return Q(**{f"{field_name}__lt": value}) | Q(**{field_name: value, "pk__lt": pk})
+
+
+def ordering(field_name="created_at"):
+    return (f"-{field_name}", "-pk")
+
+
+@dataclass
+class CursorPage:
+    items: list
+    cursor: str = None              # the cursor this page was fetched with
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+    @classmethod
+    def from_rows(cls, rows, size, cursor=None, field_name="created_at"):
+        """`rows` holds up to size + 1 items; the extra one proves there's more."""
+        rows = list(rows)
+        items = rows[:size]
+        next_cursor = None
+        if len(rows) > size:
+            last = items[-1]
+            next_cursor = encode_cursor(getattr(last, field_name), last.pk)
+        return cls(items=items, cursor=cursor if decode_cursor(cursor) else None,
+                   next_cursor=next_cursor)
@@ -0,0 +1,206 @@
+# wiki/rasterize.py
+"""
+PDF page rasterization for the guide importer.
+
+Every page is rendered once at full width; the thumbnail is scaled down from
+that pixmap instead of rendering the page a second time.  Larger documents
+are split into page ranges and rendered on a process pool, because MuPDF
+rendering is CPU bound and holds the GIL.
+"""
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import fitz
+
+from . import metrics
+
+# how wide our thumbnails and full-res snapshots should be (px)
+THUMB_W = 240
+FULL_W  = 1024
+
+# below this many pages the pool start-up and IPC cost more than they save
+PARALLEL_MIN_PAGES = 4
+
+# pages per worker task in render_pages
+BATCH_PAGES = 4
+
+# breathing room (pt) around a cropped sub-step
+CROP_MARGIN = 6
+
+
+def _open(source):
+    """`source` is either raw PDF bytes or a path on disk."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def render_page(page, clip=None):
+    """
+    Render `page` (or the `clip` rectangle of it) once and return
+    (thumb_png, full_png) as bytes.  The width of the rendered area maps
+    to FULL_W.
+    """
+    area = clip or page.rect
+    zoom = FULL_W / area.width
+    with metrics.RENDER.time():
+        full = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip,
+                               colorspace=fitz.csRGB)
+        thumb_h = max(1, round(full.height * THUMB_W / full.width))
+        thumb = fitz.Pixmap(full, THUMB_W, thumb_h, None)
+    with metrics.PNG.time():
+        return thumb.tobytes("png"), full.tobytes("png")
+
+
+def _render_range(source, page_numbers):
+    """Worker entry point: render a batch of pages of one document."""
+    doc = _open(source)
+    try:
+        return [(n, *render_page(doc[n])) for n in page_numbers]
+    finally:
+        doc.close()
+        metrics.flush()
+
+
+# ──────────────────────────────────────────────────────────────
+#  Process pool (created on first use, shared by all imports)
+# ──────────────────────────────────────────────────────────────
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def pool_size():
+    return max(1, os.cpu_count() or 1)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # "spawn": the importer runs on worker threads, and forking a
+            # threaded process can copy held locks into the child
+            _executor = ProcessPoolExecutor(
+                max_workers=pool_size(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _executor
+
+
+def _batches(items, size):
+    return (items[i:i + size] for i in range(0, len(items), size))
+
+
+@contextmanager
+def _as_path(source):
+    """Hand workers a file path rather than pickling the PDF bytes to each."""
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        yield source
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        tmp.write(source)
+        tmp.flush()
+        yield tmp.name
+
+
+def render_pages(source, page_numbers, progress=None, parallel=True):
+    """
+    Render `page_numbers` (0-based) of the PDF in `source`.
+
+    Yields (page_number, thumb_png, full_png) in page order.  `progress`,
+    if given, is called with the number of pages finished so far.
+    """
+    page_numbers = list(page_numbers)
+    workers = pool_size()
+    if not parallel or workers == 1 or len(page_numbers) < PARALLEL_MIN_PAGES:
+        done = 0
+        doc = _open(source)
+        try:
+            for n in page_numbers:
+                yield (n, *render_page(doc[n]))
+                done += 1
+                if progress:
+                    progress(done)
+        finally:
+            doc.close()
+        return
+
+    with _as_path(source) as path:
+        # small fixed-size batches keep progress reports flowing and even
+        # out slow pages; only a window of them is in flight at a time, so
+        # a 500-page manual never has more than a few dozen rendered pages
+        # waiting in memory
+        executor = get_executor()
+        batches = _batches(page_numbers, BATCH_PAGES)
+        window = deque()
+        done = 0
+        try:
+            while True:
+                while len(window) < workers * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    window.append(executor.submit(_render_range, path, batch))
+                if not window:
+                    break
+                for item in window.popleft().result():
+                    yield item
+                    done += 1
+                    if progress:
+                        progress(done)
+        finally:
+            for future in window:
+                future.cancel()
+
+
+# ──────────────────────────────────────────────────────────────
+#  Single-page documents: one crop per numbered sub-step
+# ──────────────────────────────────────────────────────────────
+def step_regions(page, numbers):
+    """
+    Find the area of `page` that belongs to each numbered step.
+
+    Returns one fitz.Rect (or None when the header line can't be located)
+    per entry in `numbers`, running from the step's header line down to the
+    next step's header, or to the end of the page's content for the last.
+    """
+    blocks = page.get_text("dict")["blocks"]
+    lines = []
+    for block in blocks:
+        if block["type"] != 0:
+            continue
+        for line in block["lines"]:
+            text = "".join(span["text"] for span in line["spans"])
+            lines.append((fitz.Rect(line["bbox"]), text))
+    lines.sort(key=lambda l: (l[0].y0, l[0].x0))
+
+    tops, start = [], 0
+    for number in numbers:
+        header = re.compile(rf"^\s*{re.escape(number)}\.")
+        for i in range(start, len(lines)):
+            if header.match(lines[i][1]):
+                tops.append(lines[i][0].y0)
+                start = i + 1
+                break
+        else:
+            tops.append(None)
+
+    # lowest thing drawn on the page (text, image or vector) closes the last step
+    bottom = max((fitz.Rect(bbox).y1 for _, bbox in page.get_bboxlog()),
+                 default=page.rect.y1) + CROP_MARGIN
+
+    regions = []
+    for i, top in enumerate(tops):
+        if top is None:
+            regions.append(None)
+            continue
+        nxt = next((t - CROP_MARGIN for t in tops[i + 1:] if t is not None), bottom)
+        rect = fitz.Rect(page.rect.x0, top - CROP_MARGIN,
+                         page.rect.x1, nxt) & page.rect
+        regions.append(rect if not rect.is_empty else None)
+    return regions
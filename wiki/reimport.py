@@ -0,0 +1,312 @@
+# wiki/reimport.py
+"""
+Re-importing a new revision of a manual into the guide made from the old one.
+
+Every imported step remembers the PDF page it came from and that page's
+fingerprint: a hash of its text, its content stream and the images and
+forms it draws, so computing it needs no rendering.  Re-importing
+fingerprints all pages of the new file, lines them up with the guide's
+steps (difflib, so inserted or removed pages don't shift everything
+after them) and renders only the pages that match no step.
+
+Steps are replaced only if they are exactly as the import left them
+(`imported_digest`).  Steps people edited or added by hand are kept where
+they are, and the report lists them so someone can check them against
+the new pages.  New pages someone chose to leave out are remembered on the
+guide (WikiPage.dismissed_pages) and stay out of later re-imports, until
+someone picks them again in the preview.
+
+Steps imported before fingerprints existed are matched by their text;
+when the text matches, they keep their image.
+
+    plan(guide, path, name, save_image)   # what would change; renders new pages
+    apply(guide, plan, open_image)        # make it so; returns the report
+
+The web import (wiki/jobs.py) stores the plan as the job's draft, and the
+preview page shows its report before applying it; `manage.py
+reimport_guide` does both in one go.
+"""
+import hashlib
+from difflib import SequenceMatcher
+
+import fitz
+from django.db import transaction
+
+from . import metrics
+from .models import GuideStep, WikiPage
+from .rasterize import render_pages
+from .steps import add_steps, renumber_steps, reorder_steps
+from .uploads import check_page_count
+
+
+class ReimportError(Exception):
+    pass
+
+
+# ──────────────────────────────────────────────────────────────
+#  Fingerprints and digests
+# ──────────────────────────────────────────────────────────────
+class Fingerprinter:
+    """Per-document: images and forms shared by many pages are hashed once."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.streams = {}
+
+    def _stream(self, xref):
+        if xref not in self.streams:
+            self.streams[xref] = hashlib.sha256(self.doc.xref_stream_raw(xref) or b"").digest()
+        return self.streams[xref]
+
+    def page(self, page, text):
+        digest = hashlib.sha256()
+        digest.update(text.encode())
+        digest.update(f"\0{tuple(page.rect)}\0{page.rotation}\0".encode())
+        digest.update(page.read_contents())
+        for xref, *_ in page.get_images(full=True):
+            digest.update(self._stream(xref))
+        for xref, *_ in page.get_xobjects():
+            digest.update(self._stream(xref))
+        return digest.hexdigest()
+
+
+def part_fingerprint(page_fingerprint, index, text):
+    # numbered parts of a single-page document, see _pdf_to_draft
+    return hashlib.sha256(f"{page_fingerprint}\0{index}\0{text}".encode()).hexdigest()
+
+
+def step_digest(content, file_name):
+    return hashlib.sha256(f"{content}\0{file_name or ''}".encode()).hexdigest()
+
+
+def stamp(steps):
+    """Remember saved, freshly imported steps as untouched (one query)."""
+    steps = [s for s in steps if s.fingerprint]
+    for step in steps:
+        step.imported_digest = step_digest(step.step_content, step.file.name)
+    GuideStep.objects.bulk_update(steps, ["imported_digest"], batch_size=500)
+
+
+def is_untouched(step):
+    return bool(step.imported_digest) and step.imported_digest == step_digest(
+        step.step_content, step.file.name)
+
+
+# ──────────────────────────────────────────────────────────────
+#  Matching
+# ──────────────────────────────────────────────────────────────
+def current_steps(guide):
+    return list(
+        guide.guide_steps.order_by("step_order")
+        .only("pk", "wiki_page", "step_order", "step_content", "file",
+              "source_page", "fingerprint", "imported_digest")
+    )
+
+
+def diff(steps, units, dismissed=()):
+    """
+    Line `steps` (the guide's, in order) up with `units` (the new pages) and
+    return the resulting guide as a list of (action, step, unit index);
+    `dismissed` holds the fingerprints of pages left out on purpose:
+
+        same      the step matches its page exactly: kept, image and all
+        changed   an untouched imported step whose page changed: replaced
+        conflict  an edited imported step whose page changed: kept as edited
+        added     a new page: becomes a new step
+        removed   an untouched imported step whose page is gone: deleted
+        kept      an edited step whose page is gone, or one written by hand
+        dismissed a new page that was left out before: stays out
+    """
+    dismissed = set(dismissed)
+    by_text = {}
+    for i, unit in enumerate(units):
+        by_text.setdefault(unit["text"].strip(), []).append(i)
+    claimed = set()
+
+    def key(step):
+        if step.fingerprint:
+            return step.fingerprint
+        # imported before fingerprints: the same text counts as the same page
+        for i in by_text.get(step.step_content.strip(), ()):
+            if i not in claimed:
+                claimed.add(i)
+                return units[i]["fingerprint"]
+        return f"step-{step.pk}"        # matches nothing
+
+    old = [key(step) for step in steps]
+    new = [unit["fingerprint"] for unit in units]
+    result = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            result += [("same", steps[i], j) for i, j in zip(range(i1, i2), range(j1, j2))]
+            continue
+        # within a run of differences, imported steps pair up with the new
+        # pages in order: that page is the new version of the step
+        pages = iter([j for j in range(j1, j2) if new[j] not in dismissed])
+        for step in steps[i1:i2]:
+            j = next(pages, None) if step.fingerprint else None
+            if j is None:
+                result.append(("removed" if is_untouched(step) else "kept", step, None))
+            else:
+                result.append(("changed" if is_untouched(step) else "conflict", step, j))
+        result += [("added", None, j) for j in pages]
+        result += [("dismissed", None, j) for j in range(j1, j2) if new[j] in dismissed]
+    return result
+
+
+def rendered(changes):
+    """Indexes of the units that become new steps."""
+    return [j for action, _step, j in changes if action in ("changed", "added")]
+
+
+def optional(changes):
+    """Indexes of the new pages the preview lets you add or leave out."""
+    return [j for action, _step, j in changes if action in ("added", "dismissed")]
+
+
+def report(changes, units):
+    """
+    What `changes` amount to: new page numbers for "unchanged", "changed",
+    "added" and "dismissed", guide step numbers for "removed" and "kept", and pairs
+    (step number, page number) for "conflicts".  JSON-able, so it can go
+    into a job's draft.
+    """
+    summary = {"unchanged": [], "changed": [], "added": [], "dismissed": [], "removed": [],
+               "kept": [], "conflicts": []}
+    for action, step, j in changes:
+        if action == "same":
+            summary["unchanged"].append(units[j]["page"])
+        elif action in ("changed", "added", "dismissed"):
+            summary[action].append(units[j]["page"])
+        elif action == "conflict":
+            summary["conflicts"].append((step.step_order, units[j]["page"]))
+        else:
+            summary[action].append(step.step_order)
+    return summary
+
+
+# ──────────────────────────────────────────────────────────────
+#  Planning and applying
+# ──────────────────────────────────────────────────────────────
+def plan(guide, path, name, save_image, progress=None, parallel=True, render=True):
+    """
+    Fingerprint the new PDF at `path` and render the pages that don't match
+    a step of `guide` (through `save_image`, as for a new import), and
+    those left out before, in case they're picked again.  Returns
+    a JSON-able plan for apply().  With render=False nothing is rendered:
+    enough for the report.
+    """
+    from .views import _pdf_to_draft, _timed_store    # views.py imports this module
+
+    with metrics.PDF_OPEN.time():
+        doc = fitz.open(str(path))
+    try:
+        check_page_count(doc.page_count)
+        pages = doc.page_count
+        if pages == 1:
+            units = None
+        else:
+            fingerprints = Fingerprinter(doc)
+            units = []
+            with metrics.TEXT.time():
+                for n in range(pages):
+                    text = doc[n].get_text("text").strip()
+                    if text:        # blank pages never become steps
+                        units.append({"page": n + 1, "text": text, "thumb": None, "full": None,
+                                      "fingerprint": fingerprints.page(doc[n], text)})
+    finally:
+        doc.close()
+
+    changes = None
+    if units is None:
+        # one page split into numbered parts: just draft it again, it's cheap
+        units = _pdf_to_draft(str(path), name=name, save_image=save_image, parallel=False)["steps"]
+    else:
+        changes = diff(current_steps(guide), units, guide.dismissed_pages)
+        wanted = [units[j]["page"] - 1 for j in sorted({*rendered(changes), *optional(changes)})]
+        if render and wanted:
+            save_image = _timed_store(save_image)
+            index = {unit["page"] - 1: unit for unit in units}
+
+            def report_progress(done):
+                if progress:
+                    progress(done, len(wanted))
+
+            report_progress(0)
+            for n, thumb, full in render_pages(str(path), wanted, report_progress, parallel):
+                index[n]["thumb"], index[n]["full"] = save_image(thumb), save_image(full)
+            metrics.IMPORT_PAGES.inc(len(wanted))
+
+    return {
+        "reimport": guide.pk,
+        "title": guide.title,
+        "source": name,
+        "pages": pages,
+        "units": units,
+        "report": report(changes or diff(current_steps(guide), units, guide.dismissed_pages),
+                         units),
+    }
+
+
+def apply(guide, plan, open_image, dismissed=None):
+    """
+    Change the steps of `guide` as `plan` says; `open_image(ref)` turns a
+    stored image ref into a value for GuideStep.file.  Returns the report.
+    The guide is matched again here, so edits made since the plan are kept.
+    `dismissed` replaces the fingerprints of the pages left out of the
+    guide (by default they stay as they are).
+    """
+    if plan.get("reimport") != guide.pk:
+        raise ReimportError("This re-import was prepared for another guide.")
+    units = plan["units"]
+    with transaction.atomic():
+        if dismissed is not None:
+            guide.dismissed_pages = sorted(dismissed)
+            # no save(): nothing about the page itself changes
+            WikiPage.objects.filter(pk=guide.pk).update(dismissed_pages=guide.dismissed_pages)
+        changes = diff(current_steps(guide), units, guide.dismissed_pages)
+        if any(units[j]["full"] is None for j in rendered(changes)):
+            raise ReimportError("The guide changed since this re-import was prepared; "
+                                "upload the file again.")
+
+        GuideStep.objects.filter(
+            pk__in=[step.pk for action, step, _j in changes if action in ("changed", "removed")]
+        ).delete()
+
+        # old steps matched by their text: untouched imports from now on
+        legacy = [step for action, step, _j in changes if action == "same" and not step.fingerprint]
+        moved = []
+        for action, step, j in changes:
+            if action == "same" and step.source_page != units[j]["page"]:
+                step.source_page = units[j]["page"]
+                step.fingerprint = units[j]["fingerprint"]
+                moved.append(step)
+        GuideStep.objects.bulk_update(moved, ["source_page", "fingerprint"], batch_size=500)
+        stamp(legacy)
+
+        new = {}
+        for j in rendered(changes):
+            unit = units[j]
+            new[j] = GuideStep(step_content=unit["text"], file=open_image(unit["full"]),
+                               source_page=unit["page"], fingerprint=unit["fingerprint"])
+        try:
+            add_steps(guide, list(new.values()))
+            stamp(list(new.values()))
+        finally:
+            for step in new.values():
+                if hasattr(step.file, "close"):
+                    step.file.close()
+
+        renumbered = None
+        if new:
+            order = [new[j].pk if action in ("changed", "added") else step.pk
+                     for action, step, j in changes if action not in ("removed", "dismissed")]
+            renumbered = reorder_steps(guide, order)
+        elif any(action == "removed" for action, _step, _j in changes):
+            renumbered = renumber_steps(guide)      # only gaps to close
+        if renumbered is not None:
+            numbers = {step.pk: step.step_order for step in renumbered}
+            for action, step, _j in changes:
+                if action in ("kept", "conflict"):
+                    step.step_order = numbers[step.pk]      # report where they are now
+    return report(changes, units)
@@ -0,0 +1,248 @@
+# wiki/revisions.py
+"""
+Revision history of pages and their guide steps.
+
+A revision is the page flattened to lines of text (title, category, type,
+content, then every step with its image; see `document`).  Most revisions
+store only a zlib-compressed delta against the one before; every
+WIKI_REVISION_SNAPSHOT_EVERY revisions, or when a delta would be no smaller,
+a full snapshot is stored instead.  Any revision is rebuilt from the nearest
+snapshot at or before it, so that is one query and at most that many rows.
+
+Revisions are recorded after commit (signals.py), once per page and
+transaction however many steps changed, and only when the flattened page
+actually differs from the last revision.  The author comes from the
+request being handled (RevisionAuthorMiddleware).
+"""
+import hashlib
+import json
+import zlib
+from contextvars import ContextVar
+from difflib import SequenceMatcher, unified_diff
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery
+
+from . import oncommit
+from .models import GuideStep, PageRevision, WikiPage
+
+RETRIES = 3
+
+_request = ContextVar("wiki_revision_request", default=None)
+
+
+def snapshot_every():
+    return getattr(settings, "WIKI_REVISION_SNAPSHOT_EVERY", 20)
+
+
+class RevisionAuthorMiddleware:
+    """Remember the request, so revisions saved during it get its user."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+
+def _current_user_id():
+    request = _request.get()
+    user = getattr(request, "user", None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+# ──────────────────────────────────────────────────────────────
+#  Documents, deltas and their encoding
+# ──────────────────────────────────────────────────────────────
+def document(title, category, page_type, content, steps):
+    """The page as a list of lines; `steps` is [(text, file name), …] in order."""
+    lines = [f"title: {title}", f"category: {category}", f"type: {page_type}", ""]
+    lines += content.split("\n")
+    for n, (text, file) in enumerate(steps, start=1):
+        lines += ["", f"== Step {n} =="]
+        if file:
+            lines.append(f"image: {file}")
+        lines += text.split("\n")
+    return lines
+
+
+def digest(lines):
+    return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+
+
+def _delta(old, new):
+    """Copy ranges [i, j] of `old` and lists of new lines, plus line counts."""
+    ops, added, removed = [], 0, 0
+    matcher = SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+            continue
+        if j2 > j1:
+            ops.append(new[j1:j2])
+        added += j2 - j1
+        removed += i2 - i1
+    return ops, added, removed
+
+
+def _apply(old, ops):
+    new = []
+    for op in ops:
+        if op and isinstance(op[0], int):
+            new.extend(old[op[0]:op[1]])
+        else:
+            new.extend(op)
+    return new
+
+
+def pack_snapshot(lines):
+    return zlib.compress("\n".join(lines).encode(), 9)
+
+
+def _pack_delta(ops):
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(",", ":")).encode(), 9)
+
+
+def _unpack(snapshot, data):
+    raw = zlib.decompress(bytes(data)).decode()
+    return raw.split("\n") if snapshot else json.loads(raw)
+
+
+# ──────────────────────────────────────────────────────────────
+#  Reading
+# ──────────────────────────────────────────────────────────────
+def _chain(page_id, number):
+    """(number, snapshot, data) from the last snapshot up to `number`, in one query."""
+    base = (PageRevision.objects
+            .filter(page_id=page_id, number__lte=number, snapshot=True)
+            .order_by("-number").values("number")[:1])
+    return list(PageRevision.objects
+                .filter(page_id=page_id, number__lte=number, number__gte=Subquery(base))
+                .order_by("number")
+                .values_list("number", "snapshot", "data"))
+
+
+def _replay(chain):
+    lines = None
+    for _number, snapshot, data in chain:
+        payload = _unpack(snapshot, data)
+        lines = payload if snapshot else _apply(lines, payload)
+    return lines
+
+
+def rebuild(page_id, number):
+    """The lines of revision `number` of the page, or None if there is no such revision."""
+    chain = _chain(page_id, number)
+    if not chain or chain[-1][0] != number:
+        return None
+    return _replay(chain)
+
+
+def diff(page_id, a, b):
+    """Unified diff from revision a to b as (css class, line) pairs; None if either is missing."""
+    old, new = rebuild(page_id, a), rebuild(page_id, b)
+    if old is None or new is None:
+        return None
+    rows = []
+    for line in unified_diff(old, new, f"revision {a}", f"revision {b}", n=3, lineterm=""):
+        if line.startswith(("---", "+++")):
+            continue
+        css = {"@": "hunk", "+": "added", "-": "removed"}.get(line[:1], "context")
+        rows.append((css, line))
+    return rows
+
+
+# ──────────────────────────────────────────────────────────────
+#  Recording
+# ──────────────────────────────────────────────────────────────
+def record_on_commit(page_ids):
+    """Record revisions of `page_ids` once the current transaction commits."""
+    # one batch per transaction (and author) collects every page it touched
+    author_id = _current_user_id()
+    oncommit.defer(("revisions", author_id),
+                   lambda batch: record_many(batch["pages"], author_id=author_id),
+                   pages=page_ids)
+
+
+def record_many(page_ids, author_id=None):
+    """
+    Store a new revision for every page in `page_ids` whose content changed
+    since its last revision.  Returns the revisions created.
+    """
+    page_ids = set(page_ids)
+    if not page_ids:
+        return []
+    for attempt in range(RETRIES):
+        try:
+            with transaction.atomic():
+                revisions = _build(page_ids, author_id)
+                PageRevision.objects.bulk_create(revisions)
+                return revisions
+        except IntegrityError:
+            # somebody recorded the same page meanwhile: number again
+            if attempt == RETRIES - 1:
+                raise
+
+
+def _build(page_ids, author_id):
+    latest = PageRevision.objects.filter(page=OuterRef("pk")).order_by("-number")
+    pages = (WikiPage.objects.filter(pk__in=page_ids)
+             .select_related("category")
+             .only("title", "content", "page_type", "author_id", "category__name")
+             .annotate(rev_number=Subquery(latest.values("number")[:1]),
+                       rev_digest=Subquery(latest.values("digest")[:1])))
+    steps = {}
+    for page_id, text, file in (GuideStep.objects.filter(wiki_page_id__in=page_ids)
+                                .order_by("wiki_page_id", "step_order")
+                                .values_list("wiki_page_id", "step_content", "file")):
+        steps.setdefault(page_id, []).append((text, file))
+
+    revisions = []
+    for page in pages:
+        lines = document(page.title, page.category.name, page.page_type,
+                         page.content, steps.get(page.pk, ()))
+        sha = digest(lines)
+        if sha == page.rev_digest:
+            continue
+        revision = PageRevision(page=page, digest=sha, author_id=author_id)
+        if page.rev_number is None:
+            # the first revision is the page as created
+            revision.number, revision.snapshot = 1, True
+            revision.author_id = author_id or page.author_id
+            revision.data = pack_snapshot(lines)
+            revision.added = len(lines)
+        else:
+            revision.number = page.rev_number + 1
+            chain = _chain(page.pk, page.rev_number)
+            ops, revision.added, revision.removed = _delta(_replay(chain), lines)
+            full, delta = pack_snapshot(lines), _pack_delta(ops)
+            # a snapshot every so often keeps rebuilding any revision bounded
+            revision.snapshot = (len(chain) >= snapshot_every() or len(delta) >= len(full))
+            revision.data = full if revision.snapshot else delta
+        revisions.append(revision)
+    return revisions
+
+
+# ──────────────────────────────────────────────────────────────
+#  Pruning
+# ──────────────────────────────────────────────────────────────
+def drop_before(page_id, number):
+    """
+    Delete the revisions of a page before `number`, first turning revision
+    `number` into a snapshot if it is a delta.  Returns how many were deleted.
+    """
+    with transaction.atomic():
+        keep = PageRevision.objects.select_for_update().filter(page_id=page_id, number=number).first()
+        if keep is None:
+            return 0
+        if not keep.snapshot:
+            keep.data = pack_snapshot(rebuild(page_id, number))
+            keep.snapshot = True
+            keep.save(update_fields=["data", "snapshot"])
+        deleted, _ = PageRevision.objects.filter(page_id=page_id, number__lt=number).delete()
+    return deleted
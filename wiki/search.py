@@ -0,0 +1,271 @@
+# wiki/search.py
+"""
+Full-text search over wiki pages and their guide steps.
+
+One index row per WikiPage, holding the title, the page content and the
+text of every GuideStep.  The backend is picked with
+``settings.WIKI_SEARCH_BACKEND`` (a dotted path); SQLite deployments use the
+FTS5 backend, anything else falls back to plain ``icontains`` lookups.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from .models import WikiPage, GuideStep
+
+# snippet() wraps matches in these private-use characters, so we can escape
+# the user text first and only then turn the markers into <mark> tags
+_HL_START = "\ue000"
+_HL_END   = "\ue001"
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class SearchHit:
+    page: WikiPage
+    snippet: str
+    rank: float = 0.0
+
+
+def highlight(text):
+    """Escape `text` and turn the highlight markers into <mark> tags."""
+    html = escape(text)
+    html = html.replace(_HL_START, "<mark>").replace(_HL_END, "</mark>")
+    return mark_safe(html)
+
+
+class SearchResults:
+    """
+    Lazy result list that Django's Paginator can slice.
+
+    Only the requested page of hits is fetched; `count()` is a separate,
+    index-only query.
+    """
+    def __init__(self, backend, query):
+        self.backend = backend
+        self.query = query
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if stop <= start:
+            return []
+        return self.backend.search(self.query, offset=start, limit=stop - start)
+
+
+# ──────────────────────────────────────────────────────────────
+#  Backends
+# ──────────────────────────────────────────────────────────────
+class BaseSearchBackend:
+    """Interface every search backend implements."""
+
+    def index_page(self, page_id):
+        """(Re)index one page, or drop it if the page no longer exists."""
+        raise NotImplementedError
+
+    def remove_page(self, page_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Drop everything and index all pages again. Returns the row count."""
+        raise NotImplementedError
+
+    def count(self, query):
+        raise NotImplementedError
+
+    def search(self, query, offset=0, limit=20):
+        """Return a list of SearchHit, best match first."""
+        raise NotImplementedError
+
+    def results(self, query):
+        return SearchResults(self, query)
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    No index at all – `icontains` over titles, content and step text.
+    Used on databases without FTS support.
+    """
+
+    def index_page(self, page_id):
+        pass
+
+    def remove_page(self, page_id):
+        pass
+
+    def rebuild(self):
+        return WikiPage.objects.count()
+
+    def _queryset(self, query):
+        return (
+            WikiPage.objects
+            .filter(
+                Q(title__icontains=query)
+                | Q(content__icontains=query)
+                | Q(guide_steps__step_content__icontains=query)
+            )
+            .distinct()
+        )
+
+    def count(self, query):
+        return self._queryset(query).count()
+
+    def search(self, query, offset=0, limit=20):
+        pages = self._queryset(query).select_related("category").order_by("-updated_at")
+        return [
+            SearchHit(page=p, snippet=highlight(_plain_snippet(p.content, query)))
+            for p in pages[offset:offset + limit]
+        ]
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 inverted index (see migration 0005 for the table).
+
+    The title column is weighted highest in bm25 ranking, step text lowest.
+    """
+    table = "wiki_search_index"
+    weights = (10.0, 2.0, 1.0)    # title, content, steps
+    snippet_tokens = 24
+
+    @staticmethod
+    def match_expression(query):
+        """
+        Turn free user input into a safe FTS5 MATCH expression.
+
+        Every word is quoted (so FTS operators in the input are inert) and
+        the last one becomes a prefix query, which keeps results useful
+        while the user is still typing.
+        """
+        tokens = _TOKEN_RE.findall(query)
+        if not tokens:
+            return ""
+        terms = [f'"{t}"' for t in tokens]
+        terms[-1] += "*"
+        return " ".join(terms)
+
+    def index_page(self, page_id):
+        row = (
+            WikiPage.objects
+            .filter(pk=page_id)
+            .values_list("title", "content")
+            .first()
+        )
+        if row is None:
+            self.remove_page(page_id)
+            return
+        steps = "\n".join(
+            GuideStep.objects
+            .filter(wiki_page_id=page_id)
+            .order_by("step_order")
+            .values_list("step_content", flat=True)
+        )
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [page_id])
+            cur.execute(
+                f"INSERT INTO {self.table}(rowid, title, content, steps) "
+                "VALUES (%s, %s, %s, %s)",
+                [page_id, row[0], row[1], steps],
+            )
+
+    def remove_page(self, page_id):
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [page_id])
+
+    def rebuild(self):
+        pages = WikiPage._meta.db_table
+        steps = GuideStep._meta.db_table
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table}")
+            cur.execute(
+                f"INSERT INTO {self.table}(rowid, title, content, steps) "
+                f"SELECT p.id, p.title, p.content, "
+                f"  COALESCE((SELECT group_concat(s.step_content, char(10)) "
+                f"            FROM (SELECT step_content FROM {steps} "
+                f"                  WHERE wiki_page_id = p.id ORDER BY step_order) s), '') "
+                f"FROM {pages} p"
+            )
+            count = cur.rowcount
+            # merge the b-tree segments left behind by the bulk insert
+            cur.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+        return count
+
+    def count(self, query):
+        match = self.match_expression(query)
+        if not match:
+            return 0
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT count(*) FROM {self.table} WHERE {self.table} MATCH %s",
+                [match],
+            )
+            return cur.fetchone()[0]
+
+    def search(self, query, offset=0, limit=20):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        w_title, w_content, w_steps = self.weights
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT rowid, "
+                f"  bm25({self.table}, %s, %s, %s) AS score, "
+                f"  snippet({self.table}, -1, %s, %s, '…', %s) "
+                f"FROM {self.table} WHERE {self.table} MATCH %s "
+                f"ORDER BY score LIMIT %s OFFSET %s",
+                [w_title, w_content, w_steps, _HL_START, _HL_END,
+                 self.snippet_tokens, match, limit, offset],
+            )
+            rows = cur.fetchall()
+
+        # the snippet comes from the index: no need for the page text
+        pages = WikiPage.objects.select_related("category").defer("content", "html").in_bulk(
+            [r[0] for r in rows]
+        )
+        return [
+            SearchHit(page=pages[pk], snippet=highlight(snip), rank=score)
+            for pk, score, snip in rows
+            if pk in pages
+        ]
+
+
+def _plain_snippet(text, query, width=160):
+    """Cut a window of `text` around the first occurrence of `query`."""
+    pos = text.lower().find(query.lower())
+    if pos < 0:
+        return text[:width]
+    start = max(pos - width // 2, 0)
+    end = pos + len(query)
+    snippet = text[start:pos] + _HL_START + text[pos:end] + _HL_END
+    snippet += text[end:start + width]
+    return ("…" if start else "") + snippet
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, "WIKI_SEARCH_BACKEND", None)
+    if path is None:
+        path = (
+            "wiki.search.SQLiteFTSBackend"
+            if connection.vendor == "sqlite"
+            else "wiki.search.DatabaseSearchBackend"
+        )
+    return import_string(path)()
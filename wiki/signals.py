@@ -0,0 +1,251 @@
+# wiki/signals.py
+"""
+Model signal handlers, connected in WikiConfig.ready().
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_category_generation, forget_category_counts, touch_page, touch_pages
+from .models import Category, WikiPage, GuideStep, MediaFile, ResourceLink, Blob
+from . import images, oncommit, revisions, typeahead
+from .search import get_backend
+from .storage import is_blob
+
+
+# ──────────────────────────────────────────────────────────────
+#  Search index
+# ──────────────────────────────────────────────────────────────
+def _reindex(batch):
+    backend = get_backend()
+    for page_id in batch["pages"]:
+        backend.index_page(page_id)
+
+
+def _reindex_on_commit(page_ids):
+    # wait for the surrounding transaction, so a guide saved together with
+    # its steps is indexed once it is complete -- and only once
+    oncommit.defer("search", _reindex, pages=page_ids)
+
+
+@receiver(post_save, sender=WikiPage, dispatch_uid="wiki_search_page_saved")
+def index_saved_page(sender, instance, **kwargs):
+    _reindex_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=WikiPage, dispatch_uid="wiki_search_page_deleted")
+def unindex_deleted_page(sender, instance, **kwargs):
+    page_id = instance.pk
+    transaction.on_commit(lambda: get_backend().remove_page(page_id))
+
+
+@receiver(post_save, sender=GuideStep, dispatch_uid="wiki_search_step_saved")
+@receiver(post_delete, sender=GuideStep, dispatch_uid="wiki_search_step_deleted")
+def reindex_step_page(sender, instance, **kwargs):
+    _reindex_on_commit([instance.wiki_page_id])
+
+
+# ──────────────────────────────────────────────────────────────
+#  Blob reference counts (wiki/storage.py) and image derivatives
+#  (wiki/images.py) for newly attached files
+# ──────────────────────────────────────────────────────────────
+BLOB_MODELS = (GuideStep, MediaFile)
+
+
+def _incref(name):
+    _incref_many([name])
+
+
+def _incref_many(names):
+    counts = Counter(n for n in names if is_blob(n))
+    while counts:
+        Blob.objects.bulk_create([Blob(name=n) for n in counts], ignore_conflicts=True)
+        # one UPDATE per distinct count, almost always just one
+        by_count = defaultdict(list)
+        for name, count in counts.items():
+            by_count[count].append(name)
+        missed = []
+        for count, group in by_count.items():
+            if Blob.objects.filter(name__in=group).update(refcount=F('refcount') + count) < len(group):
+                missed += group
+        # sweep_blobs deletes rows at zero: any it took between the two
+        # statements above are created and counted again
+        present = set(Blob.objects.filter(name__in=missed).values_list('name', flat=True))
+        counts = Counter({n: counts[n] for n in missed if n not in present})
+
+
+def _decref(name):
+    if is_blob(name):
+        Blob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+
+
+_DEFERRED = object()
+
+
+def _loaded_name(instance):
+    # read the raw attribute: touching instance.file on a row loaded with
+    # .only()/.defer() would cost a query per row
+    value = instance.__dict__.get('file', _DEFERRED)
+    return getattr(value, 'name', value)
+
+
+def remember_blob(sender, instance, **kwargs):
+    # the name the row had when loaded, to spot a replaced file on save
+    instance._saved_blob = _loaded_name(instance) if instance.pk else None
+
+
+def count_blob_on_save(sender, instance, created, **kwargs):
+    old, new = getattr(instance, '_saved_blob', None), _loaded_name(instance)
+    if new is _DEFERRED:
+        return
+    if old is not _DEFERRED and old != new:
+        _incref(new)
+        _decref(old)
+        if new:
+            storage = instance.file.storage
+            transaction.on_commit(lambda: images.schedule(new, storage))
+    instance._saved_blob = new
+
+
+def release_blob_on_delete(sender, instance, **kwargs):
+    name = getattr(instance, '_saved_blob', _DEFERRED)
+    if name is _DEFERRED:
+        name = instance.file.name
+    _decref(name)
+
+
+for model in BLOB_MODELS:
+    uid = model._meta.label_lower
+    post_init.connect(remember_blob, sender=model, dispatch_uid=f"{uid}_remember_blob")
+    post_save.connect(count_blob_on_save, sender=model, dispatch_uid=f"{uid}_count_blob")
+    post_delete.connect(release_blob_on_delete, sender=model, dispatch_uid=f"{uid}_release_blob")
+
+
+# ──────────────────────────────────────────────────────────────
+#  Rendered-page cache (wiki/cache.py)
+# ──────────────────────────────────────────────────────────────
+@receiver(post_save, sender=GuideStep, dispatch_uid="wiki_cache_step_saved")
+@receiver(post_delete, sender=GuideStep, dispatch_uid="wiki_cache_step_deleted")
+def touch_step_page(sender, instance, **kwargs):
+    touch_page(instance.wiki_page_id)
+
+
+@receiver(post_save, sender=MediaFile, dispatch_uid="wiki_cache_media_saved")
+@receiver(post_delete, sender=MediaFile, dispatch_uid="wiki_cache_media_deleted")
+@receiver(post_save, sender=ResourceLink, dispatch_uid="wiki_cache_link_saved")
+@receiver(post_delete, sender=ResourceLink, dispatch_uid="wiki_cache_link_deleted")
+def touch_attachment_page(sender, instance, **kwargs):
+    touch_page(instance.page_id)
+
+
+@receiver(post_init, sender=WikiPage, dispatch_uid="wiki_cache_page_loaded")
+def remember_page_category(sender, instance, **kwargs):
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+
+
+@receiver(post_save, sender=WikiPage, dispatch_uid="wiki_cache_page_saved")
+def recount_category_pages(sender, instance, created, **kwargs):
+    # page counts in the navbar only move on create, delete or a category
+    # move; they have their own cache entry, rendered pages stay valid
+    if created or instance._loaded_category_id != instance.category_id:
+        transaction.on_commit(forget_category_counts)
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=WikiPage, dispatch_uid="wiki_cache_page_deleted")
+def recount_after_delete(sender, instance, **kwargs):
+    transaction.on_commit(forget_category_counts)
+
+
+@receiver(post_save, sender=Category, dispatch_uid="wiki_cache_category_saved")
+@receiver(post_delete, sender=Category, dispatch_uid="wiki_cache_category_deleted")
+def invalidate_categories(sender, instance, **kwargs):
+    # after commit, so nobody rebuilds the snapshot from the old rows
+    transaction.on_commit(bump_category_generation)
+
+
+# ──────────────────────────────────────────────────────────────
+#  Revision history (wiki/revisions.py)
+# ──────────────────────────────────────────────────────────────
+@receiver(post_save, sender=WikiPage, dispatch_uid="wiki_revision_page_saved")
+def record_page_revision(sender, instance, **kwargs):
+    revisions.record_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=GuideStep, dispatch_uid="wiki_revision_step_saved")
+@receiver(post_delete, sender=GuideStep, dispatch_uid="wiki_revision_step_deleted")
+def record_step_revision(sender, instance, **kwargs):
+    # steps deleted along with their page find no page and record nothing
+    revisions.record_on_commit([instance.wiki_page_id])
+
+
+# ──────────────────────────────────────────────────────────────
+#  Typeahead index (wiki/typeahead.py)
+# ──────────────────────────────────────────────────────────────
+@receiver(post_save, sender=WikiPage, dispatch_uid="wiki_typeahead_page_saved")
+def complete_saved_page(sender, instance, **kwargs):
+    typeahead.update_on_commit(page_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=WikiPage, dispatch_uid="wiki_typeahead_page_deleted")
+def forget_deleted_page(sender, instance, **kwargs):
+    typeahead.update_on_commit(deleted=[instance.pk])
+
+
+@receiver(post_save, sender=GuideStep, dispatch_uid="wiki_typeahead_step_saved")
+@receiver(post_delete, sender=GuideStep, dispatch_uid="wiki_typeahead_step_deleted")
+def complete_step_page(sender, instance, **kwargs):
+    typeahead.update_on_commit(page_ids=[instance.wiki_page_id])
+
+
+@receiver(post_save, sender=Category, dispatch_uid="wiki_typeahead_category_saved")
+@receiver(post_delete, sender=Category, dispatch_uid="wiki_typeahead_category_deleted")
+def complete_categories(sender, instance, **kwargs):
+    typeahead.update_on_commit(categories=True)
+
+
+# ──────────────────────────────────────────────────────────────
+#  bulk_create() / bulk_update() send no signals
+# ──────────────────────────────────────────────────────────────
+def bulk_saved(model, instances, created=True):
+    """
+    Do for rows written in bulk what the handlers above do per row, with a
+    constant number of queries: count new blobs, schedule their derivatives,
+    invalidate and reindex the pages they belong to and record their
+    revisions (or, for pages themselves, index them, record them and
+    refresh the category counts).  Both also update the typeahead index.
+    """
+    instances = list(instances)
+    if not instances:
+        return
+
+    if model is WikiPage:
+        page_ids = [page.pk for page in instances]
+        revisions.record_on_commit(page_ids)
+        typeahead.update_on_commit(page_ids=page_ids)
+        _reindex_on_commit(page_ids)
+        for page in instances:
+            page._loaded_category_id = page.category_id
+        if created:
+            transaction.on_commit(forget_category_counts)
+        return
+
+    if created and model in BLOB_MODELS:
+        names = [_loaded_name(i) for i in instances]
+        _incref_many(n for n in names if n and n is not _DEFERRED)
+        for instance, name in zip(instances, names):
+            instance._saved_blob = name
+        storage = model._meta.get_field('file').storage
+        new = {n for n in names if n and n is not _DEFERRED}
+        transaction.on_commit(lambda: [images.schedule(n, storage) for n in new])
+
+    page_field = 'wiki_page_id' if model is GuideStep else 'page_id'
+    page_ids = {getattr(i, page_field) for i in instances}
+    touch_pages(page_ids)
+    if model is GuideStep:
+        revisions.record_on_commit(page_ids)
+        typeahead.update_on_commit(page_ids=page_ids)
+        _reindex_on_commit(page_ids)
@@ -0,0 +1,75 @@
+# wiki/slugs.py
+"""
+Unique slugs for wiki pages.
+
+A title's slug is slugify(title); if that is taken, the first free
+"<slug>-N" is used.  All slugs sharing the base are fetched in one query
+instead of probing candidates one by one, and `allocate_many` does the
+same for a whole batch of titles (bulk imports).
+
+Allocation alone can still race with another request saving the same
+title, so WikiPage.save retries on the unique-constraint error.
+"""
+import re
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.utils.text import slugify
+
+FALLBACK = "page"      # slugify() of a title like "???" is empty
+BATCH = 200            # bases per query in allocate_many
+
+
+def base_slug(title, max_length):
+    # leave room for a "-N" suffix so it never gets cut off
+    slug = slugify(title)[: max_length - 6].strip("-")
+    return slug or FALLBACK
+
+
+def _taken(model, bases):
+    """Map each base to the set of slugs in the table that could clash with it."""
+    taken = {base: set() for base in bases}
+    bases = list(taken)
+    for i in range(0, len(bases), BATCH):
+        chunk = bases[i : i + BATCH]
+        query = reduce(or_, (Q(slug=b) | Q(slug__startswith=f"{b}-") for b in chunk))
+        for slug in model._default_manager.filter(query).values_list("slug", flat=True):
+            for base in chunk:
+                if slug == base or slug.startswith(f"{base}-"):
+                    taken[base].add(slug)
+    return taken
+
+
+def _free(base, taken):
+    """The first of base, base-1, base-2, … not in `taken`."""
+    if base not in taken:
+        return base
+    suffix = re.compile(rf"^{re.escape(base)}-(\d+)$")
+    used = {int(m.group(1)) for m in map(suffix.match, taken) if m}
+    counter = 1
+    while counter in used:
+        counter += 1
+    return f"{base}-{counter}"
+
+
+def allocate(model, title, max_length, exclude=()):
+    """A slug for `title` that no row of `model` uses yet (one query)."""
+    base = base_slug(title, max_length)
+    taken = _taken(model, [base])[base] | set(exclude)
+    return _free(base, taken)
+
+
+def allocate_many(model, titles, max_length):
+    """
+    Slugs for many new rows at once, unique among themselves and against
+    the table: one query per BATCH distinct titles.
+    """
+    bases = [base_slug(t, max_length) for t in titles]
+    taken = _taken(model, set(bases))
+    slugs = []
+    for base in bases:
+        slug = _free(base, taken[base])
+        taken[base].add(slug)
+        slugs.append(slug)
+    return slugs
@@ -0,0 +1,82 @@
+# wiki/static_export.py
+"""
+Rendering side of `manage.py export_static`.
+
+Pages are rendered through Django's test client (the full middleware and
+context-processor stack, as an anonymous visitor) and written under the
+export directory as <url path>/index.html.  The functions here run in
+spawned worker processes, so nothing is imported from the models at module
+level.
+"""
+import os
+import re
+import tempfile
+from pathlib import Path
+from urllib.parse import unquote
+
+_client = None
+
+
+def init_worker(host):
+    import django
+    django.setup()
+
+    from django.test import Client
+    global _client
+    _client = Client(HTTP_HOST=host)
+
+
+def output_path(url):
+    """/wiki/page/foo/ -> wiki/page/foo/index.html"""
+    return (Path(url.strip("/")) / "index.html").as_posix()
+
+
+def media_names(html):
+    """Storage names of every MEDIA_URL file a page links to (src, href, srcset)."""
+    from django.conf import settings
+
+    prefix = re.escape(settings.MEDIA_URL)
+    return sorted({
+        unquote(m) for m in re.findall(rf"{prefix}([^\"'\s,?#<>]+)", html)
+    })
+
+
+def write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".export-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def render(outdir, urls, secure=False):
+    """
+    Render `urls` into `outdir`.  Returns one dict per url: the file written,
+    the media it references, whether image derivatives were still missing
+    (so the next export renders it again), or the error.
+    """
+    results = []
+    for url in urls:
+        try:
+            response = _client.get(url, secure=secure)
+        except Exception as exc:
+            results.append({"url": url, "error": f"{type(exc).__name__}: {exc}"})
+            continue
+        if response.status_code != 200:
+            results.append({"url": url, "error": f"HTTP {response.status_code}"})
+            continue
+        html = response.content
+        name = output_path(url)
+        write_atomic(Path(outdir) / name, html)
+        results.append({
+            "url": url,
+            "file": name,
+            "media": media_names(html.decode(response.charset or "utf-8", "replace")),
+            "pending": getattr(response.wsgi_request, "derivatives_pending", False),
+        })
+    return results
@@ -0,0 +1,97 @@
+# wiki/storage.py
+"""
+Content-addressed storage for uploaded guide and media files.
+
+A file is stored as blobs/ab/cd/<sha256><ext>, so uploading the same bytes
+twice (or importing the same PDF page again) reuses the existing blob
+instead of writing a random-suffixed copy.  Since the bytes behind a name
+can never change, blobs can be served with immutable cache headers.
+
+Which rows use a blob is tracked in the Blob table (see signals.py);
+`manage.py sweep_blobs` deletes blobs nobody references any more.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+BLOB_PREFIX = "blobs"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def blob_name(self, digest, ext=""):
+        return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        # keep the extension, so the web server still sends the right type
+        ext = Path(name).suffix.lower()[:10]
+        target = self.blob_name(digest.hexdigest(), ext)
+
+        if self.exists(target):
+            try:
+                # reused: sweep_blobs' grace period starts again, so the
+                # blob isn't swept before the row using it is saved
+                os.utime(self.path(target))
+                return target
+            except FileNotFoundError:
+                pass            # swept a moment ago: store it again
+        return super().save(target, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # equal names mean equal bytes: no suffixes, ever
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+
+        # write next to the target and rename: concurrent uploads of the
+        # same bytes both succeed, and nobody ever sees a half-written blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in content.chunks():
+                    fh.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return name
+
+    def iter_blobs(self):
+        """Yield the name of every stored blob."""
+        root = Path(self.path(BLOB_PREFIX))
+        if not root.exists():
+            return
+        for path in root.rglob("*"):
+            if path.is_file() and not path.name.startswith(".upload-"):
+                yield path.relative_to(self.location).as_posix()
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def get_blob_storage():
+    """Callable for FileField(storage=...), so migrations don't pickle the instance."""
+    return blob_storage
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX + "/")
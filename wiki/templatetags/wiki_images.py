@@ -0,0 +1,57 @@
+# wiki/templatetags/wiki_images.py
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from wiki import images
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, file, sizes="100vw", alt="", css_class="", style="", deferred=False):
+    """
+    <picture> for an uploaded image, with AVIF/WebP sources and a srcset
+    of every derivative width, lazy-loaded.
+
+        {% responsive_image step.file sizes="220px" alt="step image" css_class="img-thumbnail" %}
+
+    `deferred=True` writes data-srcset/data-src instead, for images inside a
+    modal: nothing is downloaded until the script swaps them in on open.
+    Files without derivatives yet (or that aren't images) render as a plain
+    <img> of the original, and their derivatives are queued.  The request is
+    flagged, so page_detail doesn't cache that temporary markup.
+    """
+    if not file:
+        return ""
+    manifest = images.get_manifest(file.name)
+    if manifest is None:
+        images.schedule(file.name, file.storage)
+        request = context.get("request")
+        if request is not None:
+            request.derivatives_pending = True
+    prefix = "data-" if deferred else ""
+
+    if not manifest or not manifest["image"]:
+        return format_html(
+            '<img {}src="{}" alt="{}" class="{}" style="{}" loading="lazy" decoding="async">',
+            prefix, file.url, alt, css_class, style,
+        )
+
+    def srcset(fmt):
+        return ", ".join(f"{url} {w}w" for url, w in images.variants(manifest, fmt))
+
+    sources = format_html_join(
+        "",
+        '<source type="{}" {}srcset="{}" sizes="{}">',
+        (
+            (images.MIME[fmt], prefix, srcset(fmt), sizes)
+            for fmt in manifest["formats"] if fmt != manifest["fallback"]
+        ),
+    )
+    fallback = images.variants(manifest, manifest["fallback"])
+    return format_html(
+        '<picture>{}<img {}src="{}" {}srcset="{}" sizes="{}" width="{}" height="{}" '
+        'alt="{}" class="{}" style="{}" loading="lazy" decoding="async"></picture>',
+        sources, prefix, fallback[0][0], prefix, srcset(manifest["fallback"]), sizes,
+        manifest["width"], manifest["height"], alt, css_class, style,
+    )
@@ -1,3 +1,487 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from wiki import pagination, reimport, revisions, slugs, steps
+from wiki.markup import render
+from wiki.models import Category, GuideStep, PageRevision, WikiPage
+
+
+class LinkTests(SimpleTestCase):
+    def test_safe_schemes_become_links(self):
+        self.assertEqual(render("[a](https://x.org/p?q=1)"),
+                         '<p><a href="https://x.org/p?q=1">a</a></p>')
+        self.assertEqual(render("[a](mailto:ndt@example.org)"),
+                         '<p><a href="mailto:ndt@example.org">a</a></p>')
+        self.assertEqual(render("[a](/wiki/page/)"), '<p><a href="/wiki/page/">a</a></p>')
+
+    def test_other_schemes_keep_only_the_label(self):
+        for url in ("javascript:alert(1)", "JavaScript:alert(1)", "data:text/html,x",
+                    "vbscript:x"):
+            with self.subTest(url=url):
+                self.assertNotIn("<a", render(f"[label]({url})"))
+                self.assertIn("label", render(f"[label]({url})"))
+
+    def test_control_characters_in_url(self):
+        self.assertEqual(render("[a](java\x01script:x)"), "<p>a</p>")
+
+    def test_entities_in_url_stay_literal(self):
+        # the & is escaped, so browsers see a relative url, not a tab
+        self.assertEqual(render("[a](java&#x09;script:x)"),
+                         '<p><a href="java&amp;#x09;script:x">a</a></p>')
+
+    def test_autolinks(self):
+        self.assertEqual(render("<https://x.org/a>"),
+                         '<p><a href="https://x.org/a">https://x.org/a</a></p>')
+        self.assertNotIn("<a", render("<javascript:alert(1)>"))
+
+    def test_quotes_in_url_stay_inside_the_attribute(self):
+        self.assertEqual(render('[a](/x"onclick="y)'),
+                         '<p><a href="/x&quot;onclick=&quot;y">a</a></p>')
+
+
+class EscapingTests(SimpleTestCase):
+    def test_html_is_escaped(self):
+        self.assertEqual(render("<script>alert('x')</script> & co"),
+                         "<p>&lt;script&gt;alert(&#x27;x&#x27;)&lt;/script&gt; &amp; co</p>")
+
+    def test_plain_text_renders_like_linebreaks(self):
+        self.assertEqual(render("one\ntwo\n\nthree"), "<p>one<br>two</p>\n\n<p>three</p>")
+        self.assertEqual(render(""), "")
+
+    def test_nul_bytes_cannot_forge_held_fragments(self):
+        self.assertEqual(render("x\x000\x00 `c`"), "<p>x0 <code>c</code></p>")
+
+    def test_emphasis_not_inside_words(self):
+        self.assertEqual(render("snake_case_name and 2*3*4"),
+                         "<p>snake_case_name and 2*3*4</p>")
+
+
+class FenceTests(SimpleTestCase):
+    def test_fenced_code_is_escaped_and_not_formatted(self):
+        self.assertEqual(render("```\n<b>*x*</b>\n\n[a](http://x)\n```"),
+                         "<pre><code>&lt;b&gt;*x*&lt;/b&gt;\n\n[a](http://x)</code></pre>")
+
+    def test_tilde_fence_and_surrounding_paragraphs(self):
+        self.assertEqual(render("before\n~~~\ncode\n~~~\nafter"),
+                         "<p>before</p>\n\n<pre><code>code</code></pre>\n\n<p>after</p>")
+
+    def test_unclosed_fence_runs_to_the_end(self):
+        self.assertEqual(render("```\na\n# b"), "<pre><code>a\n# b</code></pre>")
+
+    def test_code_spans_hide_their_content(self):
+        self.assertEqual(render("`*a* [b](http://x)`"),
+                         "<p><code>*a* [b](http://x)</code></p>")
+
+
+class NestingTests(SimpleTestCase):
+    def test_emphasis_does_not_cross_a_link(self):
+        self.assertEqual(render("[a *b](http://x) c*"),
+                         '<p><a href="http://x">a *b</a> c*</p>')
+
+    def test_emphasis_inside_and_around_links(self):
+        self.assertEqual(render("[*a*](http://x)"), '<p><a href="http://x"><em>a</em></a></p>')
+        self.assertEqual(render("**b [c](/y) d**"),
+                         '<p><strong>b <a href="/y">c</a> d</strong></p>')
+
+    def test_strong_inside_em(self):
+        self.assertEqual(render("*a **b** c*"), "<p><em>a <strong>b</strong> c</em></p>")
+
+    def test_code_inside_link_label(self):
+        self.assertEqual(render("[`x`](/y)"), '<p><a href="/y"><code>x</code></a></p>')
+
+    def test_lists_and_quotes(self):
+        self.assertEqual(render("3. *a*\n4. b"),
+                         '<ol start="3"><li><em>a</em></li><li>b</li></ol>')
+        self.assertEqual(render("> # t\n> - [a](/b)"),
+                         '<blockquote><h1>t</h1>\n<ul><li><a href="/b">a</a></li></ul></blockquote>')
+
+
+def make_page(category, title, **kwargs):
+    kwargs.setdefault("content", "")
+    return WikiPage.objects.create(title=title, category=category, **kwargs)
+
+
+class SlugTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Tests")
+
+    def test_repeated_titles_get_suffixes(self):
+        pages = [make_page(self.category, "Installation") for _ in range(3)]
+        self.assertEqual([p.slug for p in pages],
+                         ["installation", "installation-1", "installation-2"])
+
+    def test_first_free_suffix_is_reused(self):
+        pages = [make_page(self.category, "Installation") for _ in range(4)]
+        pages[2].delete()
+        self.assertEqual(make_page(self.category, "Installation").slug, "installation-2")
+
+    def test_longer_slugs_with_the_same_start_dont_count(self):
+        make_page(self.category, "Installation guide")
+        make_page(self.category, "Installation 10")
+        self.assertEqual(make_page(self.category, "Installation").slug, "installation")
+        self.assertEqual(make_page(self.category, "Installation").slug, "installation-1")
+
+    def test_empty_slug_falls_back(self):
+        self.assertEqual(make_page(self.category, "???").slug, slugs.FALLBACK)
+        self.assertEqual(make_page(self.category, "!!!").slug, f"{slugs.FALLBACK}-1")
+
+    def test_one_query_per_allocation(self):
+        for _ in range(10):
+            make_page(self.category, "Installation")
+        with self.assertNumQueries(1):
+            self.assertEqual(slugs.allocate(WikiPage, "Installation", 220), "installation-10")
+
+    def test_allocate_many_is_unique_in_the_batch_and_the_table(self):
+        make_page(self.category, "Installation")
+        make_page(self.category, "Setup")
+        with self.assertNumQueries(1):
+            allocated = slugs.allocate_many(
+                WikiPage, ["Installation", "Setup", "Installation", "Wiring", "Wiring"], 220)
+        self.assertEqual(allocated, ["installation-1", "setup-1", "installation-2",
+                                     "wiring", "wiring-1"])
+
+    def test_slug_taken_after_allocation_is_retried(self):
+        make_page(self.category, "Installation")
+        allocate = slugs.allocate
+        excluded = []
+
+        def stale(model, title, max_length, exclude=()):
+            # the first answer was allocated before another request saved it
+            excluded.append(set(exclude))
+            if len(excluded) == 1:
+                return "installation"
+            return allocate(model, title, max_length, exclude)
+
+        with mock.patch.object(slugs, "allocate", side_effect=stale):
+            page = make_page(self.category, "Installation")
+        self.assertEqual(page.slug, "installation-1")
+        self.assertEqual(excluded, [set(), {"installation"}])
+        self.assertEqual(WikiPage.objects.filter(title="Installation").count(), 2)
+
+    def test_gives_up_after_the_retries(self):
+        make_page(self.category, "Installation")
+        with mock.patch.object(slugs, "allocate", return_value="installation") as allocate:
+            with self.assertRaises(IntegrityError):
+                make_page(self.category, "Installation")
+        self.assertEqual(allocate.call_count, WikiPage.SLUG_RETRIES)
+
+    def test_other_integrity_errors_are_not_retried(self):
+        with mock.patch.object(slugs, "allocate", wraps=slugs.allocate) as allocate:
+            with self.assertRaises(IntegrityError):
+                make_page(self.category, "Installation", content=None)
+        self.assertEqual(allocate.call_count, 1)
+
+
+class StepOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Tests")
+
+    def setUp(self):
+        self.guide = make_page(self.category, "Guide", page_type=WikiPage.GUIDE)
+
+    def orders(self):
+        return list(self.guide.guide_steps.order_by("step_order")
+                    .values_list("step_content", "step_order"))
+
+    def add(self, *texts):
+        return steps.add_steps(self.guide, [GuideStep(step_content=t) for t in texts])
+
+    def test_add_steps_numbers_after_the_last_step(self):
+        GuideStep.objects.create(wiki_page=self.guide, step_content="a")
+        self.add("b", "c")
+        self.assertEqual(self.orders(), [("a", 1), ("b", 2), ("c", 3)])
+
+    def test_add_steps_costs_the_same_for_any_number_of_steps(self):
+        with CaptureQueriesContext(connection) as few:
+            self.add(*"abc")
+        with CaptureQueriesContext(connection) as many:
+            self.add(*"d" * 30)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual([o for _, o in self.orders()], list(range(1, 34)))
+
+    def test_add_steps_numbers_again_after_a_concurrent_append(self):
+        self.add("a", "b")
+        next_order = steps.next_order
+        calls = []
+
+        def stale(page):
+            # the first count was taken before another request added "b"
+            calls.append(page)
+            return 2 if len(calls) == 1 else next_order(page)
+
+        with mock.patch.object(steps, "next_order", side_effect=stale):
+            added = self.add("c", "d")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([s.step_order for s in added], [3, 4])
+        self.assertEqual(self.orders(), [("a", 1), ("b", 2), ("c", 3), ("d", 4)])
+
+    def test_the_constraint_rejects_duplicate_orders(self):
+        self.add("a")
+        with self.assertRaises(IntegrityError):
+            GuideStep.objects.create(wiki_page=self.guide, step_content="b", step_order=1)
+
+    def test_reorder_steps(self):
+        a, b, c, d = self.add(*"abcd")
+        steps.reorder_steps(self.guide, [d.pk, b.pk])
+        self.assertEqual(self.orders(), [("d", 1), ("b", 2), ("a", 3), ("c", 4)])
+
+    def test_reorder_steps_swapping_neighbours(self):
+        a, b = self.add("a", "b")
+        steps.reorder_steps(self.guide, [b.pk, a.pk])
+        steps.reorder_steps(self.guide, [a.pk, b.pk])
+        self.assertEqual(self.orders(), [("a", 1), ("b", 2)])
+
+    def test_reorder_steps_leaves_other_guides_alone(self):
+        other = make_page(self.category, "Other", page_type=WikiPage.GUIDE)
+        steps.add_steps(other, [GuideStep(step_content="x")])
+        a, b = self.add("a", "b")
+        steps.reorder_steps(self.guide, [b.pk, a.pk])
+        self.assertEqual(list(other.guide_steps.values_list("step_order", flat=True)), [1])
+
+    def test_renumber_steps_closes_gaps(self):
+        a, b, c, d = self.add(*"abcd")
+        b.delete()
+        d.delete()
+        steps.renumber_steps(self.guide)
+        self.assertEqual(self.orders(), [("a", 1), ("c", 2)])
+        self.add("e")
+        self.assertEqual(self.orders(), [("a", 1), ("c", 2), ("e", 3)])
+
+
+@override_settings(WIKI_REVISION_SNAPSHOT_EVERY=3)
+class RevisionTests(TestCase):
+    # revisions are recorded on commit, which a TestCase never does, so the
+    # tests call record_many() themselves
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Tests")
+
+    def setUp(self):
+        # long enough that a one-line delta is smaller than a snapshot
+        self.lines = [f"line {i} of the procedure" for i in range(50)]
+        self.page = make_page(self.category, "Guide", content="\n".join(self.lines))
+        self.versions = []
+        self.record()
+
+    def record(self):
+        revisions.record_many([self.page.pk])
+        self.versions.append(revisions.document(
+            self.page.title, self.category.name, self.page.page_type,
+            self.page.content, [(s.step_content, s.file.name or "")
+                                for s in self.page.guide_steps.order_by("step_order")]))
+
+    def edit(self, times):
+        for _ in range(times):
+            n = len(self.versions)
+            self.lines[n % 50] = f"line {n % 50}, edited in version {n + 1}"
+            self.page.content = "\n".join(self.lines)
+            self.page.save()
+            self.record()
+
+    def snapshots(self):
+        return list(self.page.revisions.order_by("number").values_list("number", "snapshot"))
+
+    def test_snapshot_every_few_revisions(self):
+        self.edit(7)
+        self.assertEqual([s for _, s in self.snapshots()],
+                         [True, False, False, True, False, False, True, False])
+
+    def test_rebuild_every_revision(self):
+        self.edit(7)
+        for number, expected in enumerate(self.versions, start=1):
+            with self.subTest(number=number), self.assertNumQueries(1):
+                self.assertEqual(revisions.rebuild(self.page.pk, number), expected)
+        self.assertIsNone(revisions.rebuild(self.page.pk, 9))
+
+    def test_unchanged_page_records_nothing(self):
+        self.page.save()
+        self.assertEqual(revisions.record_many([self.page.pk]), [])
+        self.assertEqual(self.page.revisions.count(), 1)
+
+    def test_steps_are_part_of_the_revision(self):
+        steps.add_steps(self.page, [GuideStep(step_content="Unplug it")])
+        self.record()
+        self.assertEqual(revisions.rebuild(self.page.pk, 2)[-2:], ["== Step 1 ==", "Unplug it"])
+        self.assertEqual(revisions.rebuild(self.page.pk, 1), self.versions[0])
+
+    def test_drop_before_a_delta(self):
+        self.edit(7)
+        self.assertEqual(revisions.drop_before(self.page.pk, 6), 5)
+        self.assertEqual(self.snapshots(), [(6, True), (7, True), (8, False)])
+        self.assertIsNone(revisions.rebuild(self.page.pk, 5))
+        for number in (6, 7, 8):
+            with self.subTest(number=number):
+                self.assertEqual(revisions.rebuild(self.page.pk, number), self.versions[number - 1])
+
+    def test_drop_before_a_snapshot_keeps_it(self):
+        self.edit(7)
+        data = bytes(PageRevision.objects.get(page=self.page, number=4).data)
+        self.assertEqual(revisions.drop_before(self.page.pk, 4), 3)
+        self.assertEqual(bytes(PageRevision.objects.get(page=self.page, number=4).data), data)
+        self.assertEqual(revisions.rebuild(self.page.pk, 5), self.versions[4])
+
+    def test_recording_continues_after_drop_before(self):
+        self.edit(4)
+        revisions.drop_before(self.page.pk, 5)
+        self.edit(3)
+        self.assertEqual(self.snapshots(), [(5, True), (6, False), (7, False), (8, True)])
+        for number in range(5, 9):
+            with self.subTest(number=number):
+                self.assertEqual(revisions.rebuild(self.page.pk, number), self.versions[number - 1])
+        self.assertEqual(revisions.drop_before(self.page.pk, 42), 0)
+
+
+class KeysetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Tests")
+        cls.pages = [make_page(cls.category, f"Page {i}") for i in range(7)]
+        # an import saves many pages within the same microsecond or so
+        cls.stamp = timezone.now().replace(microsecond=0)
+        WikiPage.objects.update(updated_at=cls.stamp)
+
+    def walk(self, size):
+        seen, cursor = [], None
+        while True:
+            rows = list(WikiPage.objects.filter(pagination.after(cursor, "updated_at"))
+                        .order_by(*pagination.ordering("updated_at"))[:size + 1])
+            page = pagination.CursorPage.from_rows(rows, size, cursor, "updated_at")
+            seen += [p.pk for p in page.items]
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_ties_are_each_seen_once(self):
+        expected = sorted((p.pk for p in self.pages), reverse=True)
+        for size in (1, 2, 3, 7, 10):
+            with self.subTest(size=size):
+                self.assertEqual(self.walk(size), expected)
+
+    def test_ties_next_to_older_and_newer_rows(self):
+        WikiPage.objects.filter(pk=self.pages[0].pk).update(updated_at=self.stamp + timedelta(seconds=1))
+        WikiPage.objects.filter(pk=self.pages[6].pk).update(updated_at=self.stamp - timedelta(seconds=1))
+        expected = [self.pages[0].pk, *sorted((p.pk for p in self.pages[1:6]), reverse=True),
+                    self.pages[6].pk]
+        for size in (1, 2, 4):
+            with self.subTest(size=size):
+                self.assertEqual(self.walk(size), expected)
+
+    def test_cursor_round_trip(self):
+        token = pagination.encode_cursor(self.stamp, 42)
+        self.assertEqual(pagination.decode_cursor(token), (self.stamp, 42))
+        for bad in ("", None, "!!", "bm90IGEgY3Vyc29y"):
+            with self.subTest(token=bad):
+                self.assertIsNone(pagination.decode_cursor(bad))
+
+    def test_api_next_links_over_ties(self):
+        url, seen = reverse("wiki:api_pages") + "?limit=2&fields=id", []
+        while url:
+            body = self.client.get(url).json()
+            seen += [item["id"] for item in body["data"]]
+            url = body["next"]
+        self.assertEqual(seen, sorted((p.pk for p in self.pages), reverse=True))
+
+    def test_api_rejects_a_malformed_cursor(self):
+        response = self.client.get(reverse("wiki:api_pages"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
+
+    @override_settings(WIKI_API_SYNC_OVERLAP=300)
+    def test_as_of_overlaps_the_last_sync(self):
+        as_of = parse_datetime(self.client.get(reverse("wiki:api_pages")).json()["as_of"])
+        self.assertAlmostEqual(as_of, timezone.now() - timedelta(seconds=300),
+                               delta=timedelta(seconds=5))
+
+
+def unit(page, fingerprint=None, text=None):
+    return {"page": page, "text": text or f"text of page {page}",
+            "fingerprint": fingerprint or f"fp{page}"}
+
+
+def imported(pk, page, edited=False):
+    # a step as the import left it, or edited since
+    content = f"text of page {page}"
+    step = GuideStep(pk=pk, step_order=pk, step_content=content, source_page=page,
+                     fingerprint=f"fp{page}",
+                     imported_digest=reimport.step_digest(content, None))
+    if edited:
+        step.step_content += "\n\nCheck the torque first."
+    return step
+
+
+class ReimportDiffTests(SimpleTestCase):
+    def actions(self, steps, units, dismissed=()):
+        return [(action, step and step.pk, j)
+                for action, step, j in reimport.diff(steps, units, dismissed)]
+
+    def test_same(self):
+        steps = [imported(1, 1), imported(2, 2, edited=True)]
+        self.assertEqual(self.actions(steps, [unit(1), unit(2)]),
+                         [("same", 1, 0), ("same", 2, 1)])
+
+    def test_changed_page_replaces_an_untouched_step(self):
+        steps = [imported(1, 1), imported(2, 2), imported(3, 3)]
+        self.assertEqual(self.actions(steps, [unit(1), unit(2, "fp2-new"), unit(3)]),
+                         [("same", 1, 0), ("changed", 2, 1), ("same", 3, 2)])
+
+    def test_changed_page_conflicts_with_an_edited_step(self):
+        steps = [imported(1, 1), imported(2, 2, edited=True), imported(3, 3)]
+        self.assertEqual(self.actions(steps, [unit(1), unit(2, "fp2-new"), unit(3)]),
+                         [("same", 1, 0), ("conflict", 2, 1), ("same", 3, 2)])
+
+    def test_page_gone(self):
+        steps = [imported(1, 1), imported(2, 2), imported(3, 3, edited=True), imported(4, 4)]
+        self.assertEqual(self.actions(steps, [unit(1), unit(4)]),
+                         [("same", 1, 0), ("removed", 2, None), ("kept", 3, None),
+                          ("same", 4, 1)])
+
+    def test_inserted_page_doesnt_shift_the_rest(self):
+        steps = [imported(1, 1), imported(2, 2), imported(3, 3)]
+        units = [unit(1), unit(2), unit(3, "fp-inserted"), unit(4, "fp3")]
+        self.assertEqual(self.actions(steps, units),
+                         [("same", 1, 0), ("same", 2, 1), ("added", None, 2), ("same", 3, 3)])
+
+    def test_hand_written_steps_are_kept_in_place(self):
+        note = GuideStep(pk=9, step_order=2, step_content="Wear gloves.")
+        steps = [imported(1, 1), note, imported(3, 2)]
+        self.assertEqual(self.actions(steps, [unit(1), unit(2)]),
+                         [("same", 1, 0), ("kept", 9, None), ("same", 3, 1)])
+
+    def test_steps_without_fingerprint_match_by_text(self):
+        old = GuideStep(pk=1, step_order=1, step_content="  text of page 1\n")
+        other = GuideStep(pk=2, step_order=2, step_content="Something else")
+        self.assertEqual(self.actions([old, other], [unit(1), unit(2)]),
+                         [("same", 1, 0), ("kept", 2, None), ("added", None, 1)])
+
+    def test_dismissed_pages_stay_out(self):
+        steps = [imported(1, 1), imported(2, 2), imported(3, 3)]
+        units = [unit(1), unit(5, "fp-new"), unit(3)]
+        # the page that replaced page 2 was left out before: step 2 isn't
+        # paired with it, and it isn't offered as new either
+        self.assertEqual(self.actions(steps, units, dismissed={"fp-new"}),
+                         [("same", 1, 0), ("removed", 2, None), ("dismissed", None, 1),
+                          ("same", 3, 2)])
+        self.assertEqual(self.actions(steps, units),
+                         [("same", 1, 0), ("changed", 2, 1), ("same", 3, 2)])
+
+    def test_report_and_what_gets_rendered(self):
+        steps = [imported(1, 1), imported(2, 2), imported(3, 3, edited=True),
+                 imported(4, 4), imported(5, 5, edited=True), imported(6, 8)]
+        units = [unit(1), unit(2, "fp2-new"), unit(3, "fp3-new"), unit(8), unit(6), unit(7)]
+        changes = reimport.diff(steps, units, dismissed={"fp7"})
+        self.assertEqual(reimport.report(changes, units), {
+            "unchanged": [1, 8], "changed": [2], "added": [6], "dismissed": [7],
+            "removed": [4], "kept": [5], "conflicts": [(3, 3)],
+        })
+        self.assertEqual(reimport.rendered(changes), [1, 4])
+        self.assertEqual(reimport.optional(changes), [4, 5])
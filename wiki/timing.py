@@ -0,0 +1,203 @@
+# wiki/timing.py
+"""
+Per-request timing: SQL, template rendering and named spans.
+
+ServerTimingMiddleware goes first in MIDDLEWARE.  For a sampled request
+(WIKI_TIMING_SAMPLE_RATE) it counts and times every query, keeps the
+slowest ones, times template rendering (with the DjangoTemplates backend
+below in TEMPLATES; context processors included) and any `span()` the code
+opens, and reports them as a Server-Timing header:
+
+    Server-Timing: db;dur=12.4;desc="9 queries", tpl;dur=30.1, app;dur=8.0, total;dur=50.5
+
+Queries a template triggers (lazy querysets) count as `db`, not `tpl`.
+`app` is what is left of `total`: view code, middleware, everything else.
+Spans (e.g. `nav`, the category menu) overlap the others and are listed
+on their own.  PDF rasterization runs on the import workers, outside any
+request; `manage.py bench_views` measures it.
+
+Requests slower than WIKI_SLOW_REQUEST_MS are logged to "wiki.timing" as
+one JSON object; queries run WIKI_REPEATED_QUERY_LIMIT times or more with
+the same SQL are logged as likely N+1 problems.  Unsampled requests only
+pay for two clock reads, and are still logged when slow (total only).
+"""
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as backend
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+SLOWEST = 5          # queries kept per request for the slow log
+# transaction control: every atomic() block repeats these, they're no N+1
+TRANSACTION_CONTROL = re.compile(
+    r"\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|START\s+TRANSACTION|END)\b", re.I
+)
+
+_current = ContextVar("wiki_timing", default=None)
+
+
+def sample_rate():
+    return getattr(settings, "WIKI_TIMING_SAMPLE_RATE", 1.0)
+
+
+def slow_ms():
+    return getattr(settings, "WIKI_SLOW_REQUEST_MS", 1000)
+
+
+def repeated_limit():
+    return getattr(settings, "WIKI_REPEATED_QUERY_LIMIT", 5)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.db_in_templates = 0.0
+        self.rendering = 0               # template render depth
+        self.slowest = []                # (seconds, sql), longest first
+        self.statements = Counter()
+        self.spans = Counter()           # name -> seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        # a django.db execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db += elapsed
+            if self.rendering:
+                self.db_in_templates += elapsed
+            self.statements[sql] += 1
+            if len(self.slowest) < SLOWEST or elapsed > self.slowest[-1][0]:
+                self.slowest.append((elapsed, sql))
+                self.slowest.sort(key=lambda q: q[0], reverse=True)
+                del self.slowest[SLOWEST:]
+
+    @property
+    def templates(self):
+        return max(0.0, self.spans.get("tpl", 0.0) - self.db_in_templates)
+
+    def repeated(self):
+        limit = repeated_limit()
+        return [(count, sql) for sql, count in self.statements.most_common()
+                if count >= limit and not TRANSACTION_CONTROL.match(sql)]
+
+
+@contextmanager
+def span(name):
+    """Time a block of the current request under `name`; free when it isn't sampled."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.spans[name] += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        timings.rendering += 1
+        try:
+            with span("tpl"):
+                return super().render(context, request)
+        finally:
+            timings.rendering -= 1
+
+
+class DjangoTemplates(backend.DjangoTemplates):
+    """
+    The usual template backend, but each whole-template render counts
+    towards `tpl` ({% include %} and {% extends %} happen inside it).
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        if random.random() >= sample_rate():
+            response = self.get_response(request)
+            total = time.perf_counter() - started
+            if total * 1000 >= slow_ms():
+                self.log_slow(request, response, total, None)
+            return response
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        if getattr(settings, "WIKI_TIMING_HEADER", True):
+            response["Server-Timing"] = self.header(timings, total)
+        if total * 1000 >= slow_ms():
+            self.log_slow(request, response, total, timings)
+        repeated = timings.repeated()
+        if repeated:
+            logger.warning("Repeated queries (likely N+1) on %s %s: %s", request.method,
+                           request.path, json.dumps([{"count": c, "sql": s} for c, s in repeated]))
+        return response
+
+    def header(self, timings, total):
+        template = timings.templates
+        parts = [
+            f'db;dur={_ms(timings.db)};desc="{timings.queries} quer{"y" if timings.queries == 1 else "ies"}"',
+            f"tpl;dur={_ms(template)}",
+            f"app;dur={_ms(max(0.0, total - timings.db - template))}",
+        ]
+        parts += [f"{name};dur={_ms(s)}" for name, s in timings.spans.items() if name != "tpl"]
+        parts.append(f"total;dur={_ms(total)}")
+        return ", ".join(parts)
+
+    def log_slow(self, request, response, total, timings):
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": _ms(total),
+        }
+        if timings is not None:
+            record.update({
+                "queries": timings.queries,
+                "db_ms": _ms(timings.db),
+                "tpl_ms": _ms(timings.templates),
+                "spans_ms": {name: _ms(s) for name, s in timings.spans.items() if name != "tpl"},
+                "slowest": [{"ms": _ms(s), "sql": sql} for s, sql in timings.slowest],
+                "repeated": [{"count": c, "sql": sql} for c, sql in timings.repeated()],
+            })
+        logger.warning("Slow request %s", json.dumps(record), extra={"timing": record})
@@ -0,0 +1,364 @@
+# wiki/typeahead.py
+"""
+In-memory prefix index behind the search box's completions.
+
+One sorted list of strings per process, built on first use from page
+titles, category names and step headings (the first line of a step).
+Every entry is a normalized key (casefolded, accents stripped, spaces
+collapsed) followed by NUL and a reference:
+
+    "calibration of the probe\\0t12"     page 12, title starts with it
+    "probe\\0w12"                        page 12, a later word of the title
+    "weld inspection\\0c3"               category 3
+    "remove the wedge\\0s4711"           step 4711, heading starts with it
+
+so a completion is a bisect to the query plus a short scan.  Titles and
+category names are indexed at every word, step headings only at their
+start (there are ten times more steps than pages).
+
+Updates never touch the list readers hold: a writer builds a new one and
+swaps it in, so lookups take no lock.  Saves in this process are applied
+after commit via signals.py.  Saves in other processes are picked up by
+a background refresh, started by the first lookup WIKI_TYPEAHEAD_REFRESH
+seconds after the last one: it looks for pages whose updated_at moved
+(step changes move it too) and for pages that are gone.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Substr
+from django.urls import reverse
+from django.utils import timezone
+
+from . import oncommit
+
+logger = logging.getLogger(__name__)
+
+KEY_CHARS = 60          # keys are cut here; longer queries are cut to match
+HEADING_CHARS = 120     # of a step read to find its first line
+SCAN = 400              # matching entries looked at per query
+SMALL_CHANGE = 64       # up to this many entries: edit a copy, else merge
+REBUILD_AT = 2000       # changed pages from which a refresh rebuilds instead
+OVERLAP = timedelta(seconds=60)   # transactions committing late still get seen
+
+RANKS = {"t": 0, "c": 1, "w": 2, "s": 3}
+KINDS = {"t": "page", "w": "page", "c": "category", "s": "step"}
+
+
+def refresh_seconds():
+    return getattr(settings, "WIKI_TYPEAHEAD_REFRESH", 10)
+
+
+def index_steps():
+    return getattr(settings, "WIKI_TYPEAHEAD_STEPS", True)
+
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    if not text.isascii():
+        decomposed = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+
+def heading(content):
+    for line in content.splitlines():
+        line = line.strip()
+        if line:
+            return line
+    return ""
+
+
+def _word_keys(text, first, rest):
+    """A key from each word of `text` on: tagged `first` for the whole text, else `rest`."""
+    key = normalize(text)
+    starts = {m.start() for m in _WORD.finditer(key)} | {0}
+    return {f"{key[start:start + KEY_CHARS]}\0{rest if start else first}" for start in starts}
+
+
+def page_entries(pk, title):
+    return sorted(k + str(pk) for k in _word_keys(title, "t", "w")) if title else []
+
+
+def category_entries(pk, name):
+    return sorted(k + str(pk) for k in _word_keys(name, "c", "c")) if name else []
+
+
+def step_entry(pk, content):
+    key = normalize(heading(content))[:KEY_CHARS]
+    return f"{key}\0s{pk}" if key else None
+
+
+class _Snapshot:
+    """What readers see; never changed once published."""
+    __slots__ = ("entries", "pages", "categories")
+
+    def __init__(self, entries, pages, categories):
+        self.entries = entries          # sorted list of "key\0ref"
+        self.pages = pages              # pk -> (title, slug, step entries)
+        self.categories = categories    # pk -> (name, slug)
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.snapshot = None
+        self.lock = threading.Lock()    # writers only
+        self.checked = 0.0              # time.monotonic() of the last refresh
+        self.since = None               # refresh looks at pages updated after this
+
+    # ── reading ──────────────────────────────────────────────────
+    def complete(self, query, limit=8):
+        """Up to `limit` matches for `query`, as dicts for the JSON response."""
+        prefix = normalize(query)[:KEY_CHARS]
+        if not prefix:
+            return []
+        snapshot = self.current()
+        entries = snapshot.entries
+
+        seen, hits = set(), []
+        i = bisect_left(entries, prefix)
+        for entry in entries[i:i + SCAN]:
+            if not entry.startswith(prefix):
+                break
+            ref = entry.rpartition("\0")[2]
+            tag, pk = ref[0], int(ref[1:])
+            ident = (KINDS[tag], pk)
+            if ident not in seen:
+                seen.add(ident)
+                hits.append((RANKS[tag], tag, pk))
+        hits.sort(key=lambda h: h[0])       # stable: alphabetical within a rank
+        return self._describe(snapshot, hits[:limit])
+
+    def _describe(self, snapshot, hits):
+        steps = {}
+        wanted = [pk for _rank, tag, pk in hits if tag == "s"]
+        if wanted:
+            # step text is not kept in memory; one query for the few shown.
+            # guide_detail numbers its #step-N anchors by position, and
+            # step_order may have gaps, so count the steps up to each one
+            from .models import GuideStep
+            position = (
+                GuideStep.objects.filter(wiki_page_id=OuterRef("wiki_page_id"),
+                                         step_order__lte=OuterRef("step_order"))
+                .values("wiki_page_id").annotate(n=Count("pk")).values("n")
+            )
+            steps = {
+                pk: (page_id, number, head)
+                for pk, page_id, number, head in GuideStep.objects.filter(pk__in=wanted)
+                .annotate(head=Substr("step_content", 1, HEADING_CHARS), number=Subquery(position))
+                .values_list("pk", "wiki_page_id", "number", "head")
+            }
+
+        results = []
+        for _rank, tag, pk in hits:
+            if tag == "c":
+                if pk in snapshot.categories:
+                    name, slug = snapshot.categories[pk]
+                    results.append({"kind": "category", "label": name,
+                                    "url": reverse("wiki:category_detail", args=[slug])})
+            elif tag == "s":
+                if pk in steps and steps[pk][0] in snapshot.pages:
+                    page_id, number, head = steps[pk]
+                    title, slug, _ = snapshot.pages[page_id]
+                    url = reverse("wiki:page_detail", args=[slug])
+                    results.append({"kind": "step", "label": heading(head), "page": title,
+                                    "url": f"{url}#step-{number}"})
+            elif pk in snapshot.pages:
+                title, slug, _ = snapshot.pages[pk]
+                results.append({"kind": "page", "label": title,
+                                "url": reverse("wiki:page_detail", args=[slug])})
+        return results
+
+    def current(self):
+        """The snapshot to read; built on first use, refreshed in the background when due."""
+        if self.snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    self._build()
+        elif time.monotonic() - self.checked >= refresh_seconds():
+            # one refresh at a time; until it is done, answer from the old list
+            if self.lock.acquire(blocking=False):
+                self.checked = time.monotonic()
+                threading.Thread(target=self._refresh_in_background, name="typeahead-refresh",
+                                 daemon=True).start()
+        return self.snapshot
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception:
+            logger.exception("Refreshing the typeahead index failed")
+        finally:
+            self.lock.release()
+            connections.close_all()      # this thread's, it ends here
+
+    # ── building ─────────────────────────────────────────────────
+    def _build(self):
+        from .models import Category, WikiPage
+        started = timezone.now()
+        entries, pages = [], {}
+        for pk, title, slug in WikiPage.objects.values_list("pk", "title", "slug").iterator(chunk_size=5000):
+            pages[pk] = [title, slug, ()]
+            entries += page_entries(pk, title)
+        categories = {}
+        for pk, name, slug in Category.objects.values_list("pk", "name", "slug"):
+            categories[pk] = (name, slug)
+            entries += category_entries(pk, name)
+        for page_id, step_keys in self._step_entries(None):
+            if page_id in pages:
+                pages[page_id][2] = step_keys
+                entries += step_keys
+        entries.sort()
+        pages = {pk: tuple(value) for pk, value in pages.items()}
+        self.snapshot = _Snapshot(entries, pages, categories)
+        self.since = started - OVERLAP
+        self.checked = time.monotonic()
+
+    def _step_entries(self, page_ids):
+        """(page id, sorted step entries) for `page_ids`, or for every page."""
+        if not index_steps():
+            return []
+        from .models import GuideStep
+        steps = GuideStep.objects.annotate(head=Substr("step_content", 1, HEADING_CHARS))
+        if page_ids is not None:
+            steps = steps.filter(wiki_page_id__in=page_ids)
+        by_page = {}
+        for pk, page_id, head in steps.values_list("pk", "wiki_page_id", "head").iterator(chunk_size=5000):
+            entry = step_entry(pk, head)
+            if entry:
+                by_page.setdefault(page_id, []).append(entry)
+        return [(page_id, tuple(sorted(keys))) for page_id, keys in by_page.items()]
+
+    # ── updating ─────────────────────────────────────────────────
+    def _publish(self, old, remove, add, pages, categories):
+        remove, add = set(remove), set(add)
+        remove, add = remove - add, sorted(add - remove)     # unchanged entries stay
+        if len(remove) + len(add) <= SMALL_CHANGE:
+            entries = old.entries.copy()
+            for entry in remove:
+                i = bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+            for entry in add:
+                i = bisect_left(entries, entry)
+                if i == len(entries) or entries[i] != entry:
+                    entries.insert(i, entry)
+        else:
+            kept = (e for e in old.entries if e not in remove) if remove else old.entries
+            entries = []
+            for entry in heapq.merge(kept, add):
+                if not entries or entries[-1] != entry:
+                    entries.append(entry)
+        self.snapshot = _Snapshot(entries, pages, categories)
+
+    def _update_pages(self, page_ids):
+        from .models import WikiPage
+        old = self.snapshot
+        page_ids = set(page_ids)
+        pages = dict(old.pages)
+        remove, add = [], []
+        for pk in page_ids:
+            if pk in pages:
+                title, _slug, step_keys = pages.pop(pk)
+                remove += page_entries(pk, title)
+                remove += step_keys
+        for pk, title, slug in WikiPage.objects.filter(pk__in=page_ids).values_list("pk", "title", "slug"):
+            pages[pk] = (title, slug, ())
+            add += page_entries(pk, title)
+        for page_id, step_keys in self._step_entries(page_ids):
+            if page_id in pages:
+                title, slug, _ = pages[page_id]
+                pages[page_id] = (title, slug, step_keys)
+                add += step_keys
+        self._publish(old, remove, add, pages, old.categories)
+
+    def _remove_pages(self, page_ids):
+        old = self.snapshot
+        pages = dict(old.pages)
+        remove = []
+        for pk in page_ids:
+            if pk in pages:
+                title, _slug, step_keys = pages.pop(pk)
+                remove += page_entries(pk, title)
+                remove += step_keys
+        self._publish(old, remove, [], pages, old.categories)
+
+    def _update_categories(self):
+        from .models import Category
+        old = self.snapshot
+        categories = {pk: (name, slug) for pk, name, slug
+                      in Category.objects.values_list("pk", "name", "slug")}
+        if categories == old.categories:
+            return
+        remove = [e for pk, (name, _) in old.categories.items() for e in category_entries(pk, name)]
+        add = [e for pk, (name, _) in categories.items() for e in category_entries(pk, name)]
+        self._publish(old, remove, add, old.pages, categories)
+
+    def _refresh(self):
+        """Catch up with changes made by other processes."""
+        from .models import WikiPage
+        started = timezone.now()
+        changed = list(WikiPage.objects.filter(updated_at__gt=self.since).values_list("pk", flat=True))
+        if len(changed) >= REBUILD_AT:
+            self._build()
+            return
+        if changed:
+            self._update_pages(changed)
+        if WikiPage.objects.count() != len(self.snapshot.pages):
+            existing = set(WikiPage.objects.values_list("pk", flat=True))
+            self._remove_pages([pk for pk in self.snapshot.pages if pk not in existing])
+        self._update_categories()
+        self.since = started - OVERLAP
+        self.checked = time.monotonic()
+
+    def pages_changed(self, page_ids):
+        with self.lock:
+            if self.snapshot is not None:
+                self._update_pages(page_ids)
+
+    def pages_deleted(self, page_ids):
+        with self.lock:
+            if self.snapshot is not None:
+                self._remove_pages(page_ids)
+
+    def categories_changed(self):
+        with self.lock:
+            if self.snapshot is not None:
+                self._update_categories()
+
+
+_index = PrefixIndex()
+
+
+def complete(query, limit=8):
+    return _index.complete(query, limit)
+
+
+def update_on_commit(page_ids=(), deleted=(), categories=False):
+    """
+    Apply page saves / deletes and category changes to this process's index
+    once the current transaction commits, in one callback per transaction.
+    """
+    oncommit.defer("typeahead", _update, pages=page_ids, deleted=deleted,
+                   categories=[True] if categories else [])
+
+
+def _update(batch):
+    if batch["deleted"]:
+        _index.pages_deleted(batch["deleted"])
+    changed = batch["pages"] - batch["deleted"]
+    if changed:
+        _index.pages_changed(changed)
+    if batch["categories"]:
+        _index.categories_changed()
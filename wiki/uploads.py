@@ -0,0 +1,88 @@
+# wiki/uploads.py
+"""
+Size and page limits for guide imports.
+
+WIKI_IMPORT_MAX_BYTES caps the upload: a request whose Content-Length is
+already too large is turned away before its body is read, and
+SizeLimitUploadHandler stops reading a chunked upload as soon as it
+passes the limit.  Anything under the limit is spooled to disk by Django's
+usual handlers, never held in memory whole.
+
+WIKI_IMPORT_MAX_PAGES caps the page count.  The form checks it for PDFs
+from the spooled file; office documents are checked once converted.
+"""
+import fitz
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.template.defaultfilters import filesizeformat
+
+# multipart boundaries and the other form fields
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    pass
+
+
+def max_bytes():
+    return getattr(settings, "WIKI_IMPORT_MAX_BYTES", 200 * 1024 * 1024)
+
+
+def max_pages():
+    return getattr(settings, "WIKI_IMPORT_MAX_PAGES", 500)
+
+
+def too_large_message():
+    return f"The file is too large; the limit is {filesizeformat(max_bytes())}."
+
+
+def content_length_exceeded(request):
+    """True if the request says up front that it's over the limit."""
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return False
+    return length > max_bytes() + FORM_OVERHEAD
+
+
+def check_page_count(count):
+    if count > max_pages():
+        raise UploadRejected(
+            f"The document has {count} pages; the limit is {max_pages()}."
+        )
+
+
+def check_pdf(uploaded):
+    """Page-count check of an uploaded PDF, opened from disk when Django spooled it."""
+    if hasattr(uploaded, "temporary_file_path"):
+        doc = fitz.open(uploaded.temporary_file_path())
+    else:
+        # small uploads stay in memory (FILE_UPLOAD_MAX_MEMORY_SIZE)
+        doc = fitz.open(stream=uploaded.read(), filetype="pdf")
+        uploaded.seek(0)
+    try:
+        check_page_count(doc.page_count)
+    finally:
+        doc.close()
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """
+    Put first in request.upload_handlers: passes chunks on to the next
+    handler untouched, and stops the upload once it exceeds the limit.
+    The view finds the reason in request.upload_rejected.
+    """
+
+    def __init__(self, request=None, limit=None):
+        super().__init__(request)
+        self.limit = max_bytes() if limit is None else limit
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit:
+            self.request.upload_rejected = too_large_message()
+            # read and drop the rest of the body, so the client gets our answer
+            raise StopUpload(connection_reset=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
@@ -1,6 +1,6 @@
 # wiki/urls.py
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = "wiki"
 
@@ -8,6 +8,7 @@ urlpatterns = [
     path("", views.home, name="home"),
     path("category/<slug:cat_slug>/", views.category_detail, name="category_detail"),
     path("page/<slug:page_slug>/", views.page_detail, name="page_detail"),
+    path("page/<slug:page_slug>/history/", views.page_history, name="page_history"),
 
     # Create pages
     path("create/note/", views.note_create, name="note_create"),
@@ -16,6 +17,18 @@ urlpatterns = [
     # NEW: PDF import
     path("guide/import/", views.guide_import_upload,  name="guide_import_upload"),
     path("guide/import/preview/", views.guide_import_preview, name="guide_import_preview"),
+    path("guide/import/preview/steps/", views.guide_import_steps, name="guide_import_steps"),
+    path("guide/import/<int:job_id>/", views.guide_import_status, name="guide_import_status"),
+    path("guide/import/<int:job_id>/progress/", views.guide_import_progress, name="guide_import_progress"),
+    path("guide/import/<int:job_id>/retry/", views.guide_import_retry, name="guide_import_retry"),
+    path("guide/import/<int:job_id>/asset/<str:name>", views.guide_import_asset, name="guide_import_asset"),
 
     path("search/", views.search, name="search"),
+    path("search/suggest/", views.search_suggest, name="search_suggest"),
+
+    # Read-only JSON API (wiki/api.py)
+    path("api/v1/categories/", api.categories, name="api_categories"),
+    path("api/v1/pages/", api.pages, name="api_pages"),
+    path("api/v1/pages/<slug:page_slug>/", api.page, name="api_page"),
+    path("api/v1/pages/<slug:page_slug>/steps/", api.page_steps, name="api_page_steps"),
 ]
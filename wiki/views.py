@@ -1,42 +1,172 @@
 # wiki/views.py
 
+import hmac
 import io
+from functools import wraps
 from pathlib import Path
-from django.forms import modelformset_factory
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 
 from .models import Category, WikiPage, GuideStep
 from .forms import NoteForm, GuideForm, GuideStepFormSet
-from django.db.models import Q
+from .search import get_backend as get_search_backend
+from django.core.paginator import Paginator
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.views.static import serve
+from django.db.models import Count, Max, Q
+from . import cache as page_cache
+from .conditional import conditional, make_etag, request_stamp
+from . import pagination as keyset
+from . import metrics, revisions, typeahead
+from .steps import add_steps
+from django.db import transaction
+
+SEARCH_PAGE_SIZE = 20
+SUGGEST_LIMIT = 8
+HISTORY_PAGE_SIZE = 50
+CATEGORY_PAGE_SIZE = 24
+
+
+def serve_blob(request, path):
+    """
+    Development server for content-addressed media (wiki/storage.py).
+    A blob's bytes never change, so browsers may cache it forever.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
 
 
+def metrics_view(request):
+    """
+    Prometheus scrape target (wiki/metrics.py).  Behind the reverse proxy
+    every request comes from 127.0.0.1, so the address says nothing: the
+    scraper sends `Authorization: Bearer <WIKI_METRICS_TOKEN>`, people log
+    in as staff.
+    """
+    token = getattr(settings, "WIKI_METRICS_TOKEN", None)
+    sent = request.META.get("HTTP_AUTHORIZATION", "").removeprefix("Bearer ").strip()
+    allowed = bool(token and sent) and hmac.compare_digest(sent.encode(), token.encode())
+    if not (allowed or request.user.is_staff):
+        raise Http404()
+    return HttpResponse(metrics.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ──────────────────────────────────────────────────────────────
+#  Validators for conditional GET (wiki/conditional.py)
+# ──────────────────────────────────────────────────────────────
+def _home_stamp(request):
+    # the home page only lists categories: usually no query at all
+    return make_etag('home', page_cache.category_counts_digest()), None
+
+
+def _category_stamp(request, cat_slug):
+    category = page_cache.find_category(cat_slug)
+    if category is None:
+        return None
+    listed = WikiPage.objects.filter(category_id=category.pk).aggregate(
+        count=Count('pk'), last=Max('updated_at'),
+    )
+    # no Last-Modified: a deleted page wouldn't move it
+    etag = make_etag('category', category.pk, listed['count'], listed['last'],
+                     request.GET.get('guides'), request.GET.get('notes'))
+    return etag, None
+
+
+def _page_stamp(request, page_slug):
+    # (pk, updated_at, version); updated_at and version also move when a
+    # step, media file or link of the page changes
+    row = (
+        WikiPage.objects.filter(slug=page_slug)
+        .values_list('pk', 'updated_at', 'version')
+        .first()
+    )
+    if row is None:
+        return None
+    return make_etag('page', *row), row[1], row
+
+
+@conditional(_home_stamp, 'home')
 def home(request):
-    categories = Category.objects.all()
+    categories = page_cache.category_snapshot()
     return render(request, 'wiki/home.html', {
         'categories': categories,
     })
 
+@conditional(_category_stamp, 'category_detail')
 def category_detail(request, cat_slug):
-    category = get_object_or_404(Category, slug=cat_slug)
-    all_pages = category.pages.all()
+    # categories come from the cached snapshot, usually no query needed
+    category = page_cache.find_category(cat_slug)
+    if category is None:
+        raise Http404("No such category")
+
+    # Guides and notes page independently (?guides=<cursor>&notes=<cursor>).
+    # Both windows are resolved in ONE query: each IN-subquery is a LIMITed
+    # range scan on the (category, page_type, created_at) index.
+    cursors = {
+        WikiPage.GUIDE: request.GET.get('guides'),
+        WikiPage.NOTE: request.GET.get('notes'),
+    }
+
+    def window(page_type):
+        return (
+            WikiPage.objects
+            .filter(category_id=category.pk, page_type=page_type)
+            .filter(keyset.after(cursors[page_type]))
+            .order_by(*keyset.ordering())
+            .values('pk')[:CATEGORY_PAGE_SIZE + 1]
+        )
+
+    rows = (
+        WikiPage.objects
+        .filter(Q(pk__in=window(WikiPage.GUIDE)) | Q(pk__in=window(WikiPage.NOTE)))
+        .select_related('author')
+        .defer('content', 'html')       # the listing shows titles only
+        .order_by(*keyset.ordering())
+    )
+    split = {WikiPage.GUIDE: [], WikiPage.NOTE: []}
+    for page in rows:
+        split[page.page_type].append(page)
 
-    # Split into two groups
-    guides = all_pages.filter(page_type=WikiPage.GUIDE).order_by('-created_at')
-    notes = all_pages.filter(page_type=WikiPage.NOTE).order_by('-created_at')
+    guides_page = keyset.CursorPage.from_rows(
+        split[WikiPage.GUIDE], CATEGORY_PAGE_SIZE, cursors[WikiPage.GUIDE])
+    notes_page = keyset.CursorPage.from_rows(
+        split[WikiPage.NOTE], CATEGORY_PAGE_SIZE, cursors[WikiPage.NOTE])
 
     template_name = category.custom_template or 'wiki/category_detail.html'
     return render(request, template_name, {
         'category': category,
-        'guides': guides,
-        'notes': notes,
+        'guides': guides_page.items,
+        'notes': notes_page.items,
+        'guides_page': guides_page,
+        'notes_page': notes_page,
+        # the simple templates list everything shown, newest first
+        'pages': sorted(guides_page.items + notes_page.items,
+                        key=lambda p: (p.created_at, p.pk), reverse=True),
         'current_category': category,
     })
 
 
 # wiki/views.py
+@conditional(_page_stamp, 'page_detail')
 def page_detail(request, page_slug):
-    page = get_object_or_404(WikiPage, slug=page_slug)
+    # one cheap query for the validators (shared with the 304 check), then
+    # the rendered page comes from the cache without touching the database
+    stamp = request_stamp(request, _page_stamp, page_slug)
+    if stamp is None:
+        raise Http404("No such page")
+    key = page_cache.page_key(page_slug, *stamp[2])
+    html = cache.get(key)
+    metrics.PAGE_CACHE.inc(result='miss' if html is None else 'hit')
+    if html is not None:
+        return HttpResponse(page_cache.fill_category_options(html))
+
+    page = get_object_or_404(
+        WikiPage.objects.select_related('category', 'author'), slug=page_slug
+    )
     guide_steps = None
 
     if page.page_type == WikiPage.GUIDE:
@@ -45,10 +175,41 @@ def page_detail(request, page_slug):
     else:
         template_name = 'wiki/note_detail.html'
 
-    return render(request, template_name, {
+    html = render_to_string(template_name, {
         'page': page,
         'guide_steps': guide_steps,
         'current_category': page.category,
+        # page counts change far more often than the page: filled in per request
+        'category_options': page_cache.CATEGORY_OPTIONS_SLOT,
+    }, request)
+    if not getattr(request, 'derivatives_pending', False):
+        cache.set(key, html, page_cache.page_timeout())
+    return HttpResponse(page_cache.fill_category_options(html))
+
+
+def page_history(request, page_slug):
+    """List a page's revisions; ?a=…&b=… shows the diff between two of them."""
+    page = get_object_or_404(WikiPage.objects.select_related('category'), slug=page_slug)
+    history = page.revisions.select_related('author').defer('data').order_by('-number')
+    page_obj = Paginator(history, HISTORY_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    try:
+        a, b = int(request.GET['a']), int(request.GET['b'])
+    except (KeyError, ValueError):
+        a = b = diff = None
+    else:
+        a, b = min(a, b), max(a, b)
+        diff = revisions.diff(page.pk, a, b)
+        if diff is None:
+            raise Http404("No such revision")
+
+    return render(request, 'wiki/page_history.html', {
+        'page': page,
+        'page_obj': page_obj,
+        'current_category': page.category,
+        'a': a,
+        'b': b,
+        'diff': diff,
     })
 
 
@@ -86,13 +247,13 @@ def guide_create(request, cat_slug=None):
             if current_category:
                 guide_page.category = current_category
 
-            guide_page.save()
-
-            for step_form in guide_formset:
-                if step_form.cleaned_data and not step_form.cleaned_data.get('DELETE'):
-                    step = step_form.save(commit=False)
-                    step.wiki_page = guide_page
-                    step.save()
+            with transaction.atomic():
+                guide_page.save()
+                add_steps(guide_page, [
+                    step_form.save(commit=False)
+                    for step_form in guide_formset
+                    if step_form.cleaned_data and not step_form.cleaned_data.get('DELETE')
+                ])
 
             return redirect('wiki:page_detail', page_slug=guide_page.slug)
     else:
@@ -120,25 +281,42 @@ def search(request):
         except Category.DoesNotExist:
             pass
 
-    results = []
+    page_obj = None
     if query:
-        results = WikiPage.objects.filter(
-            Q(title__icontains=query) | Q(content__icontains=query)
-        )
+        # ranked hits from the full-text index, fetched one page at a time
+        with metrics.SEARCH.time():
+            paginator = Paginator(get_search_backend().results(query), SEARCH_PAGE_SIZE)
+            page_obj = paginator.get_page(request.GET.get('page'))
 
     return render(request, 'wiki/search_results.html', {
         'query': query,
-        'results': results,
+        'page_obj': page_obj,
+        'results': page_obj.object_list if page_obj else [],
         'current_category': current_cat,  # So breadcrumb can show "Home → Production → Search"
     })
 
+
+def search_suggest(request):
+    """
+    Completions for the search box as the user types, straight from the
+    in-memory prefix index (wiki/typeahead.py): no full-text query.
+    """
+    query = request.GET.get('q', '')[:200]
+    try:
+        limit = min(max(int(request.GET.get('limit', SUGGEST_LIMIT)), 1), 25)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    with metrics.SUGGEST.time():
+        results = typeahead.complete(query, limit)
+    return JsonResponse({'query': query, 'results': results})
+
 # keep all previous imports
 import base64, fitz, uuid
 from pathlib import Path
 from django.core.files.base import ContentFile
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
-from .forms import GuideForm, GuideStepForm, PDFImportForm, GuideStepFormSet
+from .forms import GuideForm, PDFImportForm, GuideStepFormSet
 from .models import WikiPage, GuideStep
 from django.utils.safestring import mark_safe
 
@@ -147,157 +325,310 @@ from django.utils.safestring import mark_safe
 # ------------------------------------------------------------
 # wiki/views.py (up at the top)
 
-import re, base64, fitz
+import re, base64, fitz, shutil, tempfile
 from pathlib import Path
+from .rasterize import render_page, render_pages, step_regions
+from .reimport import Fingerprinter, part_fingerprint
+from .uploads import check_page_count
 
-# how wide our thumbnails and full-res snapshots should be (px)
-THUMB_W = 240
-FULL_W  = 1024
+SPOOL_CHUNK = 1024 * 1024
 
-def _pdf_to_draft(file_obj):
+def _inline_png(data):
+    return base64.b64encode(data).decode()
+
+
+def _pdf_to_draft(file_obj, progress=None, save_image=_inline_png, name=None,
+                  parallel=True, thumbnails=True):
     """
-    Convert PDF (or PDF-stream) to a draft dict:
+    Convert PDF (a path on disk, or a PDF stream) to a draft dict:
       {
         "title": str,
         "intro": str,
         "steps": [
-          { "text": str, "thumb": base64-png, "full": base64-png },
+          { "text": str, "thumb": image-ref, "full": image-ref,
+            "page": int, "fingerprint": str },
           …
         ]
       }
 
+    Every rendered PNG goes through `save_image(png_bytes)`, whose return
+    value is the image-ref: base64 by default, an asset name when the
+    import job passes DraftStore.save (see wiki/drafts.py).
+
     - If doc.page_count > 1: one step per page.
     - If doc.page_count == 1 but text contains "1.", "2.", … at line-starts,
-      split on those numbers into multiple steps.
+      split on those numbers into multiple steps, each with an image cropped
+      to its own part of the page.
+
+    Pages are rendered once each (see wiki/rasterize.py), on a process pool
+    for longer documents unless `parallel` is False.  `progress(done, total)`
+    is called after every page, so a background job can report how far it
+    got.  With `thumbnails=False` only the full images are stored and
+    "thumb" is None (bulk imports have no preview).
+
+    "page" is the step's page number and "fingerprint" identifies what the
+    page looked like, so a later re-import can tell which pages changed
+    (see wiki/reimport.py).
     """
-    data = file_obj.read()
-    doc = fitz.open(stream=data, filetype="pdf")
-
-    name = getattr(file_obj, "name", "upload.pdf")
-    title = Path(name).stem.replace("_", " ").title()
-    intro = f"Imported from **{name}** ({doc.page_count} pages)."
-
-    steps = []
-
-    if doc.page_count == 1:
-        # single page: split out numbered list
-        page = doc[0]
-        text = page.get_text("text").strip()
-
-        # find all leading numbers "1.", "2.", …
-        headers = re.findall(r'(?m)^\s*(\d+)\.\s*', text)
-        parts   = re.split  (r'(?m)^\s*\d+\.\s*', text)[1:]  # drop before "1."
-
-        # render thumbnail once
-        zoom  = THUMB_W / page.rect.width
-        mat   = fitz.Matrix(zoom, zoom)
-        pix   = page.get_pixmap(matrix=mat, colorspace=fitz.csRGB)
-        thumb = base64.b64encode(pix.tobytes("png")).decode()
-
-        # for each sub-step, generate its full-res
-        for header, body in zip(headers, parts):
-            # full-res for that step
-            zoom2 = FULL_W / page.rect.width
-            mat2  = fitz.Matrix(zoom2, zoom2)
-            pix2  = page.get_pixmap(matrix=mat2, colorspace=fitz.csRGB)
-            full  = base64.b64encode(pix2.tobytes("png")).decode()
-
-            steps.append({
-                "text": body.strip(),
-                "thumb": thumb,
-                "full":  full,
-            })
+    if not isinstance(file_obj, (str, Path)):
+        # spool streams to disk in chunks: MuPDF then reads pages from the
+        # file on demand instead of holding the whole upload in memory
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            shutil.copyfileobj(file_obj, tmp, SPOOL_CHUNK)
+            tmp.flush()
+            return _pdf_to_draft(
+                tmp.name, progress=progress, save_image=save_image,
+                name=name or Path(getattr(file_obj, "name", "upload.pdf")).name,
+                parallel=parallel, thumbnails=thumbnails,
+            )
 
-    else:
-        # multi-page: one step per page
-        for page in doc:
-            text = page.get_text("text").strip()
-            if not text:
-                continue
+    # the path is handed to the render workers as is
+    data = str(file_obj)
+    name = name or Path(file_obj).name
+    with metrics.PDF_OPEN.time():
+        doc = fitz.open(data)
+    save_image = _timed_store(save_image)
+    try:
+        check_page_count(doc.page_count)
+        title = Path(name).stem.replace("_", " ").title()
+        intro = f"Imported from **{name}** ({doc.page_count} pages)."
+
+        steps = []
+        fingerprints = Fingerprinter(doc)
+
+        if doc.page_count == 1:
+            # single page: split out numbered list
+            page = doc[0]
+            with metrics.TEXT.time():
+                text = page.get_text("text").strip()
+            fingerprint = fingerprints.page(page, text)
+
+            # find all leading numbers "1.", "2.", …
+            headers = re.findall(r'(?m)^\s*(\d+)\.\s*', text)
+            parts   = re.split  (r'(?m)^\s*\d+\.\s*', text)[1:]  # drop before "1."
+
+            # whole page as fallback for steps we can't locate on the page
+            page_images = None
+
+            for index, (body, region) in enumerate(zip(parts, step_regions(page, headers))):
+                if region is not None:
+                    thumb, full = render_page(page, clip=region)
+                else:
+                    page_images = page_images or render_page(page)
+                    thumb, full = page_images
+
+                steps.append({
+                    "text": body.strip(),
+                    "thumb": save_image(thumb) if thumbnails else None,
+                    "full":  save_image(full),
+                    "page": 1,
+                    "fingerprint": part_fingerprint(fingerprint, index, body.strip()),
+                })
+
+            if progress:
+                progress(1, 1)
+
+        else:
+            # multi-page: one step per page; text first (cheap), so blank
+            # pages are never rendered
+            with metrics.TEXT.time():
+                texts = {n: doc[n].get_text("text").strip() for n in range(doc.page_count)}
+            wanted = [n for n, text in texts.items() if text]
+            skipped = doc.page_count - len(wanted)
+
+            def report(done):
+                if progress:
+                    progress(skipped + done, doc.page_count)
+
+            report(0)
+            for n, thumb, full in render_pages(data, wanted, progress=report, parallel=parallel):
+                steps.append({
+                    "text": texts[n],
+                    "thumb": save_image(thumb) if thumbnails else None,
+                    "full":  save_image(full),
+                    "page": n + 1,
+                    "fingerprint": fingerprints.page(doc[n], texts[n]),
+                })
+
+        metrics.IMPORT_PAGES.inc(doc.page_count)
+        return {"title": title, "intro": intro, "steps": steps}
+    finally:
+        doc.close()
+
+
+def _timed_store(save_image):
+    def save(png):
+        with metrics.IMAGE_STORE.time():
+            return save_image(png)
+    return save
 
-            # thumbnail
-            zoom  = THUMB_W / page.rect.width
-            mat   = fitz.Matrix(zoom, zoom)
-            pix   = page.get_pixmap(matrix=mat, colorspace=fitz.csRGB)
-            thumb = base64.b64encode(pix.tobytes("png")).decode()
 
-            # full-res
-            zoom2 = FULL_W / page.rect.width
-            mat2  = fitz.Matrix(zoom2, zoom2)
-            pix2  = page.get_pixmap(matrix=mat2, colorspace=fitz.csRGB)
-            full  = base64.b64encode(pix2.tobytes("png")).decode()
+from pathlib import Path
+import io
+from django.shortcuts import render, redirect
+from django.contrib.auth.decorators import login_required
+from django.core.files import File
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+from .forms import PDFImportForm, GuideForm, GuideStepFormSet
+from .models import ImportJob
+from . import uploads
+from .drafts import DraftStore
+from . import jobs, reimport
 
-            steps.append({
-                "text": text,
-                "thumb": thumb,
-                "full":  full,
-            })
+@csrf_exempt
+@login_required
+def guide_import_upload(request):
+    # The CSRF check reads the request body, so it only runs (below) once
+    # the size limit is in place: oversized uploads are refused before
+    # they are read, or as soon as they pass the limit.
+    if request.method == "POST":
+        if uploads.content_length_exceeded(request):
+            return _upload_rejected(request, uploads.too_large_message())
+        request.upload_handlers.insert(0, uploads.SizeLimitUploadHandler(request))
+    return _guide_import_upload(request)
 
-    return {"title": title, "intro": intro, "steps": steps}
 
+def _size_limited(rejected):
+    """
+    For the preview's POSTs, which may carry replacement step images: the
+    same limit as guide_import_upload, in place before the CSRF check reads
+    the body.  `rejected(request, message)` answers uploads over it.
+    """
+    def decorate(view):
+        @csrf_protect
+        def checked(request, *args, **kwargs):
+            message = getattr(request, "upload_rejected", None)
+            if message:
+                return rejected(request, message)
+            return view(request, *args, **kwargs)
+
+        @csrf_exempt
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == "POST":
+                if uploads.content_length_exceeded(request):
+                    return rejected(request, uploads.too_large_message())
+                request.upload_handlers.insert(0, uploads.SizeLimitUploadHandler(request))
+            return checked(request, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _upload_rejected(request, message, form=None):
+    if _wants_json(request):
+        return JsonResponse({"error": message}, status=413)
+    if form is None:
+        form = PDFImportForm()
+    # replaces "this field is required" when the upload was cut short
+    form.errors["file"] = form.error_class([message])
+    return render(request, "wiki/guide_import_upload.html", {
+        "form": form,
+        "into": _reimport_target(request),
+    }, status=413)
 
-import subprocess
-import tempfile
-from pathlib import Path
-from django.core.files.uploadedfile import InMemoryUploadedFile
 
-def _odt_to_pdf(uploaded_odt):
-    # write the uploaded .odt to a temp file
-    odt_fd, odt_path = tempfile.mkstemp(suffix=".odt")
-    with open(odt_path, "wb") as f:
-        for chunk in uploaded_odt.chunks():
-            f.write(chunk)
+@csrf_protect
+def _guide_import_upload(request):
+    if request.method == "POST":
+        form = PDFImportForm(request.POST, request.FILES)
+        rejected = getattr(request, "upload_rejected", None)
+        if rejected:
+            return _upload_rejected(request, rejected, form)
+        if form.is_valid():
+            # conversion happens in the background (wiki/jobs.py);
+            # we only store the upload and hand back the job id
+            job = jobs.enqueue(
+                request.FILES["file"],
+                user=request.user,
+                category=form.cleaned_data["category"],
+                target=form.cleaned_data["into"],
+            )
+            request.session["import_job"]      = job.pk
+            request.session["import_category"] = job.category_id
+
+            if _wants_json(request):
+                return JsonResponse(_job_status(job), status=202)
+            return redirect("wiki:guide_import_status", job_id=job.pk)
+        if _wants_json(request):
+            errors = [e for field in form.errors.values() for e in field]
+            return JsonResponse({"error": " ".join(errors)}, status=400)
+    else:
+        form = PDFImportForm(initial={"into": request.GET.get("into")})
+    return render(request, "wiki/guide_import_upload.html", {
+        "form": form,
+        "into": _reimport_target(request),
+    })
 
-    # convert to PDF next to it
-    pdf_path = Path(odt_path).with_suffix(".pdf")
-    subprocess.run([
-        "soffice", "--headless", "--convert-to", "pdf", "--outdir",
-        str(pdf_path.parent), odt_path
-    ], check=True)
 
-    # read the PDF back in as a Django file-like object
-    with open(pdf_path, "rb") as f:
-        pdf_data = f.read()
+def _reimport_target(request):
+    # the guide a "Re-import" link points the upload form at, for the
+    # heading; the form posts back to the same URL, so it's always in GET
+    # (and reading POST here would read a body we're refusing)
+    slug = request.GET.get("into")
+    return slug and WikiPage.objects.filter(slug=slug, page_type=WikiPage.GUIDE).first()
 
-    # clean up
-    Path(odt_path).unlink()
-    pdf_path.unlink()
 
-    # wrap in a Django InMemoryUploadedFile if you need
-    return io.BytesIO(pdf_data)
+def _wants_json(request):
+    return "application/json" in request.headers.get("Accept", "")
 
 
-from pathlib import Path
-import io
-from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
-from .forms import PDFImportForm, GuideForm, GuideStepFormSet
-from .views import _pdf_to_draft, _odt_to_pdf
+def _job_status(job):
+    return {
+        "job":         job.pk,
+        "status":      job.status,
+        "pages_done":  job.pages_done,
+        "pages_total": job.pages_total,
+        "percent":     job.percent,
+        "error":       job.error.strip().splitlines()[-1] if job.error else "",
+        "progress_url": reverse("wiki:guide_import_progress", args=[job.pk]),
+        "preview_url":  reverse("wiki:guide_import_preview") if job.status == ImportJob.DONE else None,
+    }
+
 
 @login_required
-def guide_import_upload(request):
-    if request.method == "POST":
-        form = PDFImportForm(request.POST, request.FILES)
-        if form.is_valid():
-            uploaded = request.FILES["file"]
-
-            # If .odt, convert it to a PDF in-memory
-            if uploaded.name.lower().endswith(".odt"):
-                pdf_stream = _odt_to_pdf(uploaded)
-                # Give it a .name so _pdf_to_draft can infer a title
-                pdf_stream.name = Path(uploaded.name).with_suffix(".pdf").name
-                draft = _pdf_to_draft(pdf_stream)
-            else:
-                # Already a PDF; file_obj has .name by default
-                draft = _pdf_to_draft(uploaded)
+def guide_import_status(request, job_id):
+    """Progress page shown while the worker converts the upload."""
+    job = get_object_or_404(ImportJob, pk=job_id, user=request.user)
+    jobs.ensure_workers()   # picks up queued jobs after a restart
+    request.session["import_job"] = job.pk
+    if job.status == ImportJob.DONE:
+        return redirect("wiki:guide_import_preview")
+    return render(request, "wiki/guide_import_status.html", {
+        "job":    job,
+        "status": _job_status(job),
+    })
+
+
+@login_required
+def guide_import_progress(request, job_id):
+    """JSON polled by the status page."""
+    job = get_object_or_404(ImportJob, pk=job_id, user=request.user)
+    jobs.ensure_workers()
+    return JsonResponse(_job_status(job))
 
-            request.session["import_draft"]    = draft
-            cat = form.cleaned_data["category"]
-            request.session["import_category"] = cat.id if cat else None
-            return redirect("wiki:guide_import_preview")
-    else:
-        form = PDFImportForm()
-    return render(request, "wiki/guide_import_upload.html", {"form": form})
+
+@login_required
+def guide_import_asset(request, job_id, name):
+    """Stream one rendered image of a draft (thumbnails in the preview)."""
+    job = get_object_or_404(ImportJob, pk=job_id, user=request.user)
+    store = DraftStore(job.pk)
+    if not store.exists(name):
+        raise Http404("No such draft image")
+    response = FileResponse(store.open(name), content_type="image/png")
+    # the name is a content hash, so the bytes behind a URL never change
+    response["Cache-Control"] = "private, max-age=86400, immutable"
+    return response
+
+
+@login_required
+@require_POST
+def guide_import_retry(request, job_id):
+    job = get_object_or_404(ImportJob, pk=job_id, user=request.user)
+    jobs.retry(job)
+    return redirect("wiki:guide_import_status", job_id=job.pk)
 
 
 
@@ -305,76 +636,88 @@ def guide_import_upload(request):
 # ✂ ------------------------------------------------------------------
 # 2)  PREVIEW  /wiki/guide/import/preview/
 # --------------------------------------------------------------------
+PREVIEW_CHUNK = 20     # step cards per request
+
+
+def _preview_rejected(request, message):
+    if _wants_json(request):
+        return JsonResponse({"error": message}, status=413)
+    # shown once by the preview we send them back to
+    request.session["import_error"] = message
+    return redirect("wiki:guide_import_preview")
+
+
+def _steps_rejected(request, message):
+    return JsonResponse({"error": message}, status=413)
+
+
 @login_required
+@_size_limited(_preview_rejected)
 def guide_import_preview(request):
-    draft = request.session.get("import_draft")
-    if not draft:
+    job = ImportJob.objects.filter(
+        pk=request.session.get("import_job"), user=request.user
+    ).first()
+    if job is None:
         return redirect("wiki:guide_import_upload")
+    if job.status != ImportJob.DONE:
+        return redirect("wiki:guide_import_status", job_id=job.pk)
+    draft = job.draft
+    store = DraftStore(job.pk)
+    if draft.get("reimport"):
+        return _reimport_preview(request, job)
 
-    pages = []
-    for s in draft["steps"]:
-        img_file = None
-        img_tag  = ""
-        if s["thumb"]:
-            # thumbnail for preview
-            img_tag = mark_safe(
-              f'<img src="data:image/png;base64,{s["thumb"]}" '
-              'class="img-thumbnail d-block mb-2" style="max-width:220px">'
-            )
-        if s["full"]:
-            # full-res for saving later
-            full_bytes = base64.b64decode(s["full"])
-            img_name   = f"import_{uuid.uuid4().hex}.png"
-            img_file   = ContentFile(full_bytes, name=img_name)
-
-        pages.append({
-            "text": s["text"],
-            "file": img_file,    # full-res here
-            "tag":  img_tag,     # thumb here
-        })
-
-    # ── one empty form per PDF page  ────────────────────────────────
-    StepFormSet = modelformset_factory(
-        GuideStep,
-        form       = GuideStepForm,
-        extra      = len(pages),     # ← key point!
-        can_delete = True,
-    )
-
-    # ---------------------------------------------------- POST (Save guide)
     if request.method == "POST":
-        guide_form = GuideForm(request.POST, request.FILES)
-        formset    = StepFormSet(request.POST, request.FILES,
-                                 queryset=GuideStep.objects.none())
+        # edits on the chunk of steps on screen (the page's own JS saves
+        # them as you type and leaves them out of this POST)
+        job = _save_step_edits(job, request.POST, request.FILES)
+        draft = job.draft
+        if "start" in request.POST:
+            # "more steps" without JavaScript: save, then show the next chunk
+            return redirect(f"{reverse('wiki:guide_import_preview')}?start={_chunk_start(request.POST, draft)}")
 
-        if guide_form.is_valid() and formset.is_valid():
+        guide_form = GuideForm(request.POST, request.FILES)
+        if guide_form.is_valid():
             guide = guide_form.save(commit=False)
             guide.author, guide.page_type = request.user, WikiPage.GUIDE
-            guide.save()
 
-            order = 1
-            for f, p in zip(formset.forms, pages):
-                cd = f.cleaned_data
-                if not cd or cd.get("DELETE"):
+            new_steps = []
+            as_imported = []     # steps nobody changed in the preview
+            for s in draft["steps"]:
+                if s.get("omit"):
                     continue
 
                 # pick the file: user upload wins, otherwise our preview file
-                upload = cd.get("file")
-                the_file = upload if upload else p["file"]
+                if s.get("upload"):
+                    the_file = File(store.open(s["upload"]), name=s["upload_name"])
+                elif s["full"]:
+                    the_file = File(store.open(s["full"]),
+                                    name=f"import_{Path(s['full']).stem}.png")
+                else:
+                    the_file = None
 
                 # pick the text: user override (if any), otherwise the PDF text
-                text = cd.get("step_content") or p["text"]
-
-                step = GuideStep(
-                    wiki_page  = guide,
-                    step_content = text,
-                    file       = the_file,
-                    step_order = order,
-                )
-                step.save()
-                order += 1
-
-            request.session.pop("import_draft", None)  # done
+                text = s.get("edit") or s["text"]
+
+                step = GuideStep(step_content=text, file=the_file, source_page=s.get("page"),
+                                 fingerprint=s.get("fingerprint", ""))
+                new_steps.append(step)
+                if not s.get("upload") and text == s["text"]:
+                    as_imported.append(step)
+
+            try:
+                with metrics.STEP_SAVE.time(source='preview'), transaction.atomic():
+                    guide.save()
+                    add_steps(guide, new_steps)
+                    reimport.stamp(as_imported)
+            finally:
+                for step in new_steps:
+                    if step.file:
+                        step.file.close()
+
+            request.session.pop("import_job", None)  # done
+            store.discard()
+            job.source.delete(save=False)
+            job.delete()
             return redirect("wiki:page_detail", page_slug=guide.slug)
 
     # ---------------------------------------------------- GET (preview)
@@ -385,32 +728,152 @@ def guide_import_preview(request):
             "category": request.session.get("import_category"),
         })
 
-        # build initial list **before** constructing the form‑set
+    # only one chunk of step cards; the rest load as the user scrolls
+    start = _chunk_start(request.GET, draft)
+    return render(request, "wiki/guide_import_preview.html", {
+        "form":       guide_form,   # guide header
+        "error":      request.session.pop("import_error", None),
+        "draft_name": draft["title"],
+        "start":      start,
+        "previous":   max(start - PREVIEW_CHUNK, 0) if start else None,
+        **_preview_cards(job, start),
+    })
 
-        # 1) build the initial data list
-        initial_steps = [{"step_content": page["text"]} for page in pages]
 
-        # 2) instantiate your formset with that initial list
-        formset = StepFormSet(
-            queryset=GuideStep.objects.none(),
-            initial = initial_steps,
-        )
+@login_required
+@_size_limited(_steps_rejected)
+def guide_import_steps(request):
+    """
+    One chunk of the preview's step cards (?start=N), fetched as the user
+    scrolls; a POST stores the edits made on some cards in the draft, so
+    big drafts never need one giant form.
+    """
+    job = ImportJob.objects.filter(
+        pk=request.session.get("import_job"), user=request.user, status=ImportJob.DONE
+    ).first()
+    if job is None or job.draft.get("reimport"):
+        raise Http404("No import to preview")
+    if request.method == "POST":
+        _save_step_edits(job, request.POST, request.FILES)
+        return JsonResponse({"saved": True})
+    return render(request, "wiki/guide_import_steps.html",
+                  _preview_cards(job, _chunk_start(request.GET, job.draft)))
+
+
+def _chunk_start(params, draft):
+    try:
+        start = int(params.get("start", 0))
+    except ValueError:
+        start = 0
+    return min(max(start, 0), max(len(draft["steps"]) - 1, 0))
+
+
+def _preview_cards(job, start):
+    """Template context for the step cards start … start + PREVIEW_CHUNK."""
+    steps = job.draft["steps"]
+    cards = []
+    for i in range(start, min(start + PREVIEW_CHUNK, len(steps))):
+        s = steps[i]
+        cards.append({
+            "index":  i,
+            "text":   s.get("edit") or s["text"],
+            "omit":   s.get("omit", False),
+            "upload": s.get("upload_name"),
+            # streamed from the draft store, cacheable: never inlined
+            "thumb":  s["thumb"] and reverse("wiki:guide_import_asset", args=[job.pk, s["thumb"]]),
+        })
+    end = start + len(cards)
+    return {"cards": cards, "total": len(steps), "next": end if end < len(steps) else None}
 
-        # 3) now actually assign both the field‐initial **and** the thumbnail HTML
-        for form, page in zip(formset.forms, pages):
-            form.fields['step_content'].initial = page["text"]
-            form.img_preview = page["tag"]
 
+def _save_step_edits(job, data, files):
+    """
+    Store the edits of the step cards in a POST on the draft and return the
+    job as updated.  Every card sends "step-<i>-seen", so an unticked
+    "leave out" box is told apart from a card that wasn't sent.
+    """
+    indexes = sorted({int(m.group(1)) for key in data
+                      if (m := re.fullmatch(r"step-(\d+)-seen", key))})
+    if not indexes:
+        return job
+    store = DraftStore(job.pk)
+    with transaction.atomic():
+        # chunks may be saved while another one is still on its way
+        job = ImportJob.objects.select_for_update().get(pk=job.pk)
+        steps = job.draft["steps"]
+        for i in indexes:
+            if i >= len(steps):
+                continue
+            step = steps[i]
+            # browsers send textareas with \r\n line ends
+            text = data.get(f"step-{i}-text", "").replace("\r\n", "\n")
+            if text.strip() and text != step["text"]:
+                step["edit"] = text
+            else:
+                step.pop("edit", None)      # emptied: back to the PDF text
+            if f"step-{i}-omit" in data:
+                step["omit"] = True
+            else:
+                step.pop("omit", None)
+            upload = files.get(f"step-{i}-file")
+            if upload:
+                # kept with the draft's images until the guide is saved
+                step["upload"] = store.save(upload)
+                step["upload_name"] = Path(upload.name).name
+        job.save(update_fields=["draft", "updated_at"])
+    return job
+
+def _reimport_preview(request, job):
+    """
+    What re-importing the file would change in its guide (wiki/reimport.py);
+    a POST applies it.  The guide is compared again on every request, so
+    the report never goes stale.
+    """
+    guide, draft, store = job.target, job.draft, DraftStore(job.pk)
+    units = draft["units"]
+    applied, error = None, None
 
+    if request.method == "POST":
+        # new pages left unticked are remembered as left out; ticked ones
+        # (also those left out last time) go in
+        changes = reimport.diff(reimport.current_steps(guide), units, guide.dismissed_pages)
+        offered = {units[j]["fingerprint"] for j in reimport.optional(changes)}
+        ticked = set(request.POST.getlist("add"))
+        dismissed = (set(guide.dismissed_pages) - offered) | (offered - ticked)
+        try:
+            applied = reimport.apply(guide, draft, lambda ref: File(
+                store.open(ref), name=f"import_{Path(ref).stem}.png"), dismissed=dismissed)
+        except reimport.ReimportError as exc:
+            error = str(exc)
+        else:
+            request.session.pop("import_job", None)  # done
+            store.discard()
+            job.source.delete(save=False)
+            job.delete()
+
+    if applied is not None:
+        summary, new_pages = applied, []
+    else:
+        changes = reimport.diff(reimport.current_steps(guide), units, guide.dismissed_pages)
+        summary = reimport.report(changes, units)
+        if any(units[j]["full"] is None for j in reimport.rendered(changes)):
+            error = error or ("The guide changed since the file was uploaded; "
+                              "upload it again to re-import.")
+        new_pages = [
+            {"page": units[j]["page"], "text": units[j]["text"], "action": action,
+             "fingerprint": units[j]["fingerprint"],
+             "thumb": units[j]["thumb"] and reverse("wiki:guide_import_asset",
+                                                    args=[job.pk, units[j]["thumb"]])}
+            for action, _step, j in changes if action in ("changed", "added", "dismissed")
+        ]
 
-    # render
-    return render(
-        request,
-        "wiki/guide_import_preview.html",
-        {
-            "form":          guide_form,   # guide header
-            "guide_formset": formset,      # steps (template expects this name)
-            "draft_name":    draft["title"]
-        },
-    )
+    return render(request, "wiki/guide_reimport_preview.html", {
+        "guide":     guide,
+        "job":       job,
+        "source":    draft["source"],
+        "report":    summary,
+        "new_pages": new_pages,
+        "applied":   applied is not None,
+        "error":     error,
+    })
 